@@ -0,0 +1,85 @@
+"""Fixtures for benchmarks of labslauncher against fake servers."""
+import os
+
+import pytest
+
+from fakes import FakeEngine, FakeHub
+
+pytest.importorskip("pytest_benchmark")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+IMAGE = "ontresearch/nanolabs-notebook"
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    """Return a Qt application, required for DockerClient timers."""
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication.instance()
+    if app is None:
+        app = QCoreApplication([])
+    return app
+
+
+@pytest.fixture
+def engine_factory(monkeypatch):
+    """Return a function to start fake Docker Engines.
+
+    The environment is pointed at the most recently started engine.
+    """
+    engines = list()
+
+    def factory(**kwargs):
+        engine = FakeEngine(**kwargs).start()
+        engines.append(engine)
+        monkeypatch.setenv("DOCKER_HOST", engine.base_url)
+        return engine
+
+    yield factory
+    for engine in engines:
+        engine.stop()
+
+
+@pytest.fixture
+def hub_factory(monkeypatch):
+    """Return a function to start fake Docker Hubs.
+
+    `dockerutil` is pointed at the most recently started hub and its tag
+    caches are cleared.
+    """
+    from labslauncher import dockerutil
+    hubs = list()
+
+    def factory(**kwargs):
+        hub = FakeHub(**kwargs).start()
+        hubs.append(hub)
+        monkeypatch.setattr(dockerutil, "HUB_URL", hub.base_url)
+        dockerutil.clear_tag_cache()
+        return hub
+
+    yield factory
+    for hub in hubs:
+        hub.stop()
+    dockerutil.clear_tag_cache()
+
+
+@pytest.fixture
+def client_factory(qapp):
+    """Return a function creating a DockerClient.
+
+    Start the fake servers with `engine_factory` and `hub_factory` first.
+    """
+    from labslauncher.dockerutil import DockerClient
+    clients = list()
+
+    def factory():
+        client = DockerClient(
+            IMAGE, "Epi2Me-Labs-Server", "/epi2melabs/",
+            "start-notebook.sh", host_only=True)
+        client.heartbeat.stop()
+        clients.append(client)
+        return client
+
+    yield factory
+    for client in clients:
+        client.heartbeat.stop()
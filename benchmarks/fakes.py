@@ -0,0 +1,512 @@
+"""Local stand-ins for Docker, Docker Hub, registry and notebook APIs."""
+import hashlib
+import http.server
+import json
+import os
+import re
+import socketserver
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Dispatch requests to the owning server's routes."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        """Silence per-request logging."""
+        pass
+
+    def address_string(self):
+        """Return a client address, unix sockets have none."""
+        return "local"
+
+    def _dispatch(self):
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        fake = self.server.fake
+        with fake.lock:
+            fake.requests += 1
+        if fake.latency > 0:
+            time.sleep(fake.latency)
+        for method, pattern, func in fake.routes:
+            if method != self.command:
+                continue
+            match = re.match(
+                "^{}{}$".format(fake.prefix, pattern), parts.path)
+            if match is not None:
+                func(self, query, *match.groups())
+                return
+        self.send_json({"message": "page not found"}, status=404)
+
+    do_GET = _dispatch
+    do_POST = _dispatch
+    do_DELETE = _dispatch
+    do_HEAD = _dispatch
+
+    def send_json(self, data, status=200):
+        """Send a JSON response."""
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunked(self, lines):
+        """Send a chunked response, one chunk per line of JSON."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for line in lines:
+            data = "{}\r\n".format(json.dumps(line)).encode()
+            self.wfile.write(
+                "{:x}\r\n".format(len(data)).encode() + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _FakeServer():
+    """Common server lifecycle, usable as a context manager."""
+
+    def __init__(self, latency=0.0):
+        """Initialize the server.
+
+        :param latency: delay (s) added to every request.
+        """
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.routes = list()
+        self.prefix = ""
+        self.server = None
+
+    def _create(self):
+        raise NotImplementedError
+
+    def start(self):
+        """Start serving in a background thread."""
+        self.server = self._create()
+        self.server.fake = self
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        """Start the server."""
+        return self.start()
+
+    def __exit__(self, *args):
+        """Stop the server."""
+        self.stop()
+
+
+class FakeEngine(_FakeServer):
+    """Mimic the subset of the Docker Engine API used by the launcher.
+
+    The server listens on a unix socket, or on localhost as a second
+    docker daemon reached over tcp, use `base_url` as `DOCKER_HOST`.
+    """
+
+    def __init__(
+            self, containers=1, images=(), server_name="Epi2Me-Labs-Server",
+            pull_layers=10, pull_steps=100, layer_size=50 * 1024 * 1024,
+            latency=0.0, tcp=False, arch="x86_64"):
+        """Initialize the engine.
+
+        :param containers: number of containers, the last of which is
+            named `server_name`.
+        :param images: image references ("name:tag") present locally.
+        :param server_name: the name of the server container.
+        :param pull_layers: number of layers in a pulled image.
+        :param pull_steps: number of progress messages per layer.
+        :param layer_size: size of each layer (bytes).
+        :param latency: delay (s) added to every request.
+        :param tcp: listen on localhost rather than a unix socket.
+        :param arch: the architecture of the host, as `uname -m`.
+        """
+        super().__init__(latency=latency)
+        self.tcp = tcp
+        self.arch = arch
+        self.tmpdir = tempfile.mkdtemp(prefix="fake-docker-")
+        self.socket = os.path.join(self.tmpdir, "docker.sock")
+        self.images = set(images)
+        self.pull_layers = pull_layers
+        self.pull_steps = pull_steps
+        self.layer_size = layer_size
+        self.containers = list()
+        for i in range(containers):
+            name = "container-{}".format(i)
+            if i == containers - 1:
+                name = server_name
+            self.containers.append(self._container(i, name))
+        self.routes = [
+            ("GET", r"/_ping", self._ping),
+            ("HEAD", r"/_ping", self._ping),
+            ("GET", r"/version", self._version),
+            ("GET", r"/info", self._info),
+            ("GET", r"/containers/json", self._containers),
+            ("GET", r"/containers/([^/]+)/json", self._inspect),
+            ("GET", r"/containers/([^/]+)/stats", self._stats),
+            ("GET", r"/images/(.+)/json", self._image),
+            ("POST", r"/images/create", self._pull)]
+        # requests may be prefixed with the API version
+        self.prefix = r"(?:/v[0-9.]+)?"
+
+    def _create(self):
+        if self.tcp:
+            return _TCPHTTPServer(("127.0.0.1", 0), _Handler)
+        return _UnixHTTPServer(self.socket, _Handler)
+
+    @property
+    def base_url(self):
+        """Return the address of the engine."""
+        if self.tcp:
+            host, port = self.server.server_address
+            return "tcp://{}:{}".format(host, port)
+        return "unix://{}".format(self.socket)
+
+    def stop(self):
+        """Stop serving and remove the socket."""
+        super().stop()
+        if not self.tcp:
+            os.remove(self.socket)
+        os.rmdir(self.tmpdir)
+
+    @staticmethod
+    def _container(i, name):
+        cid = "{:064x}".format(i + 1)
+        return {
+            "Id": cid, "Name": "/{}".format(name),
+            "Image": "ontresearch/nanolabs-notebook:v0.1.0",
+            "Args": ["--NotebookApp.token=EPI2MELabs", "--port=8888"],
+            "State": {
+                "Status": "running", "Running": True,
+                "StartedAt": "2020-10-19T10:15:20.123456789Z"},
+            "Config": {"Labels": {}}}
+
+    def _find(self, cid):
+        for cont in self.containers:
+            if cid in (cont["Id"], cont["Name"].lstrip("/")):
+                return cont
+        return None
+
+    def _ping(self, handler, query):
+        body = b"OK"
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/plain")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if handler.command != "HEAD":
+            handler.wfile.write(body)
+
+    def _version(self, handler, query):
+        handler.send_json({
+            "Version": "19.03.8", "ApiVersion": "1.40",
+            "MinAPIVersion": "1.12", "Os": "linux", "Arch": "amd64"})
+
+    def _info(self, handler, query):
+        handler.send_json({
+            "ServerVersion": "19.03.8", "OperatingSystem": "Fake OS",
+            "Architecture": self.arch, "NCPU": 4, "MemTotal": 8 * 1024 ** 3,
+            "DockerRootDir": self.tmpdir})
+
+    def _containers(self, handler, query):
+        handler.send_json([
+            {"Id": c["Id"], "Names": [c["Name"]], "Image": c["Image"],
+             "State": c["State"]["Status"], "Labels": {}}
+            for c in self.containers])
+
+    def _inspect(self, handler, query, cid):
+        cont = self._find(cid)
+        if cont is None:
+            handler.send_json({"message": "No such container"}, status=404)
+        else:
+            handler.send_json(cont)
+
+    def _stats(self, handler, query, cid):
+        handler.send_json({
+            "read": "2020-01-01T00:00:00Z",
+            "cpu_stats": {"cpu_usage": {"total_usage": 1000}},
+            "memory_stats": {"usage": 1024, "max_usage": 2048}})
+
+    def _image(self, handler, query, name):
+        if name in self.images:
+            digest = hashlib.sha256(name.encode()).hexdigest()
+            handler.send_json({"Id": "sha256:{}".format(digest)})
+        else:
+            handler.send_json(
+                {"message": "No such image: {}".format(name)}, status=404)
+
+    def _pull(self, handler, query):
+        image = query.get("fromImage", "")
+        tag = query.get("tag", "latest")
+        self.images.add("{}:{}".format(image, tag))
+        handler.send_chunked(self.pull_log(tag))
+
+    def pull_log(self, tag):
+        """Generate the progress messages of a pull."""
+        yield {"status": "Pulling from image", "id": tag}
+        step = self.layer_size // self.pull_steps
+        for i in range(1, self.pull_steps + 1):
+            for layer in range(self.pull_layers):
+                yield {
+                    "status": "Downloading",
+                    "progressDetail": {
+                        "current": i * step, "total": self.layer_size},
+                    "progress": "[=>   ]", "id": "{:012x}".format(layer)}
+        for layer in range(self.pull_layers):
+            yield {"status": "Pull complete", "progressDetail": {},
+                   "id": "{:012x}".format(layer)}
+        yield {"status": "Status: Downloaded newer image"}
+
+
+class FakeHub(_FakeServer):
+    """Mimic the Docker Hub v2 repository tags API.
+
+    The server listens on localhost, use `base_url` as the hub address.
+    """
+
+    def __init__(self, tags=500, page_size=100, architectures=None,
+                 latency=0.0):
+        """Initialize the hub.
+
+        :param tags: number of tags of every repository, or a list of tag
+            names.
+        :param page_size: number of tags returned per page.
+        :param architectures: architectures of the images of tags, by tag
+            name. Tags not given have an amd64 image, an empty list gives
+            a tag without image information.
+        :param latency: delay (s) added to every request.
+        """
+        super().__init__(latency=latency)
+        if isinstance(tags, int):
+            tags = ["v0.{}.{}".format(i // 10, i % 10) for i in range(tags)]
+            tags.extend(("latest", "dev"))
+        self.tags = tags
+        self.architectures = dict() if architectures is None \
+            else architectures
+        self.page_size = page_size
+        self.routes = [
+            ("GET", r"/v2/repositories/(.+)/tags/?", self._tags)]
+
+    def _create(self):
+        return _TCPHTTPServer(("127.0.0.1", 0), _Handler)
+
+    @property
+    def base_url(self):
+        """Return the address of the server."""
+        host, port = self.server.server_address
+        return "http://{}:{}".format(host, port)
+
+    def _tags(self, handler, query, image):
+        page = int(query.get("page", 1))
+        page_size = int(query.get("page_size", self.page_size))
+        start = (page - 1) * page_size
+        names = self.tags[start:start + page_size]
+        next_page = None
+        if start + page_size < len(self.tags):
+            next_page = "{}/v2/repositories/{}/tags?page={}&page_size={}" \
+                .format(self.base_url, image, page + 1, page_size)
+        handler.send_json({
+            "count": len(self.tags), "next": next_page,
+            "previous": None,
+            "results": [self.tag_meta(name) for name in names]})
+
+    def tag_meta(self, name):
+        """Return the meta data of a tag.
+
+        The image of each architecture is 1Gb larger than that of the
+        previous one, starting from 2Gb.
+        """
+        images = [
+            {"architecture": arch, "os": "linux",
+             "size": (2 + i) * 1024 ** 3}
+            for i, arch in enumerate(
+                self.architectures.get(name, ["amd64"]))]
+        return {
+            "name": name, "images": images,
+            "full_size": max([x["size"] for x in images] + [2 * 1024 ** 3])}
+
+
+class FakeRegistry(_FakeServer):
+    """Mimic the manifests and token endpoints of a container registry.
+
+    Manifest requests require a bearer token, as Docker Hub, and report
+    the pull rate limit. GET requests of manifests count against the
+    limit, once it is reached they are refused with status 429.
+    """
+
+    def __init__(self, limit=100, window=21600, reset=None, latency=0.0):
+        """Initialize the registry.
+
+        :param limit: the number of manifests which may be fetched.
+        :param window: the period (s) of the limit.
+        :param reset: time (s) reported until the limit is restored, or
+            None to not report it.
+        :param latency: delay (s) added to every request.
+        """
+        super().__init__(latency=latency)
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset = reset
+        self.tokens = 0
+        self.routes = [
+            ("GET", r"/token", self._token),
+            ("GET", r"/v2/(.+)/manifests/([^/]+)", self._manifest),
+            ("HEAD", r"/v2/(.+)/manifests/([^/]+)", self._manifest)]
+
+    def _create(self):
+        return _TCPHTTPServer(("127.0.0.1", 0), _Handler)
+
+    @property
+    def base_url(self):
+        """Return the address of the registry."""
+        host, port = self.server.server_address
+        return "http://{}:{}".format(host, port)
+
+    def _token(self, handler, query):
+        with self.lock:
+            self.tokens += 1
+        handler.send_json({"token": "token-{}".format(query.get("scope"))})
+
+    def _manifest(self, handler, query, repository, tag):
+        token = "Bearer token-repository:{}:pull".format(repository)
+        if handler.headers.get("Authorization") != token:
+            challenge = (
+                'Bearer realm="{}/token",service="registry",'
+                'scope="repository:{}:pull"'.format(self.base_url, repository))
+            handler.send_response(401)
+            handler.send_header("WWW-Authenticate", challenge)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        with self.lock:
+            status = 200 if self.remaining > 0 else 429
+            if handler.command == "GET" and status == 200:
+                self.remaining -= 1
+            remaining = self.remaining
+        body = b"" if handler.command == "HEAD" else b"{}"
+        handler.send_response(status)
+        handler.send_header(
+            "RateLimit-Limit", "{};w={}".format(self.limit, self.window))
+        handler.send_header(
+            "RateLimit-Remaining", "{};w={}".format(remaining, self.window))
+        if self.reset is not None:
+            handler.send_header("RateLimit-Reset", str(self.reset))
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+class FakeNotebook(_FakeServer):
+    """Mimic the status and kernels of the Jupyter notebook server API.
+
+    The server listens on localhost, use `port` as that of the notebook
+    server container.
+    """
+
+    def __init__(self, token="EPI2MELabs", last_activity=None,
+                 latency=0.0):
+        """Initialize the server.
+
+        :param token: the token required by requests.
+        :param last_activity: time of the last activity of the server,
+            by default the current time.
+        :param latency: delay (s) added to every request.
+        """
+        super().__init__(latency=latency)
+        self.token = token
+        self.last_activity = time.time() if last_activity is None \
+            else last_activity
+        self.kernels = list()
+        # queries of the requests made
+        self.queries = list()
+        self.routes = [
+            ("GET", r"/api/status", self._status),
+            ("GET", r"/api/kernels", self._kernels),
+            ("DELETE", r"/api/kernels/([^/]+)", self._shutdown)]
+
+    def _create(self):
+        return _TCPHTTPServer(("127.0.0.1", 0), _Handler)
+
+    @property
+    def port(self):
+        """Return the port of the server."""
+        return self.server.server_address[1]
+
+    @staticmethod
+    def timestamp(t):
+        """Return a time as formatted by the notebook server."""
+        return time.strftime(
+            "%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime(t))
+
+    def add_kernel(self, last_activity, busy=False, name="python3"):
+        """Add a running kernel.
+
+        :param last_activity: time of the last activity of the kernel.
+        :param busy: whether the kernel is executing code.
+        :param name: the kernel name.
+
+        :returns: the kernel ID.
+        """
+        kid = "kernel-{}".format(len(self.kernels))
+        self.kernels.append({
+            "id": kid, "name": name, "connections": 1,
+            "last_activity": self.timestamp(last_activity),
+            "execution_state": "busy" if busy else "idle"})
+        return kid
+
+    def _authorized(self, handler, query):
+        with self.lock:
+            self.queries.append(query)
+        if handler.headers.get("Authorization") != \
+                "token {}".format(self.token):
+            handler.send_json({"message": "Forbidden"}, status=403)
+            return False
+        return True
+
+    def _status(self, handler, query):
+        if self._authorized(handler, query):
+            handler.send_json({
+                "started": self.timestamp(self.last_activity - 3600),
+                "last_activity": self.timestamp(self.last_activity),
+                "connections": 1, "kernels": len(self.kernels)})
+
+    def _kernels(self, handler, query):
+        if self._authorized(handler, query):
+            with self.lock:
+                kernels = list(self.kernels)
+            handler.send_json(kernels)
+
+    def _shutdown(self, handler, query, kid):
+        if not self._authorized(handler, query):
+            return
+        with self.lock:
+            kernels = [x for x in self.kernels if x["id"] != kid]
+            found = len(kernels) < len(self.kernels)
+            self.kernels = kernels
+        if not found:
+            handler.send_json({"message": "Kernel not found"}, status=404)
+            return
+        handler.send_response(204)
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
@@ -0,0 +1,89 @@
+"""Benchmarks of the hot paths in labslauncher.dockerutil."""
+import docker
+import pytest
+
+from conftest import IMAGE
+from labslauncher import dockerutil
+
+
+@pytest.mark.parametrize("latency", [0.0, 0.005])
+def test_heartbeat(benchmark, engine_factory, hub_factory, client_factory,
+                   latency):
+    """Cost of a single heartbeat, `DockerClient.is_running`."""
+    engine = engine_factory(
+        images=["{}:v0.9.9".format(IMAGE)], latency=latency)
+    hub_factory(tags=100)
+    client = client_factory()
+    start = engine.requests
+    assert benchmark(client.is_running)
+    if benchmark.stats is not None:
+        benchmark.extra_info["requests_per_call"] = \
+            (engine.requests - start) / benchmark.stats.stats.rounds
+
+
+@pytest.mark.parametrize("containers", [1, 10, 100])
+def test_container_lookup(benchmark, engine_factory, hub_factory,
+                          client_factory, containers):
+    """Scaling of `DockerClient.container` with the number of containers."""
+    engine = engine_factory(
+        containers=containers, images=["{}:v0.9.9".format(IMAGE)])
+    hub_factory(tags=100)
+    client = client_factory()
+    start = engine.requests
+    cont = benchmark(lambda: client.container)
+    assert cont is not None
+    if benchmark.stats is not None:
+        benchmark.extra_info["requests_per_call"] = \
+            (engine.requests - start) / benchmark.stats.stats.rounds
+
+
+@pytest.mark.parametrize("position", [0, 10, 100])
+def test_newest_tag(benchmark, engine_factory, hub_factory, position):
+    """Scaling of `newest_tag` with the age of the newest local image."""
+    hub_factory(tags=200)
+    tags = dockerutil.get_image_tags(IMAGE)
+    engine_factory(images=["{}:{}".format(IMAGE, tags[position])])
+    client = docker.from_env()
+    latest = benchmark(dockerutil.newest_tag, IMAGE, client=client)
+    assert latest == tags[position]
+
+
+@pytest.mark.parametrize("tags", [100, 1000])
+def test_get_image_tags_uncached(benchmark, hub_factory, tags):
+    """Cost of fetching all tag pages from the hub and sorting them."""
+    hub = hub_factory(tags=tags, page_size=100)
+
+    def fetch():
+        dockerutil.clear_tag_cache()
+        return dockerutil.get_image_tags(IMAGE)
+
+    result = benchmark(fetch)
+    assert len(result) == tags
+    if benchmark.stats is not None:
+        benchmark.extra_info["pages"] = \
+            hub.requests // benchmark.stats.stats.rounds
+
+
+@pytest.mark.parametrize("tags", [100, 1000])
+def test_tag_sorting(benchmark, hub_factory, tags):
+    """Cost of filtering and semver sorting of cached tags."""
+    hub_factory(tags=tags, page_size=100)
+    dockerutil.get_image_tags(IMAGE)  # warm the cache
+    result = benchmark(dockerutil.get_image_tags, IMAGE)
+    assert len(result) == tags
+
+
+@pytest.mark.parametrize("layers,steps", [(10, 100), (20, 500)])
+def test_pull_stream(benchmark, engine_factory, hub_factory, layers, steps):
+    """Throughput of parsing the progress stream of `pull_with_progress`."""
+    engine_factory(pull_layers=layers, pull_steps=steps)
+    hub_factory(tags=10)
+
+    def pull():
+        return sum(1 for _ in dockerutil.pull_with_progress(IMAGE, "v0.0.1"))
+
+    updates = benchmark(pull)
+    assert updates == layers * steps
+    if benchmark.stats is not None:
+        benchmark.extra_info["lines_per_second"] = \
+            updates / benchmark.stats.stats.mean
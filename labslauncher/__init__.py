@@ -192,3 +192,105 @@ class Defaults(list):
             "Send pings",
             "Send usage statistics to ONT.",
             "send_pings", True, False)
+        self.append(
+            "Stop grace period",
+            "Time (s) the notebook server is given to shut down, saving "
+            "its state, before it is killed.",
+            "stop_timeout", 10, True)
+        self.append(
+            "Images to keep",
+            "Number of newest server versions kept when removing old "
+            "versions.",
+            "keep_images", 2, True)
+        self.append(
+            "Remove old images",
+            "Automatically remove old server versions after an update.",
+            "auto_prune", False, True)
+        self.append(
+            "Metrics port",
+            "Local port serving Prometheus metrics (0 to disable).",
+            "metrics_port", 0, False)
+        self.append(
+            "Extra mounts",
+            "Additional host folders accessible within notebooks, "
+            "separated by ';', each as 'source=PATH,target=PATH' "
+            "optionally with ',readonly' and ',consistency=cached', "
+            "'delegated' or 'consistent'.",
+            "extra_mounts", "", True)
+        self.append(
+            "Scratch size",
+            "Size (Mb) of an in-memory scratch area for temporary files "
+            "(0 to disable).",
+            "scratch_size", 0, True)
+        self.append(
+            "Scratch bind",
+            "Location on server of the scratch area.",
+            "scratch_bind", "/scratch/", False)
+        self.append(
+            "Stage data",
+            "Copy the staged folders into a docker volume for fast access "
+            "from notebooks, results are copied back when the server is "
+            "stopped.",
+            "stage_data", False, True)
+        self.append(
+            "Staged folders",
+            "Folders copied into the staging volume, separated by "
+            "'{}'.".format(os.pathsep),
+            "stage_folders", "", True)
+        self.append(
+            "Staging bind",
+            "Location on server where staged folders are accessible.",
+            "stage_bind", "/staged/", False)
+        self.append(
+            "Staging volume",
+            "Name of the docker volume holding staged folders.",
+            "stage_volume", "epi2melabs-staged", False)
+        self.append(
+            "Usage history",
+            "Record the resource usage of the notebook server, such that "
+            "peak memory and CPU use can be reviewed.",
+            "usage_history", True, True)
+        self.append(
+            "Usage sample interval",
+            "Time (s) between samples of resource usage.",
+            "usage_interval", 60, False)
+        self.append(
+            "Usage retention",
+            "Number of days for which resource usage is kept.",
+            "usage_retention", 365, False)
+        self.append(
+            "Idle shutdown",
+            "Time (minutes) without notebook activity after which the "
+            "idle action is taken (0 to disable).",
+            "idle_timeout", 0, True)
+        self.append(
+            "Idle action",
+            "Action taken on an idle server: 'stop' to stop the server, "
+            "or 'cull' to shut down its idle kernels.",
+            "idle_action", "stop", True)
+        self.append(
+            "Docker host",
+            "Docker daemon on which to run the server, e.g. "
+            "'ssh://user@server' or 'tcp://server:2376'. Folders are "
+            "mounted from that computer. Empty for the docker of this "
+            "computer, or that set by DOCKER_HOST.",
+            "docker_host", "", True)
+        self.append(
+            "Docker TLS certificates",
+            "Folder containing ca.pem, cert.pem and key.pem to connect to a "
+            "tcp docker host using TLS.",
+            "docker_cert_path", "", True)
+        self.append(
+            "Forward ports",
+            "Forward the server's ports from a remote docker host to this "
+            "computer with ssh, such that it is accessed as if it were "
+            "local: 'auto' for ssh docker hosts, 'always' to also forward "
+            "from tcp hosts, which requires ssh access, or 'never'.",
+            "docker_forward", "auto", True)
+        self.append(
+            "Pull limit reserve",
+            "Docker Hub limits the pulls from an address, shared by all "
+            "computers of a network. Registry requests made only to "
+            "estimate download sizes are skipped when this many or fewer "
+            "pulls remain.",
+            "registry_reserve", 10, False)
@@ -0,0 +1,438 @@
+"""Asynchronous docker Engine API client, bridged to Qt.
+
+The synchronous docker SDK ties up a thread for every blocking call, and
+a streamed response can only be abandoned when the consumer next checks
+whether it should stop. `AsyncEngine` speaks the Engine API directly with
+asyncio, such that pulls, events, stats and logs can run as concurrent
+coroutines on a single thread. Cancelling a coroutine closes its
+connection, ending the stream immediately.
+
+`EngineThread` runs the asyncio event loop on a dedicated thread and
+delivers results to the Qt event loop through signals, so that the GUI
+thread is never blocked.
+"""
+import asyncio
+import codecs
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from PyQt5.QtCore import pyqtSignal as Signal, QObject
+
+import labslauncher
+from labslauncher import dockerapi, metrics
+
+
+DEFAULT_HOST = 'unix:///var/run/docker.sock'
+API_VERSION = '1.40'
+
+
+def _tasks(loop):
+    """Return the tasks of an event loop, other than the current task."""
+    # the task functions moved to the module in python 3.7
+    if hasattr(asyncio, 'all_tasks'):
+        tasks, current = asyncio.all_tasks(loop), asyncio.current_task(loop)
+    else:
+        tasks = asyncio.Task.all_tasks(loop)
+        current = asyncio.Task.current_task(loop)
+    return [t for t in tasks if t is not current]
+
+
+class EngineError(Exception):
+    """An error response from the docker engine."""
+
+    def __init__(self, status, message):
+        """Initialize the error.
+
+        :param status: HTTP status code.
+        :param message: the error message from the engine.
+        """
+        super().__init__("{} ({})".format(message, status))
+        self.status = status
+
+
+class AsyncEngine():
+    """A minimal asyncio client of the docker Engine API."""
+
+    def __init__(self, base_url=None, version=API_VERSION, ssl=None):
+        """Initialize the client.
+
+        :param base_url: the docker host, as `DOCKER_HOST`. Only unix
+            sockets and TCP are supported.
+        :param version: the API version to request.
+        :param ssl: an `ssl.SSLContext` for a TCP host using TLS.
+        """
+        if not base_url:
+            base_url = os.environ.get('DOCKER_HOST', DEFAULT_HOST)
+        self.base_url = base_url
+        self.version = version
+        self.ssl = ssl
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        if self.scheme == 'unix':
+            self.address = url.path
+        elif self.scheme == 'tcp':
+            self.address = (
+                url.hostname, url.port or (2375 if ssl is None else 2376))
+        else:
+            raise ValueError(
+                "Unsupported docker host for async client: {}".format(
+                    base_url))
+        self.logger = labslauncher.get_named_logger("AioEngn")
+
+    @staticmethod
+    def supported(base_url=None):
+        """Return whether a docker host can be used by this client."""
+        if not base_url:
+            base_url = os.environ.get('DOCKER_HOST', DEFAULT_HOST)
+        if base_url == DEFAULT_HOST and sys.platform == 'win32':
+            return False
+        return urlsplit(base_url).scheme in ('unix', 'tcp')
+
+    async def _open(self):
+        if self.scheme == 'unix':
+            return await asyncio.open_unix_connection(self.address)
+        return await asyncio.open_connection(*self.address, ssl=self.ssl)
+
+    async def _send(self, method, path, params=None, body=None):
+        """Send a request, returning the response status, headers and reader.
+
+        :returns: tuple of status code, headers, reader and writer.
+        """
+        url = '/v{}{}'.format(self.version, path)
+        if params:
+            url = '{}?{}'.format(url, urlencode(params))
+        data = b''
+        headers = ['Host: docker', 'Connection: close']
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers.append('Content-Type: application/json')
+        headers.append('Content-Length: {}'.format(len(data)))
+        reader, writer = await self._open()
+        try:
+            writer.write('{} {} HTTP/1.1\r\n{}\r\n\r\n'.format(
+                method, url, '\r\n'.join(headers)).encode() + data)
+            line = await reader.readline()
+            status = int(line.split()[1])
+            response_headers = dict()
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if line == '':
+                    break
+                key, value = line.split(':', 1)
+                response_headers[key.strip().lower()] = value.strip()
+        except BaseException:
+            writer.close()
+            raise
+        return status, response_headers, reader, writer
+
+    async def _body(self, reader, headers, on_data):
+        """Read the body of a response, passing each chunk to a callback."""
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    break
+                on_data(await reader.readexactly(size))
+                await reader.readline()
+        elif 'content-length' in headers:
+            on_data(await reader.readexactly(int(headers['content-length'])))
+        else:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                on_data(data)
+
+    async def request(self, method, path, params=None, body=None):
+        """Make a request, returning the decoded JSON response.
+
+        :param method: HTTP method.
+        :param path: API path, without the version prefix.
+        :param params: query parameters.
+        :param body: object to send as JSON.
+
+        :raises: `EngineError` for error responses.
+        """
+        endpoint = metrics.api_endpoint(method, path)
+        start = time.perf_counter()
+        status, size = 'error', 0
+        try:
+            status, headers, reader, writer = await self._send(
+                method, path, params=params, body=body)
+            data = list()
+            try:
+                await self._body(reader, headers, data.append)
+            finally:
+                writer.close()
+            data = b''.join(data)
+            size = len(data)
+        finally:
+            dockerapi.record(
+                endpoint, time.perf_counter() - start, status, size)
+        result = json.loads(data.decode()) if data else None
+        if status >= 400:
+            raise EngineError(
+                status, (result or dict()).get('message', 'unknown error'))
+        return result
+
+    async def stream(self, method, path, on_item, params=None, body=None):
+        """Make a request with a streamed JSON response.
+
+        The connection is closed when the coroutine completes or is
+        cancelled.
+
+        :param method: HTTP method.
+        :param path: API path, without the version prefix.
+        :param on_item: function called with each decoded object.
+        :param params: query parameters.
+        :param body: object to send as JSON.
+
+        :raises: `EngineError` for error responses.
+        """
+        endpoint = metrics.api_endpoint(method, path)
+        start = time.perf_counter()
+        status, headers, reader, writer = await self._send(
+            method, path, params=params, body=body)
+        dockerapi.record(endpoint, time.perf_counter() - start, status, 0)
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder('utf-8')()
+        buffer = ['']
+
+        def on_data(data):
+            text = buffer[0] + utf8.decode(data)
+            pos = 0
+            while True:
+                while pos < len(text) and text[pos].isspace():
+                    pos += 1
+                try:
+                    item, pos = decoder.raw_decode(text, pos)
+                except ValueError:
+                    break
+                on_item(item)
+            buffer[0] = text[pos:]
+
+        try:
+            if status >= 400:
+                data = list()
+                await self._body(reader, headers, data.append)
+                message = json.loads(b''.join(data).decode() or '{}')
+                raise EngineError(
+                    status, message.get('message', 'unknown error'))
+            await self._body(reader, headers, on_data)
+        finally:
+            writer.close()
+
+    async def ping(self):
+        """Return whether the engine responds."""
+        status, headers, reader, writer = await self._send('GET', '/_ping')
+        writer.close()
+        return status == 200
+
+    async def pull(self, image, tag, on_item, platform=None):
+        """Pull an image, passing each progress message to a callback.
+
+        :param image: image name.
+        :param tag: image tag.
+        :param on_item: function called with each progress message.
+        :param platform: the platform to pull, e.g. 'linux/arm64'.
+        """
+        params = {'fromImage': image, 'tag': tag}
+        if platform is not None:
+            params['platform'] = platform
+        await self.stream('POST', '/images/create', on_item, params=params)
+
+    async def events(self, on_item, filters=None):
+        """Follow engine events.
+
+        :param on_item: function called with each event.
+        :param filters: event filters, as for `docker events`.
+        """
+        params = dict()
+        if filters is not None:
+            params['filters'] = json.dumps(filters)
+        await self.stream('GET', '/events', on_item, params=params)
+
+    async def stats(self, container, on_item, stream=True):
+        """Follow the resource usage of a container.
+
+        :param container: container name or ID.
+        :param on_item: function called with each statistics sample.
+        :param stream: if False, a single sample is returned.
+        """
+        await self.stream(
+            'GET', '/containers/{}/stats'.format(container), on_item,
+            params={'stream': str(stream).lower()})
+
+    async def logs(self, container, on_line, follow=True, tail=100):
+        """Follow the logs of a container without a TTY.
+
+        :param container: container name or ID.
+        :param on_line: function called with each line of output.
+        :param follow: continue to follow the logs.
+        :param tail: number of lines from the end of the logs to send.
+        """
+        status, headers, reader, writer = await self._send(
+            'GET', '/containers/{}/logs'.format(container), params={
+                'stdout': 1, 'stderr': 1, 'follow': int(follow),
+                'tail': tail})
+        # the stream is multiplexed into frames of stdout and stderr
+        state = {'buffer': b'', 'partial': ''}
+
+        def on_data(data):
+            buffer = state['buffer'] + data
+            while len(buffer) >= 8:
+                _, size = struct.unpack('>BxxxL', buffer[:8])
+                if len(buffer) < 8 + size:
+                    break
+                text = state['partial'] + buffer[8:8 + size].decode(
+                    errors='replace')
+                buffer = buffer[8 + size:]
+                lines = text.split('\n')
+                state['partial'] = lines.pop()
+                for line in lines:
+                    on_line(line)
+            state['buffer'] = buffer
+
+        try:
+            if status >= 400:
+                raise EngineError(status, "Failed to retrieve logs")
+            await self._body(reader, headers, on_data)
+        finally:
+            writer.close()
+
+
+class EngineJob(QObject):
+    """A coroutine running on the `EngineThread`.
+
+    item - objects produced by a streaming coroutine
+    progress - float indicating % progress of a coroutine
+    result - the return value of the coroutine
+    error - tuple (exception type, exception)
+    finished - emitted when the coroutine completes, fails or is cancelled
+    """
+
+    item = Signal(object)
+    progress = Signal(float)
+    result = Signal(object)
+    error = Signal(tuple)
+    finished = Signal()
+
+    def __init__(self, loop):
+        """Initialize the job."""
+        super().__init__()
+        self.loop = loop
+        self.future = None
+        self._coroutine = None
+
+    def start(self):
+        """Start the coroutine of a job submitted with `defer=True`."""
+        if self.future is None:
+            self.future = asyncio.run_coroutine_threadsafe(
+                self._coroutine(), self.loop)
+
+    def cancel(self):
+        """Cancel the coroutine, closing any connection it holds."""
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(self.future.cancel)
+
+    def done(self):
+        """Return whether the coroutine has completed."""
+        return self.future is not None and self.future.done()
+
+
+class EngineThread():
+    """Run an asyncio event loop on a dedicated thread."""
+
+    def __init__(self, engine=None):
+        """Initialize and start the event loop.
+
+        :param engine: an `AsyncEngine`, by default connected to the
+            docker host from the environment.
+        """
+        self.engine = engine if engine is not None else AsyncEngine()
+        self.logger = labslauncher.get_named_logger("AioEngn")
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="asyncio", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, func, *args, streaming=False, defer=False, **kwargs):
+        """Run a coroutine function on the event loop.
+
+        :param func: coroutine function, called on the event loop thread.
+        :param args: arguments of the function.
+        :param streaming: if True, the function is additionally passed a
+            callback (as its last positional argument) which emits the
+            job's `item` signal. If "progress", the callback emits the
+            job's `progress` signal.
+        :param defer: if True the job is started by calling its `start`,
+            such that its signals can be connected beforehand.
+        :param kwargs: keyword arguments of the function.
+
+        :returns: an `EngineJob`.
+        """
+        job = EngineJob(self.loop)
+        if streaming == "progress":
+            args = args + (job.progress.emit,)
+        elif streaming:
+            args = args + (job.item.emit,)
+
+        async def run():
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                self.logger.info("Cancelled: {}.".format(
+                    getattr(func, '__qualname__', func)))
+                raise
+            except Exception as e:
+                self.logger.warning("{} failed: {}".format(
+                    getattr(func, '__qualname__', func), e))
+                job.error.emit((type(e), e))
+            else:
+                job.result.emit(result)
+            finally:
+                job.finished.emit()
+
+        job._coroutine = run
+        if not defer:
+            job.start()
+        return job
+
+    def run_sync(self, func, *args, timeout=None, **kwargs):
+        """Run a coroutine function, blocking until it completes.
+
+        Must not be called from the event loop thread.
+
+        :param timeout: time (s) after which the coroutine is cancelled.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            func(*args, **kwargs), self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def close(self, timeout=2):
+        """Cancel outstanding coroutines and stop the event loop."""
+        async def cancel_all():
+            tasks = _tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            if len(tasks) > 0:
+                await asyncio.wait(tasks, timeout=timeout)
+        try:
+            self.run_sync(cancel_all, timeout=timeout + 1)
+        except Exception:
+            self.logger.exception("Failed to cancel coroutines.")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
@@ -8,6 +8,7 @@ import os
 import platform
 import socket
 import sys
+import time
 import webbrowser
 
 from epi2melabs import ping
@@ -19,12 +20,43 @@ from PyQt5.QtCore import (
 from PyQt5.QtGui import QIcon, QIntValidator, QPixmap
 from PyQt5.QtWidgets import (
     QAction, QApplication, QCheckBox, QDesktopWidget, QDialog, QFileDialog,
-    QGridLayout, QHBoxLayout, QLabel, QLineEdit, QMainWindow, QMessageBox,
-    QProgressBar, QPushButton, QStackedWidget, QVBoxLayout, QWidget)
+    QGridLayout, QHBoxLayout, QHeaderView, QLabel, QLineEdit, QMainWindow,
+    QMenu, QMessageBox, QProgressBar, QPushButton, QStackedWidget,
+    QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget)
 
 import labslauncher
+from labslauncher import (
+    dockerapi, idle, preflight, profiling, pulls, remote, staging, state,
+    tracing, usage)
+from labslauncher.aioengine import AsyncEngine, EngineThread
 from labslauncher.dockerutil import DockerClient
+from labslauncher.metrics import MetricsServer
 from labslauncher.qtext import ClickLabel, Settings, Worker
+from labslauncher.registry import RateLimited
+from labslauncher.telemetry import Telemetry
+from labslauncher.watchdog import StallDetector
+
+
+def format_size(size):
+    """Format a size in bytes for display.
+
+    :param size: size (bytes).
+    """
+    if size >= 1024 ** 3:
+        return "{:.1f}Gb".format(size / 1024 ** 3)
+    return "{:.0f}Mb".format(size / 1024 ** 2)
+
+
+def format_duration(seconds):
+    """Format a duration for display.
+
+    :param seconds: the duration (s).
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours > 0:
+        return "{}h{:02d}m".format(hours, minutes)
+    return "{}m{:02d}s".format(minutes, seconds)
 
 
 class Screen(QWidget):
@@ -65,6 +97,17 @@ class HomeScreen(Screen):
         self.start_btn.clicked.connect(self.goto_start.emit)
         self.stop_btn = QPushButton("Stop")
         self.stop_btn.clicked.connect(self.on_stop)
+        # a running server can be paused or stopped, to be resumed quickly
+        self.stop_menu = QMenu(self)
+        self.pause_act = self.stop_menu.addAction("Pause")
+        self.pause_act.triggered.connect(
+            functools.partial(self.on_stop, keep=True, pause=True))
+        self.keep_act = self.stop_menu.addAction("Stop")
+        self.keep_act.triggered.connect(
+            functools.partial(self.on_stop, keep=True))
+        self.remove_act = self.stop_menu.addAction("Stop and remove")
+        self.remove_act.triggered.connect(
+            functools.partial(self.on_stop, keep=False))
         self.l0.addWidget(self.start_btn)
         self.l0.addWidget(self.stop_btn)
         self.layout.addLayout(self.l0)
@@ -89,9 +132,13 @@ class HomeScreen(Screen):
         self.layout.addWidget(self.welcome_lbl)
         self.layout.addWidget(self.version_lbl)
         self.setLayout(self.layout)
+        self.sync_worker = None
 
         # add callbacks
+        self.app.settings.changed.connect(self.on_setting)
         self.app.docker.status.changed.connect(self.on_status)
+        self.app.docker.stale.changed.connect(
+            lambda stale: self.on_status(self.app.docker.status.value))
         self.app.docker.tag.changed.connect(self.on_tag)
         self.on_status(self.app.docker.status.value)
         self.on_tag(self.app.docker.tag.value)
@@ -109,6 +156,10 @@ class HomeScreen(Screen):
                 port=settings['port'],
                 databind=settings['data_bind'].replace('/', ''),
                 token=settings['token'])
+            host = self.app.docker.server_host
+            if host is not None:
+                link = link.replace(
+                    "//localhost:", "//{}:".format(host), 1)
         return link
 
     def set_welcome_lbl_text(self):
@@ -117,6 +168,12 @@ class HomeScreen(Screen):
             "Navigate to the <a href='{}'>Welcome page</a> to get started."
         self.welcome_lbl.setText(template.format(self.colab_link))
 
+    @Slot(str, object)
+    def on_setting(self, key, value):
+        """Update the welcome link when a setting it uses changes."""
+        if key in ("colab_link", "port", "data_bind", "token"):
+            self.set_welcome_lbl_text()
+
     def copy_address(self):
         """Copy server address to clipboard."""
         self.cb.clear(mode=self.cb.Clipboard)
@@ -130,9 +187,84 @@ class HomeScreen(Screen):
         msg.setWindowTitle("Address Copied")
         msg.exec_()
 
-    def on_stop(self):
-        """Stop and remove the container."""
-        self.app.docker.clear_container()
+    def on_stop(self, *args, keep=False, pause=False):
+        """Stop the container.
+
+        :param keep: keep the container, such that it can be resumed.
+        :param pause: pause rather than stop the container, if it is kept.
+        """
+        with tracing.span("ui.stop", keep=keep, pause=pause):
+            self._stop(keep=keep, pause=pause)
+
+    def _stop(self, keep=False, pause=False):
+        """Create and start the stop worker."""
+        for btn in (self.start_btn, self.stop_btn):
+            btn.setEnabled(False)
+        self.worker = Worker(
+            self.app.docker.stop_container, pause=pause, remove=not keep)
+        self.worker.setAutoDelete(True)
+        self.worker.signals.progress.connect(self.on_stop_progress)
+        self.worker.signals.finished.connect(
+            functools.partial(self.on_stopped, pause=pause))
+        self.app.pool.start(self.worker)
+
+    def on_stopped(self, pause=False):
+        """Copy results from the staging volume once the server stopped.
+
+        :param pause: whether the server was paused, its results are
+            copied once it is stopped.
+        """
+        stager = self.app.docker.staging
+        if pause or stager is None:
+            self.on_status(self.app.docker.status.value)
+            return
+        self.sync_worker = Worker(stager.sync_out)
+        self.sync_worker.setAutoDelete(True)
+        self.sync_worker.signals.progress.connect(self.on_sync_progress)
+        self.sync_worker.signals.error.connect(self.on_sync_error)
+        self.sync_worker.signals.finished.connect(self.on_synced)
+        self.app.closing.connect(self.sync_worker.stop)
+        self.app.pool.start(self.sync_worker)
+        self.on_status(self.app.docker.status.value)
+
+    @Slot(float)
+    def on_sync_progress(self, value):
+        """Display progress of copying results from the staging volume.
+
+        :param value: copy progress.
+        """
+        self.status_lbl.setText(
+            "Server status: <b>copying results</b> ({:.0f}%, {}/s)".format(
+                value, format_size(self.app.docker.staging.rate)))
+
+    @Slot(tuple)
+    def on_sync_error(self, error):
+        """Report a failure to copy results from the staging volume."""
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Warning)
+        msg.setText("Results not copied")
+        msg.setWindowTitle("Staging Error")
+        msg.setInformativeText(
+            "Results could not be copied from the staging volume. They "
+            "are kept in the volume and copied when the server is next "
+            "stopped.")
+        msg.setDetailedText(error[2])
+        msg.exec_()
+
+    @Slot()
+    def on_synced(self):
+        """Display the server status once results are copied."""
+        self.sync_worker = None
+        self.on_status(self.app.docker.status.value)
+
+    @Slot(float)
+    def on_stop_progress(self, value):
+        """Display progress of stopping the server.
+
+        :param value: stop progress.
+        """
+        self.status_lbl.setText(
+            "Server status: <b>stopping</b> ({:.0f}%)".format(value))
 
     @Slot(str)
     def on_tag(self, value):
@@ -152,6 +284,11 @@ class HomeScreen(Screen):
             color = "Crimson"
             stop_text = "Clear"
             extra_msg = "<br>(try restarting)"
+        elif new in ("paused", "stopped"):
+            color = "SlateGray"
+            start_text = "Resume"
+            if new == "stopped":
+                stop_text = "Remove"
         elif new == "unknown":
             color = "Orange"
             extra_msg = "<br>(waiting for docker)"
@@ -165,13 +302,31 @@ class HomeScreen(Screen):
         self.stop_btn.setText(stop_text)
         self.stop_btn.setEnabled(
             new not in ("inactive", "unknown"))
+        self.pause_act.setEnabled(new == "running")
+        self.stop_btn.setMenu(
+            self.stop_menu if new in ("running", "paused") else None)
+        stale = self.app.docker.stale.value
+        if stale:
+            # the saved state is shown until docker has been queried
+            color = "Gray"
+            extra_msg = "<br><i>(last known status, checking docker)</i>"
+        if stale or self.sync_worker is not None:
+            for btn in (self.start_btn, self.stop_btn):
+                btn.setEnabled(False)
+        if self.sync_worker is not None:
+            extra_msg = "<br>(copying results)"
         self.status_lbl.setText(
             'Server status: <b><font color="{}">{}</font></b>{}'.format(
                 color, new, extra_msg))
 
         address = ""
         self.address_lbl.setClickable(False)
-        container = self.app.docker.container
+        if stale:
+            container = None
+            if new == 'running':
+                address = self.app.saved_state['address']
+        else:
+            container = self.app.docker.container
         if container is not None and new == 'running':
             cargs = container.__dict__['attrs']['Args']
             for c in cargs:
@@ -180,7 +335,8 @@ class HomeScreen(Screen):
                 elif c.startswith('--NotebookApp.token='):
                     token = c.split('=')[1]
             self.address_lbl.setClickable(True)
-            address = "http://localhost:{}?token={}".format(port, token)
+            address = "http://{}:{}?token={}".format(
+                self.app.docker.server_host or "localhost", port, token)
         self.address_lbl.setText(address)
         self.repaint()
 
@@ -290,39 +446,40 @@ class StartScreen(Screen):
     def token_change(self):
         """Set state when user changes token."""
         self.app.settings["token"] = self.token_txt.text()
-        self.app.home.set_welcome_lbl_text()
 
     def port_change(self):
         """Set state when user changes port."""
-        self.app.settings["port"] = self.port_txt.text()
-        self.app.home.set_welcome_lbl_text()
+        if self.port_txt.hasAcceptableInput():
+            self.app.settings["port"] = self.port_txt.text()
 
     def aux_port_change(self):
         """Set state when user changes auxilary port."""
-        self.app.settings["aux_port"] = self.aux_port_txt.text()
-        self.app.home.set_welcome_lbl_text()
+        if self.aux_port_txt.hasAcceptableInput():
+            self.app.settings["aux_port"] = self.aux_port_txt.text()
 
     def validate_and_start(self):
         """Start the container."""
+        with tracing.span("ui.start"):
+            self._validate_and_start()
+
+    def _validate_and_start(self):
+        """Validate inputs and start the container."""
         mount = self.app.settings["data_mount"]
         token = self.app.settings["token"]
         port = self.app.settings["port"]
         aux_port = self.app.settings["aux_port"]
         # validate inputs
+        # a folder of a remote docker host is checked by the pre-flight
         valid = all([
             mount != "",
-            os.path.isdir(mount),
+            self.app.docker.remote_host is not None or os.path.isdir(mount),
             len(self.token_policy.test(token)) == 0,
             self.port_txt.hasAcceptableInput() and int(port) > 1024,
             self.aux_port_txt.hasAcceptableInput() and int(aux_port) > 1024,
             port != aux_port])
 
         if valid:
-            if (self.app.docker.latest_available_tag is None or
-                    self.app.settings["fixed_tag"] == "dev"):
-                self.pull_image(callback=self._start_container)
-            else:
-                self._start_container()
+            self.run_preflight(mount, port, aux_port)
         else:
             self.logger.warning("Container start options were invalid.")
             msg = QMessageBox(self)
@@ -338,8 +495,122 @@ class StartScreen(Screen):
                 "4. Port and Aux. port must be distinct.")
             msg.exec_()
 
+    def run_preflight(self, mount, port, aux_port):
+        """Check conditions for starting the server in the background."""
+        for btn in (self.start_btn, self.update_btn):
+            btn.setEnabled(False)
+        self.header_lbl.setText("Start server: (checking)")
+        checks = preflight.Preflight(
+            self.app.docker, mount, port, aux_port)
+        self.preflight_worker = Worker(checks.run)
+        self.preflight_worker.setAutoDelete(True)
+        self.preflight_worker.signals.result.connect(self.on_preflight)
+        self.preflight_worker.signals.error.connect(
+            lambda error: self.on_status(self.app.docker.status.value))
+        self.app.pool.start(self.preflight_worker)
+
+    @Slot(object)
+    def on_preflight(self, results):
+        """Start the server if the pre-flight checks passed.
+
+        :param results: list of `preflight.CheckResult`.
+        """
+        self.on_status(self.app.docker.status.value)
+        details = "\n".join(
+            "{}: {} ({:.0f}ms)\n    {}".format(
+                x.title, x.level, 1000 * x.duration, x.message)
+            for x in results)
+        errors = [x for x in results if x.level == preflight.ERROR]
+        # a missing image is downloaded before starting
+        warnings = [
+            x for x in results
+            if x.level == preflight.WARNING and x.name != "image"]
+        if len(errors) > 0:
+            self.logger.error("Pre-flight checks failed.")
+            msg = QMessageBox(self)
+            msg.setIcon(QMessageBox.Critical)
+            msg.setText("Cannot start server")
+            msg.setWindowTitle("Server Error")
+            msg.setInformativeText("\n\n".join(x.message for x in errors))
+            msg.setDetailedText(details)
+            msg.exec_()
+            return
+        if len(warnings) > 0:
+            msg = QMessageBox(self)
+            msg.setIcon(QMessageBox.Warning)
+            msg.setText("Start server anyway?")
+            msg.setWindowTitle("Server Warning")
+            msg.setInformativeText(
+                "\n\n".join(x.message for x in warnings))
+            msg.setDetailedText(details)
+            msg.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+            if msg.exec_() != QMessageBox.Yes:
+                return
+        if (self.app.docker.latest_available_tag is None or
+                self.app.settings["fixed_tag"] == "dev"):
+            self.pull_image(
+                callback=self.stage_and_start, priority=pulls.HIGH)
+        else:
+            self.stage_and_start()
+
+    def stage_and_start(self):
+        """Copy data to the staging volume, if enabled, and start."""
+        stager = staging.Stager.from_settings(
+            self.app.docker, self.app.settings)
+        # settings changed whilst a server ran take effect here
+        self.app.docker.staging = stager
+        if stager is None:
+            self._start_container()
+            return
+        for btn in (self.start_btn, self.update_btn):
+            btn.setEnabled(False)
+        self.header_lbl.setText("Start server: (copying data)")
+        self.stage_worker = Worker(stager.sync_in)
+        self.stage_worker.setAutoDelete(True)
+        signals = self.stage_worker.signals
+        signals.result.connect(self.on_staged)
+        signals.error.connect(self.on_stage_error)
+        self.app.closing.connect(self.stage_worker.stop)
+        self.progress_dlg = StagingDialog(
+            signals.progress, stager, parent=self)
+        self.progress_dlg.finished.connect(self.stage_worker.stop)
+        signals.finished.connect(self.progress_dlg.close)
+        self.app.pool.start(self.stage_worker)
+        self.progress_dlg.show()
+
+    @Slot(object)
+    def on_staged(self, completed):
+        """Start the server once data is copied to the staging volume.
+
+        :param completed: False if the copy was cancelled.
+        """
+        if completed:
+            self._start_container()
+        else:
+            self.on_status(self.app.docker.status.value)
+
+    @Slot(tuple)
+    def on_stage_error(self, error):
+        """Report a failure to copy data to the staging volume."""
+        self.on_status(self.app.docker.status.value)
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Critical)
+        msg.setText("Cannot start server")
+        msg.setWindowTitle("Staging Error")
+        msg.setInformativeText(
+            "Data could not be copied to the staging volume: {}".format(
+                error[1]))
+        msg.setDetailedText(error[2])
+        msg.exec_()
+
+    @profiling.profiled('start')
+    @tracing.traced('ui.start_container')
     def _start_container(self):
-        """Start container."""
+        """Start the container in the background.
+
+        An existing container may need to be stopped first, which takes
+        up to the stop timeout.
+        """
         mount = self.app.settings["data_mount"]
         token = self.app.settings["token"]
         port = self.app.settings["port"]
@@ -347,9 +618,30 @@ class StartScreen(Screen):
 
         for btn in (self.start_btn, self.update_btn):
             btn.setEnabled(False)
-        self.app.docker.start_container(mount, token, port, aux_port)
-        self.repaint()
+        self.header_lbl.setText("Start server: (starting)")
+        self.start_worker = Worker(
+            self.app.docker.start_container, mount, token, port, aux_port)
+        self.start_worker.setAutoDelete(True)
+        self.start_worker.signals.progress.connect(self.on_start_progress)
+        self.start_worker.signals.finished.connect(
+            functools.partial(self.on_started, mount, port, aux_port))
+        self.app.pool.start(self.start_worker)
 
+    @Slot(float)
+    def on_start_progress(self, value):
+        """Display progress of stopping an existing container."""
+        self.header_lbl.setText(
+            "Start server: (stopping previous server - {:.0f}%)".format(
+                value))
+
+    def on_started(self, mount, port, aux_port):
+        """Report the outcome of starting the container.
+
+        :param mount: the data folder mounted in the container.
+        :param port: the port of the notebook server.
+        :param aux_port: the auxiliary port of the container.
+        """
+        self.on_status(self.app.docker.status.value)
         if self.app.docker.status.value[1] != "running":
             self.logger.error("Failed to start container.")
             msg = QMessageBox(self)
@@ -367,12 +659,20 @@ class StartScreen(Screen):
                     "in Docker should either be the same as or "
                     "contain the path you specify in this "
                     "application.".format(mount))
+            elif self.app.docker.last_failure_type == "config":
+                msg.setInformativeText(
+                    "The server settings are invalid: {}".format(
+                        self.app.docker.last_failure))
             else:
                 msg.setInformativeText(
                     "An unexpected error occurred starting the server.")
                 msg.setDetailedText(self.app.docker.last_failure)
                 self.logger.error(self.app.docker.last_failure)
             msg.exec_()
+        elif self.app.docker.remote_host is not None:
+            self.logger.info(
+                "Container started on {}.".format(
+                    self.app.docker.remote_host))
         else:
             self.logger.info("Container started, writing config to mount.")
             config = configparser.ConfigParser()
@@ -386,34 +686,73 @@ class StartScreen(Screen):
                 'id': self.app.docker.container.id}
             config['Pings'] = {'enabled': self.app.settings["send_pings"]}
             fname = os.path.join(mount, os.path.basename(ping.CONTAINER_META))
-            with open(fname, 'w') as config_file:
-                config.write(config_file)
+            with tracing.span("ui.write_config"):
+                with open(fname, 'w') as config_file:
+                    config.write(config_file)
             self.logger.info("Container started and primed.")
 
-    def pull_image(self, *args, callback=None):
-        """Pull new image in a thread.
+    def pull_image(self, *args, callback=None, priority=pulls.NORMAL):
+        """Pull the latest image.
 
-        :param callback: function to run when pull as completed.
+        :param callback: function to run when the pull has completed.
+        :param priority: priority of the pull, see `pulls.PullManager`.
         """
-        self.logger.info("Starting thread to pull image.")
-        self.worker = Worker(self.app.docker.pull_image)
-        self.worker.setAutoDelete(True)
-        self.app.closing.connect(self.worker.stop)
-
-        self.worker.signals.finished.connect(
+        self.logger.info("Requesting pull of image.")
+        with tracing.span("ui.pull_image"):
+            self._pull_image(callback=callback, priority=priority)
+
+    def _pull_image(self, callback=None, priority=pulls.NORMAL):
+        """Find the latest tag in the background, then request its pull."""
+        self.tag_worker = Worker(self.app.docker.get_latest_tag)
+        self.tag_worker.setAutoDelete(True)
+        self.tag_worker.signals.result.connect(
+            functools.partial(
+                self._request_pull, callback=callback, priority=priority))
+        self.tag_worker.signals.error.connect(self.on_pull_error)
+        self.app.pool.start(self.tag_worker)
+
+    def _request_pull(self, tag, callback=None, priority=pulls.NORMAL):
+        """Request the pull of a tag and display its progress.
+
+        A pull of the same tag which is already queued or running is
+        shared rather than started again. Closing the progress dialog
+        releases the pull, which is cancelled only if no other requester
+        remains.
+        """
+        job = self.app.pulls.request(tag, priority=priority)
+        job.progress.connect(self.on_download)
+        job.finished.connect(
             lambda: self.update_btn.setEnabled(
                 self.app.docker.update_available))
-
+        job.error.connect(self.on_pull_error)
         if callback is not None:
-            self.worker.signals.finished.connect(callback)
-        self.progress_dlg = DownloadDialog(
-            progress=self.worker.signals.progress, parent=self)
-        self.progress_dlg.finished.connect(self.worker.stop)
-        self.worker.signals.finished.connect(self.progress_dlg.close)
+            job.result.connect(lambda image: callback())
 
-        self.app.pool.start(self.worker)
+        self.progress_dlg = DownloadDialog(progress=job.progress, parent=self)
+        self.progress_dlg.finished.connect(job.release)
+        job.finished.connect(self.progress_dlg.close)
         self.progress_dlg.show()
 
+    @Slot(tuple)
+    def on_pull_error(self, error):
+        """Report a pull which failed after all retries."""
+        self.on_status(self.app.docker.status.value)
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Critical)
+        msg.setText("Download failed")
+        msg.setWindowTitle("Download Error")
+        if isinstance(error[1], RateLimited):
+            msg.setText("Download limit reached")
+            msg.setInformativeText(
+                "Docker Hub limits the downloads from a network, which "
+                "is shared by the computers of your site. {} The number "
+                "of downloads remaining is shown in File > "
+                "Downloads.".format(error[1]))
+        else:
+            msg.setInformativeText(
+                "The server could not be downloaded: {}".format(error[1]))
+        msg.exec_()
+
     @Slot(float)
     def on_download(self, value):
         """Set state when download progress changes."""
@@ -431,12 +770,16 @@ class StartScreen(Screen):
         elif new in ("created", "exited"):
             msg = " (last attempt failed)"
             start_text = "Restart"
+        elif new in ("paused", "stopped"):
+            msg = " ({})".format(new)
+            start_text = "Resume"
         elif new == "running":
             start_text = "Restart"
             self.app.show_home()
 
         self.start_btn.setText(start_text)
-        self.start_btn.setEnabled(new != "unknown")
+        self.start_btn.setEnabled(
+            new != "unknown" and not self.app.docker.stale.value)
         self.header_lbl.setText('Start server: {}'.format(msg))
         self.update_btn.setEnabled(
             self.app.docker.update_available and new != "unknown")
@@ -469,16 +812,41 @@ class DownloadDialog(QDialog):
 
         :param value: download progress.
         """
-        self.pbar.setValue(value)
+        self.pbar.setValue(int(value))
 
         extra = ""
         size = self.parent().app.docker.total_size
         if size is not None:
-            size = size / 1024 / 1024 / 1024
-            extra = "({:.1f}Gb)".format(size)
+            extra = "({})".format(format_size(size))
         self.lbl.setText("Downloading server components {}".format(extra))
 
 
+class StagingDialog(DownloadDialog):
+    """Dialog displaying progress of copying data to the staging volume."""
+
+    def __init__(self, progress, stager, parent=None):
+        """Initialize the dialog.
+
+        :param progress: progress signal of the copy.
+        :param stager: the `staging.Stager` performing the copy.
+        """
+        self.stager = stager
+        super().__init__(progress, parent=parent)
+        self.setWindowTitle("Copying data.")
+        self.lbl.setText("Copying data to the server")
+
+    @Slot(float)
+    def on_progress(self, value):
+        """Update progress bar and throughput.
+
+        :param value: copy progress.
+        """
+        self.pbar.setValue(int(value))
+        self.lbl.setText("Copying data to the server ({}, {}/s)".format(
+            format_size(self.stager.transferred),
+            format_size(self.stager.rate)))
+
+
 class UpdateScreen(Screen):
     """Screen to display message that image update is available."""
 
@@ -490,7 +858,8 @@ class UpdateScreen(Screen):
         "EPI2ME Labs notebooks on GitHub. Please press the Update "
         "button on the main screen to update.<br><br>"
         "Current version: {}.<br>"
-        "Latest version: {}.")
+        "Latest version: {}.<br>"
+        "Download size: {}.")
 
     def __init__(self, parent=None):
         """Initialize the screen."""
@@ -511,6 +880,38 @@ class UpdateScreen(Screen):
 
         self.setLayout(self.layout)
 
+    def show_update(self, current, latest):
+        """Display the available update, calculating its download size.
+
+        :param current: the current version.
+        :param latest: the latest version.
+        """
+        self.versions = (current, latest)
+        self.update_lbl.setText(
+            self.update_text.format(current, latest, "calculating..."))
+        self.update_lbl.setWordWrap(True)
+        worker = Worker(self.app.docker.pull_size, latest)
+        worker.setAutoDelete(True)
+        worker.signals.result.connect(
+            functools.partial(self.on_size, latest))
+        self.app.pool.start(worker)
+
+    def on_size(self, latest, sizes):
+        """Display the download size of an update.
+
+        :param latest: the version for which the size was calculated.
+        :param sizes: bytes to download and full size of the version.
+        """
+        if latest != self.versions[1]:
+            return
+        needed, total = sizes
+        size = format_size(needed)
+        if needed < total:
+            size = "{} ({} total, shared parts are already present)".format(
+                size, format_size(total))
+        self.update_lbl.setText(
+            self.update_text.format(*self.versions, size))
+
 
 class LabsLauncher(QMainWindow):
     """Main application window."""
@@ -534,24 +935,94 @@ class LabsLauncher(QMainWindow):
         self.move(qtRectangle.topLeft())
         self.setFixedSize(400, 400)
 
-        app.aboutToQuit.connect(self.settings.qsettings.sync)
+        app.aboutToQuit.connect(self.settings.sync)
 
         self.pool = QThreadPool()
         app.aboutToQuit.connect(self.pool.waitForDone)
 
-        fixed_tag = self.settings["fixed_tag"]
-        if fixed_tag == "":
-            fixed_tag = None
+        # the docker host is configured at startup
+        host = self.settings["docker_host"]
+        cert_path = self.settings["docker_cert_path"]
+        connection = dockerapi.SharedClient(host=host, cert_path=cert_path)
+
+        # streams run as coroutines on a single thread where supported
+        self.engine = None
+        if AsyncEngine.supported(host):
+            context = None
+            if host and cert_path:
+                context = dockerapi.ssl_context(cert_path)
+            self.engine = EngineThread(AsyncEngine(host, ssl=context))
+            app.aboutToQuit.connect(self.engine.close)
+
+        # show the last known state whilst docker is queried
+        self.saved_state = state.load(
+            self.settings["image_name"], self.settings["server_name"])
+        self.reconciling = self.saved_state is not None
         self.docker = DockerClient(
             self.settings["image_name"], self.settings["server_name"],
             self.settings["data_bind"], self.settings["container_cmd"],
             host_only=self.settings["docker_restrict"],
-            fixed_tag=fixed_tag)
-
+            fixed_tag=self.fixed_tag, registry=self.settings["registry"],
+            stop_timeout=self.settings["stop_timeout"],
+            state=self.saved_state, connection=connection)
+        tunnel = remote.configure(
+            self.docker, host, self.settings["docker_forward"])
+        if self.docker.remote_host is not None:
+            self.logger.info("Using docker on {}{}.".format(
+                self.docker.remote_host,
+                "" if tunnel is None else ", forwarding ports"))
+        if tunnel is not None:
+            app.aboutToQuit.connect(tunnel.stop)
+        # the stager is replaced from the settings when the server starts
+        self.docker.staging = staging.Stager.from_settings(
+            self.docker, self.settings)
+        self.docker.extra_mounts = self.settings["extra_mounts"]
+        self.docker.scratch_bind = self.settings["scratch_bind"]
+        self.docker.scratch_size = self.settings["scratch_size"]
+        app.aboutToQuit.connect(self.save_state)
+        app.aboutToQuit.connect(self.docker.connection.close)
+        self.docker.registry_client.reserve = \
+            self.settings["registry_reserve"]
+        self.pulls = pulls.PullManager(
+            self.docker, self.pool, engine=self.engine)
+        self.closing.connect(self.pulls.cancel_all)
+
+        # settings changes are applied together once control returns to
+        # the event loop, such that the dialog's changes coalesce.
+        self._reconfigure_keys = set()
+        self._reconfigure_timer = QTimer(self)
+        self._reconfigure_timer.setSingleShot(True)
+        self._reconfigure_timer.setInterval(0)
+        self._reconfigure_timer.timeout.connect(self.reconfigure)
+        self.settings.changed.connect(self.on_setting)
+
+        self.metrics_server = None
+        self.start_metrics_server()
+        app.aboutToQuit.connect(self.stop_metrics_server)
+
+        self.telemetry = Telemetry()
+        app.aboutToQuit.connect(self.telemetry.close)
+        self.usage_store = usage.UsageStore(
+            retention=self.settings["usage_retention"])
+        self.usage = usage.UsageRecorder(
+            self.docker, self.pool, self.usage_store, engine=self.engine,
+            interval=self.settings["usage_interval"])
+        # the partial interval is stored before the store is closed
+        app.aboutToQuit.connect(self.usage.stop)
+        app.aboutToQuit.connect(self.usage_store.close)
+        self.idle_monitor = idle.IdleMonitor(
+            self.docker, self.pool, timeout=self.settings["idle_timeout"],
+            action=self.settings["idle_action"])
+        self.idle_monitor.idle.connect(self.on_idle)
+        self.idle_monitor.culled.connect(self.notify_idle)
         self.ping_timer = QTimer(self)
-        self.pinger = ping.Pingu()
+        self.ping_timer.setInterval(1000*60*20)  # 20 minutes
+        self.ping_timer.timeout.connect(functools.partial(self.ping, 'update'))
         self.docker.status.changed.connect(self.on_status)
         self.on_status(self.docker.status.value, boot=True)
+        self.events_job = None
+        self.closing.connect(self.stop_events)
+        self.watch_events()
 
         self.layout = QVBoxLayout()
 
@@ -562,6 +1033,19 @@ class LabsLauncher(QMainWindow):
         self.settings_act = QAction("Setting", self)
         self.settings_act.triggered.connect(self.settings_dlg.show)
         self.file_menu.addAction(self.settings_act)
+        self.disk_dlg = DiskUsageDlg(parent=self)
+        self.disk_act = QAction("Disk usage", self)
+        self.disk_act.triggered.connect(self.disk_dlg.show)
+        self.file_menu.addAction(self.disk_act)
+        self.pulls.pulled.connect(self.disk_dlg.auto_prune)
+        self.pulls_dlg = PullsDlg(self.pulls, self.pool, parent=self)
+        self.pulls_act = QAction("Downloads", self)
+        self.pulls_act.triggered.connect(self.pulls_dlg.show)
+        self.file_menu.addAction(self.pulls_act)
+        self.usage_dlg = UsageDlg(self.usage_store, parent=self)
+        self.usage_act = QAction("Usage", self)
+        self.usage_act.triggered.connect(self.usage_dlg.show)
+        self.file_menu.addAction(self.usage_act)
         self.help_menu = self.menuBar().addMenu("&Help")
         self.about_act = QAction('About', self)
         self.about_act.triggered.connect(self.about.show)
@@ -569,6 +1053,12 @@ class LabsLauncher(QMainWindow):
         self.help_act = QAction("Help", self)
         self.help_act.triggered.connect(self.show_help)
         self.help_menu.addAction(self.help_act)
+        self.api_stats_dlg = ApiStatsDlg(parent=self)
+        self.api_stats_act = QAction("Docker API statistics", self)
+        self.api_stats_act.triggered.connect(self.api_stats_dlg.show)
+        self.help_menu.addAction(self.api_stats_act)
+        app.aboutToQuit.connect(self.api_stats_dlg.log_stats)
+        app.aboutToQuit.connect(tracing.write)
 
         self.stack = QStackedWidget()
         self.home = HomeScreen(parent=self)
@@ -583,6 +1073,12 @@ class LabsLauncher(QMainWindow):
         w.setLayout(self.layout)
         self.setCentralWidget(w)
 
+        if self.reconciling:
+            self.reconcile_worker = Worker(self.docker.reconcile)
+            self.reconcile_worker.setAutoDelete(True)
+            self.reconcile_worker.signals.finished.connect(self.on_reconciled)
+            self.pool.start(self.reconcile_worker)
+
         self.home.goto_start.connect(self.show_start)
         self.start.goto_home.connect(self.show_home)
         self.update.goto_start.connect(
@@ -590,6 +1086,191 @@ class LabsLauncher(QMainWindow):
         self.show_home()
         self.logger.info("Application started.")
 
+    @property
+    def fixed_tag(self):
+        """Return the fixed image tag, or None."""
+        fixed_tag = self.settings["fixed_tag"]
+        if fixed_tag == "":
+            fixed_tag = None
+        return fixed_tag
+
+    @Slot(str, object)
+    def on_setting(self, key, value):
+        """Schedule reconfiguration when a setting changes."""
+        self._reconfigure_keys.add(key)
+        self._reconfigure_timer.start()
+
+    @profiling.profiled('reconfigure')
+    @tracing.traced('ui.reconfigure')
+    def reconfigure(self):
+        """Apply changed settings to the affected components."""
+        keys, self._reconfigure_keys = self._reconfigure_keys, set()
+        if len(keys) == 0:
+            return
+        self.logger.info(
+            "Applying changed settings: {}.".format(", ".join(sorted(keys))))
+        if keys & {"image_name", "registry"}:
+            self.docker.set_image(
+                self.settings["image_name"], self.settings["registry"])
+        if keys & {"registry", "registry_reserve"}:
+            self.docker.registry_client.reserve = \
+                self.settings["registry_reserve"]
+        if "fixed_tag" in keys:
+            self.docker.set_fixed_tag(self.fixed_tag)
+        if "stop_timeout" in keys:
+            self.docker.stop_timeout = self.settings["stop_timeout"]
+        if "metrics_port" in keys:
+            self.stop_metrics_server()
+            self.start_metrics_server()
+        if keys & {"docker_host", "docker_cert_path", "docker_forward"}:
+            msg = QMessageBox(self)
+            msg.setWindowTitle("Docker host")
+            msg.setText("Docker host")
+            msg.setInformativeText(
+                "The docker host settings are applied when the launcher "
+                "is next started.")
+            msg.exec_()
+        if "usage_interval" in keys:
+            self.usage.interval = self.settings["usage_interval"]
+        if "usage_retention" in keys:
+            self.usage_store.retention = self.settings["usage_retention"]
+        if keys & {"idle_timeout", "idle_action"}:
+            self.idle_monitor.stop()
+            self.idle_monitor.timeout = self.settings["idle_timeout"]
+            self.idle_monitor.action = self.settings["idle_action"]
+            if self.docker.status.value[1] == "running":
+                self.idle_monitor.start()
+        if "usage_history" in keys:
+            if not self.settings["usage_history"]:
+                self.usage.stop()
+            elif self.docker.status.value[1] == "running":
+                self.usage.start()
+
+        container_keys = keys & {
+            "server_name", "container_cmd", "data_bind", "docker_restrict",
+            "extra_mounts", "scratch_bind", "scratch_size"}
+        if len(container_keys) > 0:
+            clear, restart = False, False
+            status = self.docker.status.value[1]
+            if status in ("running", "paused"):
+                restart = clear = self.confirm_restart()
+                if not restart and "server_name" in container_keys:
+                    # keep tracking the running container under its
+                    # current name, the change is applied once it stops.
+                    container_keys.remove("server_name")
+                    self._reconfigure_keys.add("server_name")
+            elif status == "stopped" and "server_name" in container_keys:
+                # a stopped container would be orphaned by the new name
+                clear = True
+            if clear:
+                # the container is found by its current name, so the
+                # settings are applied once it has been removed
+                self.start.start_btn.setEnabled(False)
+                self.clear_worker = Worker(self.docker.clear_container)
+                self.clear_worker.setAutoDelete(True)
+                self.clear_worker.signals.finished.connect(
+                    functools.partial(
+                        self.apply_container_settings, container_keys,
+                        restart))
+                self.pool.start(self.clear_worker)
+                return
+            self.apply_container_settings(container_keys, restart)
+            return
+        self.start.on_status(self.docker.status.value)
+
+    def apply_container_settings(self, keys, restart=False):
+        """Apply settings of the server container.
+
+        :param keys: the changed settings.
+        :param restart: start the server with the new settings.
+        """
+        if "server_name" in keys:
+            self.docker.server_name = self.settings["server_name"]
+        if "container_cmd" in keys:
+            self.docker.container_cmd = self.settings["container_cmd"]
+        if "data_bind" in keys:
+            self.docker.data_bind = self.settings["data_bind"]
+        if "docker_restrict" in keys:
+            self.docker.host_only = self.settings["docker_restrict"]
+        for key in keys & {"extra_mounts", "scratch_bind", "scratch_size"}:
+            setattr(self.docker, key, self.settings[key])
+        if restart:
+            # results left in the staging volume are kept, and copied
+            # back when this server is stopped
+            self.start.stage_and_start()
+        else:
+            self.docker.set_status()
+        self.start.on_status(self.docker.status.value)
+
+    def watch_events(self):
+        """Follow docker container events to update the server status.
+
+        The heartbeat detects status changes only every few seconds. The
+        event stream is reopened after a delay if it ends, for example
+        when docker is restarted.
+        """
+        if self.engine is None:
+            return
+        job = self.events_job = self.engine.submit(
+            self.engine.engine.events, streaming=True, defer=True,
+            filters={'type': ['container']})
+        job.item.connect(self.on_event)
+
+        def reopen():
+            # unless stopped, or replaced, in the meantime
+            if self.events_job is job:
+                self.watch_events()
+
+        # the job is not retried once cancelled
+        for signal in (job.result, job.error):
+            signal.connect(lambda *args: QTimer.singleShot(5000, reopen))
+        job.start()
+
+    def stop_events(self):
+        """Stop following docker container events."""
+        job, self.events_job = self.events_job, None
+        if job is not None:
+            job.cancel()
+
+    @Slot(object)
+    def on_event(self, event):
+        """Update the server status on events of the server container."""
+        name = event.get('Actor', dict()).get('Attributes', dict()).get(
+            'name')
+        if name == self.docker.server_name:
+            self.docker.set_status()
+
+    def start_metrics_server(self):
+        """Start the metrics endpoint, if a port is configured."""
+        port = self.settings["metrics_port"]
+        if port > 0:
+            self.metrics_server = MetricsServer(port)
+            self.metrics_server.start()
+
+    def stop_metrics_server(self):
+        """Stop the metrics endpoint."""
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def confirm_restart(self):
+        """Ask the user whether the server should be restarted.
+
+        :returns: True if the user agrees to the restart.
+        """
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Question)
+        msg.setWindowTitle("Restart server")
+        msg.setText("Restart server")
+        msg.setInformativeText(
+            "The changed settings require the notebook server to be "
+            "restarted. Unsaved work in notebooks may be lost. Restart "
+            "the server now?\n\nOtherwise the settings will take effect "
+            "the next time the server is started.")
+        msg.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        msg.setDefaultButton(QMessageBox.No)
+        return msg.exec_() == QMessageBox.Yes
+
     def closeEvent(self, event):
         """Emit closing signal on window close."""
         self.logger.info("Quiting application.")
@@ -612,17 +1293,39 @@ class LabsLauncher(QMainWindow):
 
     def show_start(self):
         """Move to the start screen."""
+        with tracing.span("ui.show_start"):
+            self._show_start()
+
+    def _show_start(self):
+        """Check for updates and move to the appropriate screen."""
         self.start.update_btn.setEnabled(self.docker.update_available)
         if self.docker.update_available:
             cur = self.docker.latest_available_tag
             new = self.docker.latest_tag
-            self.update.update_lbl.setText(
-                self.update.update_text.format(cur, new))
-            self.update.update_lbl.setWordWrap(True)
+            self.update.show_update(cur, new)
             self.stack.setCurrentIndex(2)
         else:
             self.stack.setCurrentIndex(1)
 
+    def on_reconciled(self):
+        """Start monitoring docker once the saved state is replaced."""
+        self.reconciling = False
+        self.docker.heartbeat.start()
+        self.start.on_status(self.docker.status.value)
+        if self.docker.status.value[1] == "unknown":
+            self.docker_error()
+        self.save_state()
+
+    def save_state(self):
+        """Save the current state for display at the next launch."""
+        if self.docker.stale.value:
+            return
+        current = self.docker.state()
+        current['address'] = self.home.address_lbl.text()
+        state.save(
+            current, self.settings["image_name"],
+            self.settings["server_name"])
+
     @Slot(object)
     def on_status(self, status, boot=False):
         """Respond to container status changes."""
@@ -630,28 +1333,35 @@ class LabsLauncher(QMainWindow):
         if old == new:
             return
         self.logger.info("Status changed: '{}'->'{}'".format(old, new))
+        if hasattr(self, 'home'):
+            # once the screens have shown the new status
+            QTimer.singleShot(0, self.save_state)
+        if self.docker.tunnel is not None and new != "unknown":
+            self.forward_ports()
+        if new != "running" and len(self._reconfigure_keys) > 0:
+            self._reconfigure_timer.start()
+        if new == "running":
+            if self.settings["usage_history"]:
+                self.usage.start()
+            self.idle_monitor.start()
+        elif old == "running":
+            self.idle_monitor.stop()
+            self.usage.stop(
+                None if new == "paused" else self.docker.final_stats)
         if new == "running":
             if self.settings["send_pings"]:
                 self.ping('start')
-                callback = functools.partial(self.ping, 'update')
-                self.ping_timer.setInterval(1000*60*20)  # 20 minutes
                 self.ping_timer.start()
-                self.ping_timer.timeout.connect(callback)
-        elif old == "running" and new == "inactive":
+        elif old == "running" and new in ("inactive", "paused", "stopped"):
             if self.settings["send_pings"]:
                 self.ping_timer.stop()
                 self.ping('stop')
         elif new == "unknown":
             self.ping_timer.stop()  # might not be required
-            msg = QMessageBox(self)
-            msg.setWindowTitle("Docker error")
-            msg.setIcon(QMessageBox.Critical)
-            msg.setText("Docker Error")
-            msg.setInformativeText(
-                "The application cannot communicate with docker.\n"
-                "Please ensure that docker is running\n")
-            msg.exec_()
-        elif old == "unknown" and not boot:
+            # a saved status is reported once docker has been queried
+            if not self.reconciling:
+                self.docker_error()
+        elif old == "unknown" and not (boot or self.reconciling):
             msg = QMessageBox(self)
             msg.setWindowTitle("Docker connection")
             msg.setText("Docker connection")
@@ -659,6 +1369,54 @@ class LabsLauncher(QMainWindow):
                 "Connection to docker established.")
             msg.exec_()
 
+    def forward_ports(self):
+        """Open or close the tunnel to a remote server in the background."""
+        worker = Worker(self.docker.forward_ports)
+        worker.setAutoDelete(True)
+        worker.signals.error.connect(self.on_forward_error)
+        self.pool.start(worker)
+
+    @Slot(tuple)
+    def on_forward_error(self, error):
+        """Report that the ports of a remote server were not forwarded."""
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Warning)
+        msg.setWindowTitle("Port forwarding")
+        msg.setText("Port forwarding")
+        msg.setInformativeText(
+            "The server is running on {} but its ports could not be "
+            "forwarded to this computer: {}".format(
+                self.docker.remote_host, error[1]))
+        msg.exec_()
+
+    @Slot(str)
+    def on_idle(self, message):
+        """Stop the idle server, keeping it to be resumed."""
+        if self.docker.status.value[1] != "running":
+            return
+        self.home.on_stop(keep=True)
+        self.notify_idle(message)
+
+    @Slot(str)
+    def notify_idle(self, message):
+        """Inform the user of the action taken on an idle server."""
+        msg = QMessageBox(self)
+        msg.setWindowTitle("Idle server")
+        msg.setText("Idle server")
+        msg.setInformativeText(message)
+        msg.exec_()
+
+    def docker_error(self):
+        """Report that docker is not available."""
+        msg = QMessageBox(self)
+        msg.setWindowTitle("Docker error")
+        msg.setIcon(QMessageBox.Critical)
+        msg.setText("Docker Error")
+        msg.setInformativeText(
+            "The application cannot communicate with docker.\n"
+            "Please ensure that docker is running\n")
+        msg.exec_()
+
     def moveEvent(self, event):
         """Move the progress dialog when main window moves."""
         super().moveEvent(event)
@@ -676,14 +1434,13 @@ class LabsLauncher(QMainWindow):
         if "unknown" in self.docker.status.value:
             # the app just started
             return
-        stats = None
         if state == 'stop':
             stats = self.docker.final_stats
         else:
-            stats = self.docker.container.stats(stream=False)
-        self.logger.info("Sending ping data, state={}.".format(state))
-        self.pinger.send_container_ping(
-            state, stats, self.docker.image_name)
+            # collected on the telemetry thread
+            stats = self.docker.container_stats
+        self.logger.info("Queueing ping data, state={}.".format(state))
+        self.telemetry.container_ping(state, self.docker.image_name, stats)
 
 
 class About(QDialog):
@@ -708,6 +1465,384 @@ class About(QDialog):
         self.setLayout(self.layout)
 
 
+class DiskUsageDlg(QDialog):
+    """Dialog displaying disk usage of server images, allowing pruning."""
+
+    columns = ("Version", "Size (Gb)", "Unique (Gb)", "Shared (Gb)", "State")
+
+    def __init__(self, parent=None):
+        """Initialize the dialog."""
+        super().__init__(parent)
+        self.logger = self.parent().logger
+        self.setWindowTitle("Disk usage")
+        self.resize(500, 350)
+        self.layout = QVBoxLayout()
+        self.worker = None
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.Stretch)
+        self.layout.addWidget(self.table)
+        self.summary_lbl = QLabel()
+        self.summary_lbl.setWordWrap(True)
+        self.layout.addWidget(self.summary_lbl)
+
+        self.l0 = QHBoxLayout()
+        self.prune_btn = QPushButton("Remove old versions")
+        self.prune_btn.clicked.connect(self.prune)
+        self.l0.addWidget(self.prune_btn)
+        self.refresh_btn = QPushButton("Refresh")
+        self.refresh_btn.clicked.connect(self.refresh)
+        self.l0.addWidget(self.refresh_btn)
+        self.close_btn = QPushButton("Close")
+        self.close_btn.clicked.connect(self.close)
+        self.l0.addWidget(self.close_btn)
+        self.layout.addLayout(self.l0)
+        self.setLayout(self.layout)
+
+    @property
+    def keep(self):
+        """Return the number of versions to keep."""
+        return self.parent().settings["keep_images"]
+
+    def showEvent(self, event):
+        """Refresh the table when the dialog is shown."""
+        self.refresh()
+        super().showEvent(event)
+
+    def _run(self, fn, callback, *args):
+        """Run a docker query in the thread pool."""
+        for btn in (self.prune_btn, self.refresh_btn):
+            btn.setEnabled(False)
+        self.worker = Worker(fn, *args)
+        self.worker.setAutoDelete(True)
+        self.worker.signals.result.connect(callback)
+        self.worker.signals.error.connect(self.on_error)
+        self.worker.signals.finished.connect(self.on_finished)
+        self.parent().closing.connect(self.worker.stop)
+        self.parent().pool.start(self.worker)
+
+    def refresh(self, *args):
+        """Query the image disk usage in the background."""
+        self.summary_lbl.setText("Querying docker for disk usage...")
+        self._run(self._query, self.on_usage)
+
+    def _query(self, progress=None, stopped=None):
+        """Return images and reclaimable space."""
+        docker = self.parent().docker
+        images = docker.image_usage()
+        reclaim = docker.mark_removable(images, self.keep)
+        return images, reclaim
+
+    @Slot(object)
+    def on_usage(self, result):
+        """Display image disk usage."""
+        images, reclaim = result
+        gb = 1024 ** 3
+        self.table.setRowCount(len(images))
+        for i, img in enumerate(images):
+            state = "removable" if img['removable'] else "kept"
+            if img['in_use']:
+                state = "in use"
+            values = (
+                img['tag'], "{:.2f}".format(img['size'] / gb),
+                "{:.2f}".format(img['unique_size'] / gb),
+                "{:.2f}".format(img['shared_size'] / gb), state)
+            for j, value in enumerate(values):
+                self.table.setItem(i, j, QTableWidgetItem(value))
+        self.summary_lbl.setText(
+            "{} version(s) using {:.1f}Gb. Keeping the newest {} version(s) "
+            "and those in use, {:.1f}Gb can be reclaimed.".format(
+                len(images), sum(x['unique_size'] for x in images) / gb,
+                self.keep, reclaim / gb))
+        self.prune_btn.setEnabled(reclaim > 0)
+
+    def prune(self):
+        """Remove old images in the background."""
+        self.summary_lbl.setText("Removing old versions...")
+        self._run(self.parent().docker.prune_images, self.on_pruned, self.keep)
+
+    def auto_prune(self, image):
+        """Remove old images after a completed pull, if enabled.
+
+        :param image: the pulled image, None if the pull was cancelled.
+        """
+        if not self.parent().settings["auto_prune"]:
+            return
+        if image is not None and self.worker is None:
+            self.logger.info("Automatically removing old images.")
+            self.prune()
+
+    @Slot(object)
+    def on_pruned(self, result):
+        """Report the result of pruning and refresh the table."""
+        removed, reclaim = result
+        self.logger.info("Removed versions: {}.".format(", ".join(removed)))
+        if self.isVisible():
+            QTimer.singleShot(0, self.refresh)
+
+    @Slot(tuple)
+    def on_error(self, error):
+        """Display an error from the background query."""
+        self.summary_lbl.setText(
+            "Failed to query docker: {}".format(error[1]))
+
+    def on_finished(self):
+        """Re-enable buttons when the background query completes."""
+        self.worker = None
+        self.refresh_btn.setEnabled(True)
+
+
+class PullsDlg(QDialog):
+    """Dialog displaying queued, running and finished image pulls."""
+
+    columns = ("Tag", "State", "Attempts", "Duration", "Size", "Rate")
+
+    def __init__(self, manager, pool, parent=None):
+        """Initialize the dialog.
+
+        :param manager: the `pulls.PullManager`.
+        :param pool: a `QThreadPool` on which to query the pull limit.
+        """
+        super().__init__(parent)
+        self.manager = manager
+        self.pool = pool
+        self.setWindowTitle("Downloads")
+        self.resize(600, 300)
+        self.layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.Stretch)
+        self.layout.addWidget(self.table)
+        self.limit_lbl = QLabel()
+        self.layout.addWidget(self.limit_lbl)
+
+        self.l0 = QHBoxLayout()
+        self.cancel_btn = QPushButton("Cancel download")
+        self.cancel_btn.clicked.connect(self.cancel)
+        self.l0.addWidget(self.cancel_btn)
+        self.close_btn = QPushButton("Close")
+        self.close_btn.clicked.connect(self.close)
+        self.l0.addWidget(self.close_btn)
+        self.layout.addLayout(self.l0)
+        self.setLayout(self.layout)
+        self.jobs = list()
+        self.manager.changed.connect(self.refresh)
+
+    def showEvent(self, event):
+        """Refresh the jobs and pull limit when the dialog is shown."""
+        self.refresh()
+        worker = Worker(self.manager.client.pull_budget)
+        worker.setAutoDelete(True)
+        worker.signals.result.connect(lambda _: self.refresh())
+        worker.signals.error.connect(self.on_limit_error)
+        self.pool.start(worker)
+        super().showEvent(event)
+
+    @Slot(tuple)
+    def on_limit_error(self, error):
+        """Show that the pull limit could not be queried."""
+        self.limit_lbl.setText(
+            "{} (failed to query the registry)".format(
+                self.manager.client.registry_client.budget.describe()))
+
+    def refresh(self):
+        """Fill the table with the current jobs and the pull limit."""
+        if not self.isVisible():
+            return
+        self.limit_lbl.setText(
+            self.manager.client.registry_client.budget.describe())
+        self.jobs = self.manager.jobs()
+        self.table.setRowCount(len(self.jobs))
+        for i, job in enumerate(self.jobs):
+            rate = job.throughput
+            values = (
+                job.tag, job.state, str(job.attempts),
+                "{:.1f}s".format(job.duration),
+                "" if job.size is None else format_size(job.size),
+                "" if rate is None else "{}/s".format(format_size(rate)))
+            for j, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if j > 1:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, j, item)
+
+    def cancel(self):
+        """Cancel the selected download."""
+        rows = {x.row() for x in self.table.selectedIndexes()}
+        for row in rows:
+            self.jobs[row].cancel()
+
+
+class UsageDlg(QDialog):
+    """Dialog displaying the resource usage of recent server sessions."""
+
+    columns = (
+        "Started", "Version", "Duration", "Peak CPU", "CPU time",
+        "Peak memory", "Disk I/O", "Network")
+
+    def __init__(self, store, parent=None):
+        """Initialize the dialog.
+
+        :param store: the `usage.UsageStore`.
+        """
+        super().__init__(parent)
+        self.store = store
+        self.setWindowTitle("Usage")
+        self.resize(750, 350)
+        self.layout = QVBoxLayout()
+        self.worker = None
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.ResizeToContents)
+        self.layout.addWidget(self.table)
+        self.summary_lbl = QLabel()
+        self.summary_lbl.setWordWrap(True)
+        self.layout.addWidget(self.summary_lbl)
+
+        self.l0 = QHBoxLayout()
+        self.refresh_btn = QPushButton("Refresh")
+        self.refresh_btn.clicked.connect(self.refresh)
+        self.l0.addWidget(self.refresh_btn)
+        self.close_btn = QPushButton("Close")
+        self.close_btn.clicked.connect(self.close)
+        self.l0.addWidget(self.close_btn)
+        self.layout.addLayout(self.l0)
+        self.setLayout(self.layout)
+
+    def showEvent(self, event):
+        """Refresh the table when the dialog is shown."""
+        self.refresh()
+        super().showEvent(event)
+
+    def refresh(self, *args):
+        """Query the usage history in the background."""
+        if self.worker is not None:
+            return
+        self.refresh_btn.setEnabled(False)
+        self.worker = Worker(self._query)
+        self.worker.setAutoDelete(True)
+        self.worker.signals.result.connect(self.on_usage)
+        self.worker.signals.error.connect(self.on_error)
+        self.worker.signals.finished.connect(self.on_finished)
+        self.parent().pool.start(self.worker)
+
+    def _query(self, progress=None, stopped=None):
+        """Return recent sessions and the overall summary."""
+        return self.store.sessions(), self.store.summary()
+
+    @Slot(object)
+    def on_usage(self, result):
+        """Display the usage of sessions."""
+        sessions, summary = result
+        self.table.setRowCount(len(sessions))
+        for i, session in enumerate(sessions):
+            values = (
+                time.strftime(
+                    '%Y-%m-%d %H:%M', time.localtime(session['started'])),
+                session['tag'],
+                format_duration(session['ended'] - session['started']),
+                "{:.2f}".format(session['cpu_peak']),
+                format_duration(session['cpu_seconds']),
+                format_size(session['mem_peak']),
+                format_size(session['blk_read'] + session['blk_write']),
+                format_size(session['net_rx'] + session['net_tx']))
+            for j, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if j > 1:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, j, item)
+        if summary['sessions'] == 0:
+            self.summary_lbl.setText("No usage has been recorded.")
+            return
+        self.summary_lbl.setText(
+            "Over {} session(s) totalling {}: peak memory {} (95% of "
+            "sessions within {}), peak CPU {:.2f} cores (95% of sessions "
+            "within {:.2f}).".format(
+                summary['sessions'], format_duration(summary['duration']),
+                format_size(summary['mem_max']),
+                format_size(summary['mem_p95']), summary['cpu_max'],
+                summary['cpu_p95']))
+
+    @Slot(tuple)
+    def on_error(self, error):
+        """Display an error from the background query."""
+        self.summary_lbl.setText(
+            "Failed to read usage history: {}".format(error[1]))
+
+    def on_finished(self):
+        """Re-enable refreshing when the background query completes."""
+        self.worker = None
+        self.refresh_btn.setEnabled(True)
+
+
+class ApiStatsDlg(QDialog):
+    """Dialog displaying statistics of docker API calls."""
+
+    columns = (
+        ("Endpoint", "endpoint", "{}"), ("Calls", "calls", "{}"),
+        ("Errors", "errors", "{}"), ("Total (s)", "total", "{:.2f}"),
+        ("Mean (ms)", "mean", "{:.1f}"), ("Bytes", "bytes", "{}"))
+
+    def __init__(self, parent=None):
+        """Initialize the dialog."""
+        super().__init__(parent)
+        self.logger = self.parent().logger
+        self.setWindowTitle("Docker API statistics")
+        self.resize(700, 400)
+        self.layout = QVBoxLayout()
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels([x[0] for x in self.columns])
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.Stretch)
+        self.layout.addWidget(self.table)
+
+        self.l0 = QHBoxLayout()
+        self.refresh_btn = QPushButton("Refresh")
+        self.refresh_btn.clicked.connect(self.refresh)
+        self.l0.addWidget(self.refresh_btn)
+        self.log_btn = QPushButton("Write to log")
+        self.log_btn.clicked.connect(self.log_stats)
+        self.l0.addWidget(self.log_btn)
+        self.close_btn = QPushButton("Close")
+        self.close_btn.clicked.connect(self.close)
+        self.l0.addWidget(self.close_btn)
+        self.layout.addLayout(self.l0)
+        self.setLayout(self.layout)
+
+    def showEvent(self, event):
+        """Refresh the statistics when the dialog is shown."""
+        self.refresh()
+        super().showEvent(event)
+
+    def refresh(self):
+        """Fill the table with the current statistics."""
+        rows = dockerapi.summary()
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, (_, key, fmt) in enumerate(self.columns):
+                item = QTableWidgetItem(fmt.format(row[key]))
+                if j > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, j, item)
+
+    def log_stats(self):
+        """Write the statistics to the log."""
+        self.logger.info(
+            "Docker API statistics:\n{}".format(dockerapi.format_summary()))
+
+
 class SettingsDlg(QDialog):
     """About dialog."""
 
@@ -735,6 +1870,9 @@ class SettingsDlg(QDialog):
                 wid = QLineEdit(text=value)
                 if key == 'registry':
                     wid.setEnabled(False)
+            elif setting['type'] is int:
+                wid = QLineEdit(text=str(value))
+                wid.setValidator(QIntValidator(0, 65535))
             elif setting['type'] is bool:
                 wid = QCheckBox()
                 wid.setChecked(value)
@@ -769,24 +1907,20 @@ class SettingsDlg(QDialog):
     def store_settings(self):
         """Save settings in edit fields to Qt settings manager."""
         self.logger.info("Saving configuration.")
-        for key, wid in self.val_boxes.items():
-            value = None
-            if isinstance(wid, QLineEdit):
-                value = wid.text()
-            elif isinstance(wid, QCheckBox):
-                value = wid.isChecked()
-            else:
-                raise TypeError("Unhandled widget type when setting item.")
-            self.settings[key] = value
-        self.settings.qsettings.sync()
-        msg = QMessageBox()
-        msg.setIcon(QMessageBox.Information)
-        msg.setText("Restart Application")
-        msg.setInformativeText(
-            "Please restart the Launcher application for settings "
-            "to take effect.")
-        msg.setWindowTitle("Restart Notice")
-        msg.exec_()
+        with profiling.profile('settings_save'), \
+                tracing.span('ui.settings_save'):
+            for key, wid in self.val_boxes.items():
+                value = None
+                if isinstance(wid, QLineEdit):
+                    if not wid.hasAcceptableInput():
+                        continue
+                    value = wid.text()
+                elif isinstance(wid, QCheckBox):
+                    value = wid.isChecked()
+                else:
+                    raise TypeError(
+                        "Unhandled widget type when setting item.")
+                self.settings[key] = value
         self.close()
 
     def set_defaults(self):
@@ -798,7 +1932,7 @@ class SettingsDlg(QDialog):
         for key, wid in self.val_boxes.items():
             value = self.settings.spec.by_key[key]['default']
             if isinstance(wid, QLineEdit):
-                wid.setText(value)
+                wid.setText(str(value))
             elif isinstance(wid, QCheckBox):
                 value = wid.setChecked(value)
             else:
@@ -814,6 +1948,15 @@ def main():
         description="EPI2ME Labs Server Management.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         parents=[labslauncher.log_level(), settings.parser])
+    parser.add_argument(
+        '--profile', nargs='?', metavar='DIR',
+        const=os.path.join(labslauncher.__LOGDIR__, 'profiles'),
+        help='Write profiles of startup and operations to DIR '
+             '(default ~/.labslauncher/profiles if given without a value).')
+    parser.add_argument(
+        '--watchdog', nargs='?', type=int, const=250, metavar='MS',
+        help='Log stalls of the user interface longer than MS '
+             'milliseconds (default 250 if given without a value).')
     args = parser.parse_args()
     settings.override(args)
 
@@ -826,7 +1969,8 @@ def main():
     # setup logging
     os.makedirs(labslauncher.__LOGDIR__, exist_ok=True)
     formatter = logging.Formatter(
-        '[%(asctime)s - %(name)s] %(message)s', datefmt='%H:%M:%S')
+        '[%(asctime)s.%(msecs)03d - %(name)s] %(message)s',
+        datefmt='%H:%M:%S')
     logger = logging.getLogger(__package__)
     logger.setLevel(args.log_level)
     filehandler = logging.handlers.RotatingFileHandler(
@@ -841,8 +1985,18 @@ def main():
     # write unhandled exceptions to log, and force exit
     labslauncher.handle_unhandled(logger)
 
+    # optionally report stalls in the event loop
+    if args.watchdog is not None:
+        watchdog = StallDetector(threshold=args.watchdog / 1000)
+        app.aboutToQuit.connect(watchdog.stop)
+        watchdog.start()
+
+    if args.profile is not None:
+        profiling.enable(args.profile)
+
     # start gui
     logger.info("Starting application.")
-    launcher = LabsLauncher(app, settings)
-    launcher.show()
+    with profiling.profile('startup'):
+        launcher = LabsLauncher(app, settings)
+        launcher.show()
     sys.exit(app.exec_())
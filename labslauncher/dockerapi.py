@@ -0,0 +1,286 @@
+"""Docker API clients which record statistics of each API call.
+
+A single `SharedClient` holds the connection pool to the docker daemon,
+which is used for all API calls, including streams, such that idle
+connections are kept alive and reused rather than reopened.
+"""
+import os
+import ssl
+import threading
+import time
+
+import docker
+from docker.transport.unixconn import UnixHTTPAdapter, UnixHTTPConnectionPool
+import requests
+
+import labslauncher
+from labslauncher import metrics, tracing
+
+
+API_LATENCY = metrics.Histogram(
+    "labslauncher_docker_api_seconds",
+    "Duration of docker API requests by endpoint.", labels=("endpoint",))
+API_BYTES = metrics.Counter(
+    "labslauncher_docker_api_response_bytes_total",
+    "Size of docker API responses by endpoint, excluding streams.",
+    labels=("endpoint",))
+# connections kept alive to the daemon, streams hold a connection whilst
+# open and further connections are opened, and discarded, as required.
+MAX_POOL_SIZE = 4
+
+
+def record(endpoint, duration, status, size):
+    """Record the statistics of an API call.
+
+    :param endpoint: endpoint name, see `metrics.api_endpoint`.
+    :param duration: duration (s) of the call.
+    :param status: HTTP status code, or "error" if no response was received.
+    :param size: size of the response (bytes).
+    """
+    API_LATENCY.observe(duration, endpoint=endpoint)
+    metrics.API_CALLS.inc(endpoint=endpoint, status=status)
+    API_BYTES.inc(size, endpoint=endpoint)
+    # missing images and containers are expected in normal operation
+    if status == "error" or (status >= 400 and status != 404):
+        metrics.API_ERRORS.inc(endpoint=endpoint)
+
+
+def _cert_files(cert_path):
+    """Return the CA, certificate and key files in a folder."""
+    return tuple(
+        os.path.join(os.path.expanduser(cert_path), x)
+        for x in ('ca.pem', 'cert.pem', 'key.pem'))
+
+
+def client_kwargs(host=None, cert_path=None):
+    """Return the arguments with which to create a docker client.
+
+    :param host: the docker host, e.g. 'tcp://server:2376' or
+        'ssh://user@server'. If not given the environment is used, as
+        for the docker command line.
+    :param cert_path: folder containing ca.pem, cert.pem and key.pem for a
+        tcp host using TLS, as `DOCKER_CERT_PATH`.
+    """
+    if not host:
+        return docker.utils.kwargs_from_env()
+    kwargs = dict(base_url=host)
+    if cert_path:
+        ca, cert, key = _cert_files(cert_path)
+        kwargs['tls'] = docker.tls.TLSConfig(
+            client_cert=(cert, key), ca_cert=ca, verify=True)
+    return kwargs
+
+
+def ssl_context(cert_path):
+    """Return an SSL context for a tcp host using TLS.
+
+    :param cert_path: folder containing ca.pem, cert.pem and key.pem.
+    """
+    ca, cert, key = _cert_files(cert_path)
+    context = ssl.create_default_context(cafile=ca)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class _UnixAdapter(UnixHTTPAdapter):
+    """Unix socket adapter with a single connection pool.
+
+    `UnixHTTPAdapter` keeps a pool per request URL, such that connections
+    are reused only for requests to the same URL, and pools are closed as
+    they are evicted.
+    """
+
+    def __init__(self, *args, max_pool_size=MAX_POOL_SIZE, **kwargs):
+        """Initialize the adapter, arguments are as `UnixHTTPAdapter`."""
+        self.max_pool_size = max_pool_size
+        super().__init__(*args, **kwargs)
+
+    def get_connection(self, url, proxies=None):
+        """Return the connection pool for a URL."""
+        with self.pools.lock:
+            pool = self.pools.get(self.socket_path)
+            if pool is None:
+                pool = UnixHTTPConnectionPool(
+                    url, self.socket_path, self.timeout,
+                    maxsize=self.max_pool_size)
+                self.pools[self.socket_path] = pool
+        return pool
+
+
+class InstrumentedAPIClient(docker.APIClient):
+    """A low-level docker API client recording each API call."""
+
+    def __init__(self, *args, max_pool_size=MAX_POOL_SIZE, **kwargs):
+        """Initialize the client.
+
+        :param max_pool_size: connections kept alive to the daemon.
+
+        Other arguments are as `docker.APIClient`.
+        """
+        kwargs.setdefault('num_pools', 1)
+        super().__init__(*args, **kwargs)
+        if isinstance(getattr(self, '_custom_adapter', None),
+                      UnixHTTPAdapter):
+            adapter = _UnixAdapter(
+                self._custom_adapter.socket_path, self.timeout,
+                pool_connections=1, max_pool_size=max_pool_size)
+            self._custom_adapter.close()
+            self._custom_adapter = adapter
+            self.mount('http+docker://', adapter)
+        elif self.base_url.startswith('http://'):
+            self.mount('http://', requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=max_pool_size))
+
+    def send(self, request, **kwargs):
+        """Send a request, recording its endpoint, duration and size."""
+        endpoint = metrics.api_endpoint(request.method, request.url)
+        start = time.perf_counter()
+        try:
+            with tracing.span("docker.{}".format(endpoint), root=False):
+                response = super().send(request, **kwargs)
+        except Exception:
+            record(endpoint, time.perf_counter() - start, "error", 0)
+            raise
+        duration = time.perf_counter() - start
+        size = response.headers.get('Content-Length')
+        if size is not None:
+            size = int(size)
+        elif not kwargs.get('stream', False):
+            size = len(response.content)
+        else:
+            size = 0
+        record(endpoint, duration, response.status_code, size)
+        return response
+
+
+class InstrumentedDockerClient(docker.client.DockerClient):
+    """A high-level docker client recording each API call."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the client, arguments are as `docker.DockerClient`."""
+        self.api = InstrumentedAPIClient(*args, **kwargs)
+
+
+class SharedClient():
+    """A docker client shared by all users of the docker daemon.
+
+    The client is created once and its connections are reused. If the
+    daemon cannot be reached, further attempts are delayed with an
+    exponential backoff, during which calls fail immediately.
+    """
+
+    def __init__(self, max_pool_size=MAX_POOL_SIZE, min_backoff=1,
+                 max_backoff=30, host=None, cert_path=None):
+        """Initialize the shared client.
+
+        :param max_pool_size: connections kept alive to the daemon.
+        :param min_backoff: delay (s) after the first failure.
+        :param max_backoff: maximum delay (s) between attempts.
+        :param host: the docker host, see `client_kwargs`.
+        :param cert_path: folder of TLS certificates, see `client_kwargs`.
+        """
+        self.max_pool_size = max_pool_size
+        self.host = host
+        self.cert_path = cert_path
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.logger = labslauncher.get_named_logger("DckrConn")
+        self._client = None
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = 0
+
+    def _backoff(self):
+        """Raise a `ConnectionError` if an attempt should not be made."""
+        remaining = self._retry_at - time.monotonic()
+        if remaining > 0:
+            raise ConnectionError(
+                "Could not communicate with docker, retrying in "
+                "{:.1f}s.".format(remaining))
+
+    def _failed(self):
+        """Record a failure, delaying the next attempt."""
+        with self._lock:
+            self._failures += 1
+            delay = min(
+                self.min_backoff * 2 ** (self._failures - 1),
+                self.max_backoff)
+            self._retry_at = time.monotonic() + delay
+
+    def get(self):
+        """Return the client, creating it if required.
+
+        :raises ConnectionError: if the client cannot be created.
+        """
+        if self._client is None:
+            self._backoff()
+            try:
+                client = InstrumentedDockerClient(
+                    max_pool_size=self.max_pool_size,
+                    **client_kwargs(self.host, self.cert_path))
+            except Exception as e:
+                self._failed()
+                raise ConnectionError(
+                    "Could not create docker client: {}".format(e))
+            with self._lock:
+                if self._client is None:
+                    self._client = client
+                else:
+                    client.close()
+        return self._client
+
+    def check(self):
+        """Return the client, once the daemon has responded.
+
+        :raises ConnectionError: if the daemon does not respond.
+        """
+        client = self.get()
+        self._backoff()
+        try:
+            with metrics.DOCKER_RTT.time():
+                client.version()
+        except Exception as e:
+            self._failed()
+            raise ConnectionError(
+                "Failed to query docker client: {}".format(e))
+        if self._failures > 0:
+            self.logger.info(
+                "Docker responded after {} failed attempts.".format(
+                    self._failures))
+            self._failures = 0
+        return client
+
+    def close(self):
+        """Close the connections to the daemon."""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+
+def summary():
+    """Return statistics of API calls per endpoint.
+
+    :returns: list of dictionaries, sorted by total time descending.
+    """
+    rows = list()
+    for labels in API_LATENCY.labelsets():
+        endpoint = labels["endpoint"]
+        total, count = API_LATENCY.totals(endpoint=endpoint)
+        rows.append({
+            "endpoint": endpoint, "calls": count,
+            "errors": metrics.API_ERRORS.value(endpoint=endpoint),
+            "total": total, "mean": total / count if count else 0,
+            "bytes": API_BYTES.value(endpoint=endpoint)})
+    return sorted(rows, key=lambda x: x["total"], reverse=True)
+
+
+def format_summary():
+    """Return API call statistics as text."""
+    lines = ["{:<36} {:>7} {:>6} {:>9} {:>9} {:>11}".format(
+        "endpoint", "calls", "errors", "total(s)", "mean(ms)", "bytes")]
+    for row in summary():
+        lines.append("{:<36} {:>7} {:>6} {:>9.2f} {:>9.1f} {:>11}".format(
+            row["endpoint"], row["calls"], row["errors"], row["total"],
+            1000 * row["mean"], row["bytes"]))
+    return "\n".join(lines)
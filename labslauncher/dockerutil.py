@@ -1,9 +1,14 @@
 """Miscellaneous utility functions to support labslauncher application."""
 
+import asyncio
+import contextlib
 import functools
+import hashlib
 import json
 import os
-import platform
+import sys
+import threading
+import time
 import traceback
 
 from cachetools import cached, TTLCache
@@ -14,33 +19,111 @@ import requests
 import semver
 
 import labslauncher
-from labslauncher import qtext
+from labslauncher import metrics, mounts, qtext, tracing
+from labslauncher.aioengine import EngineError
+from labslauncher.dockerapi import (
+    InstrumentedAPIClient, InstrumentedDockerClient, SharedClient)
+from labslauncher.profiling import profiled
+from labslauncher.registry import (
+    get_client, is_limit_error, MANIFEST_TYPES, RateLimited)
 
 
-@cached(cache=TTLCache(maxsize=1, ttl=300))
-def _get_image_meta(image):
+HUB_URL = 'https://hub.docker.com'
+# label holding the hash of the configuration a container was created with
+CONFIG_LABEL = 'org.epi2melabs.launcher.config'
+# exit codes of a container stopped by `docker stop`
+STOP_EXIT_CODES = (0, 137, 143)
+# suffix of a container name whilst it is removed in the background
+REMOVING_SUFFIX = '-removing'
+# architectures reported by `docker info` and their registry names
+ARCH_NAMES = {
+    'x86_64': 'amd64', 'x86-64': 'amd64', 'aarch64': 'arm64',
+    'armv7l': 'arm', 'i386': '386', 'i686': '386'}
+_tag_cache = TTLCache(maxsize=1, ttl=300)
+# layers of local images, by image ID. Images are immutable, entries
+# expire such that those of removed images are dropped.
+_local_layers = TTLCache(maxsize=256, ttl=3600)
+_local_layers_lock = threading.Lock()
+
+
+@cached(cache=_tag_cache)
+def _fetch_image_meta(image):
     """Retrieve meta data from docker hub for tags of an image.
 
     :param image: image name.
     """
+    metrics.HUB_CACHE_MISSES.inc()
     tags = list()
-    addr = 'https://hub.docker.com/v2/repositories/{}/tags'.format(image)
-    while True:
-        response = requests.get(addr)
-        tags_data = json.loads(response.content.decode())
-        tags.extend(tags_data['results'])
-        if tags_data['next'] is not None:
-            addr = tags_data['next']
-        else:
-            break
+    addr = '{}/v2/repositories/{}/tags'.format(HUB_URL, image)
+    with metrics.HUB_SYNC.time(), tracing.span("hub.tags", root=False):
+        while True:
+            with tracing.span("hub.request", root=False):
+                response = requests.get(addr)
+            tags_data = json.loads(response.content.decode())
+            tags.extend(tags_data['results'])
+            if tags_data['next'] is not None:
+                addr = tags_data['next']
+            else:
+                break
     return tags
 
 
-def get_image_tags(image, prefix='v'):
+def _get_image_meta(image):
+    """Retrieve meta data for tags of an image, cached for 5 minutes.
+
+    :param image: image name.
+    """
+    metrics.HUB_CACHE_REQUESTS.inc()
+    return _fetch_image_meta(image)
+
+
+def normalize_arch(arch):
+    """Return the registry name of an architecture.
+
+    :param arch: an architecture as reported by `docker info` or
+        `uname -m`, e.g. 'x86_64' or 'aarch64'.
+    """
+    arch = arch.lower()
+    return ARCH_NAMES.get(arch, arch)
+
+
+def tag_architectures(meta):
+    """Return the architectures of the images of a tag.
+
+    :param meta: tag meta data from dockerhub, see `get_image_meta`.
+
+    :returns: set of architectures, or None if not known.
+    """
+    images = meta.get('images')
+    if not images:
+        return None
+    return {
+        normalize_arch(x['architecture']) for x in images
+        if x.get('os', 'linux') == 'linux' and 'architecture' in x}
+
+
+def image_size(meta, arch=None):
+    """Return the compressed size of a tag for an architecture.
+
+    :param meta: tag meta data from dockerhub, see `get_image_meta`.
+    :param arch: the architecture, if None or not available the full
+        size of the tag is returned.
+    """
+    for image in meta.get('images') or list():
+        if image.get('os', 'linux') == 'linux' and \
+                normalize_arch(image.get('architecture', '')) == arch:
+            return image['size']
+    return meta['full_size']
+
+
+def get_image_tags(image, prefix='v', arch=None):
     """Retrieve tags from dockerhub of an image.
 
     :param image: image name, organisation/repository.
     :param prefix: prefix by which to filter images.
+    :param arch: if given, only tags with an image for the architecture
+        are returned. Tags for which the architectures are unknown are
+        included.
 
     :returns: sorted list of tags, newest first, ordered by semver.
     """
@@ -50,6 +133,10 @@ def get_image_tags(image, prefix='v'):
         name = t['name']
         if name[0] != prefix:
             continue
+        if arch is not None:
+            archs = tag_architectures(t)
+            if archs is not None and arch not in archs:
+                continue
         try:
             semver.parse(name[1:])
         except ValueError:
@@ -80,6 +167,120 @@ def get_image_meta(image, tag):
     raise IndexError("Tag was not found: \"{}\"".format(tag))
 
 
+def clear_tag_cache():
+    """Clear cached tag information retrieved from dockerhub."""
+    _tag_cache.clear()
+    get_image_meta.cache_clear()
+    get_image_layers.cache_clear()
+
+
+@functools.lru_cache(5)
+def get_image_layers(image, tag, registry='docker.io', arch='amd64'):
+    """Retrieve the layers of an image tag from its registry.
+
+    :param image: image name.
+    :param tag: image tag.
+    :param registry: the registry hosting the image.
+    :param arch: architecture to select from multi-platform images.
+
+    :returns: list of (diff ID, compressed size) tuples, as the layer diff
+        IDs are the layer identifiers known to the local docker daemon.
+
+    :raises RateLimited: if the registry's pull limit is low, the
+        manifests fetched count against the limit.
+    """
+    client = get_client(registry)
+    headers = {'Accept': ', '.join(MANIFEST_TYPES)}
+    with tracing.span("registry.layers", root=False):
+        manifest = client.get(
+            '/manifests/{}'.format(tag), image, essential=False,
+            headers=headers).json()
+        if 'manifests' in manifest:
+            # a multi-platform image, select our platform
+            digest = next(
+                x['digest'] for x in manifest['manifests']
+                if x['platform']['os'] == 'linux'
+                and x['platform']['architecture'] == arch)
+            manifest = client.get(
+                '/manifests/{}'.format(digest), image, essential=False,
+                headers=headers).json()
+        config = client.get(
+            '/blobs/{}'.format(manifest['config']['digest']), image,
+            headers=headers).json()
+    diff_ids = config['rootfs']['diff_ids']
+    sizes = [x['size'] for x in manifest['layers']]
+    if len(diff_ids) != len(sizes):
+        raise ValueError("Manifest and image configuration do not match.")
+    return list(zip(diff_ids, sizes))
+
+
+def local_layers(client):
+    """Return the diff IDs of all layers present locally.
+
+    :param client: a `docker.DockerClient`.
+    """
+    layers = set()
+    for image_id in client.api.images(quiet=True):
+        with _local_layers_lock:
+            image_layers = _local_layers.get(image_id)
+        if image_layers is None:
+            attrs = client.api.inspect_image(image_id)
+            image_layers = attrs['RootFS'].get('Layers', list())
+            with _local_layers_lock:
+                _local_layers[image_id] = image_layers
+        layers.update(image_layers)
+    return layers
+
+
+def download_size(image, tag, client, registry='docker.io', arch='amd64'):
+    """Calculate the bytes to download to pull an image tag.
+
+    Layers shared with images already present are not downloaded, so
+    the size is calculated from the layers of the tag which are not
+    present locally. If the registry cannot be queried, the full size
+    of the tag reported by Docker Hub is returned.
+
+    :param image: image name.
+    :param tag: image tag.
+    :param client: a `docker.DockerClient`.
+    :param registry: the registry hosting the image.
+    :param arch: architecture to select from multi-platform images.
+
+    :returns: tuple of bytes to download and full size of the tag (bytes).
+    """
+    logger = labslauncher.get_named_logger("DckrUtil")
+    try:
+        layers = get_image_layers(image, tag, registry=registry, arch=arch)
+    except RateLimited as e:
+        logger.info("Not retrieving image layers: {}".format(e))
+        total = image_size(get_image_meta(image, tag), arch)
+        return total, total
+    except Exception:
+        logger.exception("Failed to retrieve image layers from registry.")
+        total = image_size(get_image_meta(image, tag), arch)
+        return total, total
+    present = local_layers(client)
+    total = sum(size for _, size in layers)
+    needed = sum(size for diff_id, size in layers if diff_id not in present)
+    logger.info(
+        "Pull of {}:{} requires {} of {} layers, {:.1f} of {:.1f}Mb.".format(
+            image, tag, sum(1 for x, _ in layers if x not in present),
+            len(layers), needed / 1024 ** 2, total / 1024 ** 2))
+    return needed, total
+
+
+def _tag_order(tag, prefix='v'):
+    """Return a sort key ordering tags by semver, then by name."""
+    if tag.startswith(prefix):
+        try:
+            version = semver.VersionInfo.parse(tag[len(prefix):])
+        except ValueError:
+            pass
+        else:
+            return (1, version, '')
+    return (0, semver.VersionInfo.parse('0.0.0'), tag)
+
+
 def newest_tag(image, tags=None, client=None):
     """Find the newest available local tag of an image.
 
@@ -87,7 +288,7 @@ def newest_tag(image, tags=None, client=None):
     :param client: a docker client.
     """
     if client is None:
-        client = docker.from_env()
+        client = InstrumentedDockerClient.from_env()
     if tags is None:
         tags = get_image_tags(image)
 
@@ -103,35 +304,95 @@ def newest_tag(image, tags=None, client=None):
     return latest
 
 
-def pull_with_progress(image, tag):
+def pull_with_progress(image, tag, total=None, client=None, platform=None):
     """Pull an image, yielding download progress.
 
+    The pull stream is closed, releasing its connection, when the
+    generator is closed.
+
     :param image: image name.
     :param tag: image tag.
+    :param total: bytes to download, see `download_size`. If not given
+        the full size of the tag is used.
+    :param client: a low-level `docker.APIClient`. If not given a client
+        is created for the pull.
+    :param platform: the platform to pull, e.g. 'linux/arm64'. If not
+        given the daemon's platform is pulled.
 
     :yields: downloaded bytes, total bytes.
 
+    :raises RateLimited: if the registry's pull limit has been reached.
+
     """
-    if platform.system() == "Darwin":
+    registry, _ = docker.auth.resolve_repository_name(image)
+    registry_client = get_client(registry)
+    registry_client.check()
+
+    if sys.platform == "darwin":
         path = "/Applications/Docker.app/Contents/Resources/bin/"
         if path not in os.environ['PATH']:
             os.environ['PATH'] = "{}:{}".format(path, os.environ['PATH'])
 
-    image_tag = get_image_meta(image, tag)
-    total = image_tag['full_size']
+    if total is None:
+        arch = None if platform is None else platform.split('/')[1]
+        total = image_size(get_image_meta(image, tag), arch)
 
     # to get feedback we need to use the low-level API
-    client = docker.APIClient()
+    own_client = client is None
+    if own_client:
+        client = InstrumentedAPIClient(**docker.utils.kwargs_from_env())
 
     layers = dict()
-    pull_log = client.pull(image, tag=tag, stream=True)
-    for response in (x.decode() for x in pull_log):
-        for line in response.splitlines():
-            resp = json.loads(line)
-            if "status" in resp and resp["status"] == "Downloading":
-                layers[resp['id']] = resp["progressDetail"]["current"]
-                current = sum(layers.values())
-                yield current, total
+    start = time.monotonic()
+    # as `APIClient.pull`, but holding the response such that it can be
+    # closed if the pull is abandoned
+    headers = dict()
+    auth = docker.auth.get_config_header(client, registry)
+    if auth:
+        headers['X-Registry-Auth'] = auth
+    params = {'fromImage': image, 'tag': tag}
+    if platform is not None:
+        params['platform'] = platform
+    try:
+        with tracing.span("docker.pull", root=False, tag=tag):
+            response = client._post(
+                client._url('/images/create'), headers=headers,
+                params=params, stream=True, timeout=None)
+            try:
+                client._raise_for_status(response)
+                for chunk in client._stream_helper(response):
+                    for line in chunk.decode().splitlines():
+                        resp = json.loads(line)
+                        if 'error' in resp:
+                            raise docker.errors.APIError(resp['error'])
+                        if resp.get("status") == "Downloading":
+                            layers[resp['id']] = \
+                                resp["progressDetail"]["current"]
+                            current = sum(layers.values())
+                            yield min(current, total), total
+            except docker.errors.APIError as e:
+                if is_limit_error(e):
+                    raise registry_client.refused(e) from e
+                raise
+            finally:
+                response.close()
+    finally:
+        if own_client:
+            client.close()
+    registry_client.budget.consume()
+    _record_pull(sum(layers.values()), time.monotonic() - start)
+
+
+def _record_pull(downloaded, duration):
+    """Record the metrics of a completed pull.
+
+    :param downloaded: bytes downloaded.
+    :param duration: duration (s) of the pull.
+    """
+    metrics.PULL_BYTES.inc(downloaded)
+    metrics.PULL_DURATION.observe(duration)
+    if duration > 0:
+        metrics.PULL_THROUGHPUT.set(downloaded / duration)
 
 
 class DockerClient():
@@ -140,11 +401,24 @@ class DockerClient():
     status = qtext.Property(('', 'unknown'))
     tag = qtext.StringProperty('')
     _available = qtext.BoolProperty(False)
+    # whether status and tag are from a saved state, yet to be confirmed
+    stale = qtext.BoolProperty(False)
 
     def __init__(
             self, image_name, server_name, data_bind, container_cmd,
-            host_only, fixed_tag=None, registry='docker.io'):
-        """Initialize the client."""
+            host_only, fixed_tag=None, registry='docker.io', stop_timeout=10,
+            state=None, connection=None):
+        """Initialize the client.
+
+        :param connection: a `dockerapi.SharedClient` through which docker
+            is accessed, if not given one is created.
+
+        :param state: last known state, see `labslauncher.state`. If given
+            the status and tag are initialized from the state, which is
+            marked as stale, and `reconcile` should be run in the
+            background to query docker. Otherwise docker is queried
+            immediately.
+        """
         self.image_name = image_name
         self.server_name = server_name
         self.data_bind = data_bind
@@ -152,6 +426,7 @@ class DockerClient():
         self.host_only = host_only
         self.fixed_tag = fixed_tag
         self.registry = registry
+        self.stop_timeout = stop_timeout
         # TODO: plumb in registry
         self.logger = labslauncher.get_named_logger("DckrClnt")
         # throttle connection errors to once every 5 minutes
@@ -170,35 +445,84 @@ class DockerClient():
            fixed tag: {}""".format(
                image_name, server_name, data_bind, container_cmd,
                host_only, fixed_tag))
-        self._client = None
+        self.connection = SharedClient() if connection is None \
+            else connection
+        self._connected = False
         self.total_size = None
+        self._arch = None
         self.final_stats = None
-        self.is_running()  # sets up tag, status, and available
+        self._stats_sample = (0, None)
+        self.container_id = None
+        # a `staging.Stager` if data is staged in a volume
+        self.staging = None
+        # name of the docker host if it is another computer, and a
+        # `remote.Tunnel` if the server's ports are forwarded from it
+        self.remote_host = None
+        self.tunnel = None
+        # additional mounts, see `labslauncher.mounts`
+        self.extra_mounts = ''
+        self.scratch_bind = '/scratch/'
+        self.scratch_size = 0
+        self.last_latest_tag = None
+        self.last_update_available = False
         self.heartbeat = QTimer()
         self.heartbeat.setInterval(1000*5)  # 5 seconds
-        self.heartbeat.start()
         self.heartbeat.timeout.connect(self.is_running)
+        if state is None:
+            self.is_running()  # sets up tag, status, and available
+            self.heartbeat.start()
+        else:
+            self.container_id = state['container_id']
+            self.last_latest_tag = state['latest_tag']
+            self.last_update_available = state['update_available']
+            self.stale.value = True
+            self.tag.value = state['tag']
+            self.status.value = ('', state['status'])
+
+    def reconcile(self, progress=None, stopped=None):
+        """Query docker to replace the state given on initialization.
+
+        The heartbeat should be started once this has completed.
+        """
+        with tracing.span("docker.reconcile"):
+            if not self.is_running():
+                # the saved state cannot be confirmed
+                self.tag.value = 'unknown'
+                self.set_status('unknown')
+            self.stale.value = False
+            if self._available.value:
+                try:
+                    self.update_available
+                except Exception:
+                    self.logger.exception("Failed to check for updates.")
+
+    def state(self):
+        """Return the current state, see `labslauncher.state`.
+
+        Values which require network access are those last retrieved.
+        """
+        return {
+            'container_id': self.container_id,
+            'status': self.status.value[1], 'tag': self.tag.value,
+            'latest_tag': self.last_latest_tag,
+            'update_available': self.last_update_available}
 
     @property
     def docker(self):
-        """Return a connected docker client."""
-        old_client = self._client
-        if self._client is None:
-            try:
-                self._client = docker.client.DockerClient.from_env()
-            except Exception:
-                self.logger.exception("Could not create docker client:")
-                pass
+        """Return a connected docker client.
+
+        The client, and its connections, are shared by all calls.
+        """
         try:
-            self._client.version()
-        except Exception:
-            self.logger.exception("Failed to query docker client:")
-            self._client = None
+            client = self.connection.check()
+        except ConnectionError as e:
+            self.logger.warning("Failed to query docker client: {}".format(e))
+            self._connected = False
             raise ConnectionError("Could not communicate with docker.")
-        else:
-            if old_client is None:
-                self.logger.info("Connection to docker (re)established.")
-        return self._client
+        if not self._connected:
+            self.logger.info("Connection to docker (re)established.")
+            self._connected = True
+        return client
 
     def is_running(self):
         """Return whether docker is connected.
@@ -206,6 +530,11 @@ class DockerClient():
         Note if True value does not guaranteed subsequent API calls
         will necessarily succeed.
         """
+        with metrics.HEARTBEAT.time():
+            return self._is_running()
+
+    def _is_running(self):
+        """Check docker connection and update state."""
         try:
             value = self.docker is not None
         except ConnectionError:
@@ -220,12 +549,48 @@ class DockerClient():
                 self.set_status('unknown')
         return self._available.value
 
+    def set_image(self, image_name, registry='docker.io'):
+        """Change the image used for the server.
+
+        :param image_name: image name, organisation/repository.
+        :param registry: the container registry from which to download.
+        """
+        self.logger.info(
+            "Changing image to: {}/{}.".format(registry, image_name))
+        self.image_name = image_name
+        self.registry = registry
+        self.refresh_tag()
+
+    def set_fixed_tag(self, fixed_tag=None):
+        """Change the fixed tag of the image.
+
+        :param fixed_tag: tag to use, if None the newest tag is used.
+        """
+        self.logger.info("Changing fixed tag to: {}.".format(fixed_tag))
+        self.fixed_tag = fixed_tag
+        clear_tag_cache()
+        self.refresh_tag()
+
+    def refresh_tag(self):
+        """Update the tag property from the local images."""
+        if self._available.value:
+            self.tag.value = self.latest_available_tag
+
     @property
     def latest_tag(self):
         """Return the latest tag on dockerhub."""
         if self.fixed_tag is not None:
             return self.fixed_tag
-        return get_image_tags(self.image_name)[0]
+        tags = get_image_tags(self.image_name, arch=self.arch)
+        if len(tags) == 0:
+            # no tag runs natively, see `pull_arch`
+            tags = get_image_tags(self.image_name)
+        self.last_latest_tag = tags[0]
+        return self.last_latest_tag
+
+    def get_latest_tag(self, progress=None, stopped=None):
+        """Return the latest tag on dockerhub, from a worker thread."""
+        return self.latest_tag
 
     @property
     def latest_available_tag(self):
@@ -235,11 +600,19 @@ class DockerClient():
         return newest_tag(self.image_name, client=self.docker)
 
     @property
+    @profiled('update_check')
     def update_available(self):
-        """Return whether an updated tag available on dockerhub."""
+        """Return whether an updated tag available on dockerhub.
+
+        Whilst the state is stale the last known value is returned.
+        """
+        if self.stale.value:
+            return self.last_update_available
         if not self._available.value:
             return False
-        return self.latest_available_tag != self.latest_tag
+        self.last_update_available = \
+            self.latest_available_tag != self.latest_tag
+        return self.last_update_available
 
     def full_image_name(self, tag=None):
         """Return the image name for the requested tag.
@@ -276,6 +649,90 @@ class DockerClient():
                 image = self.pull_image(tag)
         return image
 
+    @property
+    def arch(self):
+        """Return the architecture of the docker daemon's host."""
+        if self._arch is None:
+            try:
+                arch = self.docker.info().get('Architecture')
+            except docker.errors.APIError:
+                arch = None
+            if arch is None:
+                arch = self.docker.version().get('Arch', 'amd64')
+            self._arch = normalize_arch(arch)
+        return self._arch
+
+    @property
+    def platform(self):
+        """Return the native platform of the docker daemon."""
+        return "linux/{}".format(self.arch)
+
+    def pull_arch(self, tag):
+        """Return the architecture to pull for a tag.
+
+        The daemon's architecture is used if the tag provides it, or if
+        the architectures of the tag are unknown. Otherwise an image for
+        another architecture is pulled, which docker runs under emulation.
+
+        :param tag: the image tag.
+
+        :returns: tuple of the architecture and whether it is emulated.
+        """
+        try:
+            archs = tag_architectures(get_image_meta(self.image_name, tag))
+        except Exception as e:
+            self.logger.warning(
+                "Failed to retrieve tag architectures: {}".format(e))
+            archs = None
+        if archs is None or len(archs) == 0 or self.arch in archs:
+            return self.arch, False
+        arch = 'amd64' if 'amd64' in archs else sorted(archs)[0]
+        self.logger.warning(
+            "Tag {} has no image for {}, the {} image will be run under "
+            "emulation.".format(tag, self.arch, arch))
+        return arch, True
+
+    def image_arch(self, tag=None):
+        """Return the architecture of a local image, or None if absent.
+
+        :param tag: the image tag, by default the most recent local tag.
+        """
+        try:
+            image = self.docker.images.get(self.full_image_name(tag=tag))
+        except (docker.errors.ImageNotFound, ValueError):
+            return None
+        return normalize_arch(image.attrs.get('Architecture', self.arch))
+
+    @property
+    def registry_client(self):
+        """Return the client of the registry hosting the image."""
+        return get_client(self.registry)
+
+    def pull_budget(self, progress=None, stopped=None):
+        """Query the registry's pull rate limit, without consuming it.
+
+        :returns: the `registry.PullBudget`.
+        """
+        tag = self.fixed_tag or self.last_latest_tag or 'latest'
+        return self.registry_client.refresh(self.image_name, tag)
+
+    def pull_size(self, tag=None, arch=None, progress=None, stopped=None):
+        """Return the bytes to download to pull a tag.
+
+        :param tag: tag to fetch. If None the latest tag is used.
+        :param arch: architecture to fetch, see `pull_arch`.
+
+        :returns: tuple of bytes to download and full size of the tag.
+        """
+        if tag is None:
+            tag = self.latest_tag
+        if arch is None:
+            arch, _ = self.pull_arch(tag)
+        return download_size(
+            self.image_name, tag, self.docker, registry=self.registry,
+            arch=arch)
+
+    @profiled('pull')
     def pull_image(self, tag=None, progress=None, stopped=None):
         """Pull an image tag whilst updating download progress.
 
@@ -290,19 +747,164 @@ class DockerClient():
         full_name = self.full_image_name(tag=tag)
 
         # to get feedback we need to use the low-level API
-        self.total_size = None
-        for current, total in pull_with_progress(self.image_name, tag):
-            if stopped is not None and stopped.is_set():
-                return None
-            if progress is not None:
-                progress.emit(100 * current / total)
-            self.total_size = total
+        arch, _ = self.pull_arch(tag)
+        self.total_size, _ = self.pull_size(tag, arch)
+        pull = pull_with_progress(
+            self.image_name, tag, total=self.total_size,
+            client=self.docker.api, platform="linux/{}".format(arch))
+        with contextlib.closing(pull):
+            for current, total in pull:
+                if stopped is not None and stopped.is_set():
+                    return None
+                if progress is not None and total > 0:
+                    progress.emit(100 * current / total)
         progress.emit(100.0)
         image = self.docker.images.get(full_name)
         self.tag.value = self.latest_available_tag
         self.logger.info("Finished pulling image")
         return image
 
+    async def pull_image_async(self, engine, tag=None, on_progress=None):
+        """Pull an image tag with the asynchronous engine client.
+
+        Cancelling the coroutine closes the pull stream, such that the
+        pull stops immediately.
+
+        :param engine: an `aioengine.AsyncEngine`.
+        :param tag: tag to fetch. If None the latest tag is pulled.
+        :param on_progress: function called with the download progress.
+
+        :returns: the image object.
+        """
+        self.registry_client.check()
+        loop = asyncio.get_event_loop()
+        if tag is None:
+            tag = await loop.run_in_executor(
+                None, lambda: self.latest_tag)
+        self.logger.info("Starting pull of image tag: {}.".format(tag))
+        full_name = self.full_image_name(tag=tag)
+        arch, _ = await loop.run_in_executor(None, self.pull_arch, tag)
+        self.total_size, _ = await loop.run_in_executor(
+            None, self.pull_size, tag, arch)
+        total = self.total_size
+        layers = dict()
+
+        def on_item(resp):
+            if 'error' in resp:
+                raise EngineError(500, resp['error'])
+            if resp.get("status") == "Downloading":
+                layers[resp['id']] = resp["progressDetail"]["current"]
+                if on_progress is not None and total > 0:
+                    on_progress(
+                        100 * min(sum(layers.values()), total) / total)
+
+        start = time.monotonic()
+        try:
+            await engine.pull(
+                self.image_name, tag, on_item,
+                platform="linux/{}".format(arch))
+        except EngineError as e:
+            if is_limit_error(e):
+                raise self.registry_client.refused(e) from e
+            raise
+        self.registry_client.budget.consume()
+        _record_pull(sum(layers.values()), time.monotonic() - start)
+        if on_progress is not None:
+            on_progress(100.0)
+
+        def finish():
+            image = self.docker.images.get(full_name)
+            self.tag.value = self.latest_available_tag
+            return image
+        image = await loop.run_in_executor(None, finish)
+        self.logger.info("Finished pulling image")
+        return image
+
+    def image_usage(self):
+        """Return the disk usage of local tags of the image.
+
+        :returns: list of dictionaries with keys: tag, id, size (bytes),
+            shared_size (bytes shared with other images), unique_size,
+            in_use (whether used by a container) and removable. The list
+            is ordered newest tag first.
+        """
+        usage = self.docker.df()
+        used = set(
+            c.get('ImageID') for c in usage.get('Containers') or list())
+        prefix = "{}:".format(self.image_name)
+        images = list()
+        for img in usage.get('Images') or list():
+            for ref in img.get('RepoTags') or list():
+                if not ref.startswith(prefix):
+                    continue
+                shared = max(img.get('SharedSize', 0), 0)
+                images.append({
+                    'tag': ref[len(prefix):], 'id': img['Id'],
+                    'size': img['Size'], 'shared_size': shared,
+                    'unique_size': img['Size'] - shared,
+                    'in_use': img['Id'] in used
+                    or img.get('Containers', 0) > 0})
+        images.sort(key=lambda x: _tag_order(x['tag']), reverse=True)
+        return images
+
+    def mark_removable(self, images, keep):
+        """Mark which images can be removed to reclaim space.
+
+        The newest `keep` tags, the fixed tag, the tag currently in use by
+        the launcher and tags used by containers are kept.
+
+        :param images: list from `image_usage`.
+        :param keep: number of newest tags to keep.
+
+        :returns: bytes reclaimed by removing the removable images.
+        """
+        kept = set(x['tag'] for x in images[:keep])
+        kept.add(self.fixed_tag)
+        kept.add(self.tag.value)
+        for img in images:
+            img['removable'] = not (img['tag'] in kept or img['in_use'])
+        # an image is deleted only when all of its tags are removed
+        keep_ids = set(x['id'] for x in images if not x['removable'])
+        reclaim = dict()
+        for img in images:
+            if img['removable'] and img['id'] not in keep_ids:
+                reclaim[img['id']] = img['unique_size']
+        return sum(reclaim.values())
+
+    @tracing.traced('docker.prune_images')
+    def prune_images(self, keep, progress=None, stopped=None):
+        """Remove old tags of the image.
+
+        :param keep: number of newest tags to keep, see `mark_removable`.
+
+        :returns: tuple of removed tags and reclaimed bytes.
+        """
+        images = self.image_usage()
+        reclaim = self.mark_removable(images, keep)
+        remove = [x['tag'] for x in images if x['removable']]
+        removed = list()
+        for i, tag in enumerate(remove):
+            if stopped is not None and stopped.is_set():
+                break
+            name = self.full_image_name(tag=tag)
+            self.logger.info("Removing image: {}.".format(name))
+            try:
+                self.docker.images.remove(name)
+            except docker.errors.APIError:
+                self.logger.exception("Failed to remove image.")
+            else:
+                removed.append(tag)
+            if progress is not None:
+                progress.emit(100 * (i + 1) / len(remove))
+        if len(removed) < len(remove):
+            # some space was not reclaimed, report what actually changed
+            before = sum(x['size'] for x in images)
+            after = sum(x['size'] for x in self.image_usage())
+            reclaim = max(before - after, 0)
+        self.logger.info("Removed {} image(s), reclaimed {:.1f}Gb.".format(
+            len(removed), reclaim / 1024 ** 3))
+        return removed, reclaim
+
     @property
     def container(self):
         """Return the server container if one is present, else None."""
@@ -314,70 +916,370 @@ class DockerClient():
             pass
         return None
 
-    def start_container(self, mount, token, port, aux_port):
-        """Start the server container, removing a previous one if necessary.
+    @property
+    def server_host(self):
+        """Return the remote host serving the notebook server.
 
-        .. note:: The behaviour of docker.run is that a pull will be invoked if
-            the image is not available locally. To ensure more controlled
-            behaviour check .fetch_local_image() first.
+        :returns: the host name, or None if the server is reached on this
+            computer, including when its ports are forwarded.
         """
-        self.logger.info("Starting container.")
-        self.clear_container()
+        if self.remote_host is None or self.tunnel is not None:
+            return None
+        return self.remote_host
+
+    @staticmethod
+    def published_ports(cont):
+        """Return the host ports published by a container.
+
+        :param cont: the container.
+        """
+        ports = set()
+        bindings = cont.attrs['HostConfig'].get('PortBindings') or dict()
+        for binding in bindings.values():
+            for item in binding or list():
+                ports.add(int(item['HostPort']))
+        return ports
+
+    def forward_ports(self, progress=None, stopped=None):
+        """Forward the ports of the running server from a remote host.
+
+        The tunnel is opened, or reopened if the ports have changed, if
+        the server is running, else it is closed.
+
+        :raises RuntimeError: if the ports could not be forwarded.
+        """
+        if self.tunnel is None:
+            return
+        cont = self.container
+        if cont is None or cont.status != 'running':
+            self.tunnel.stop()
+            return
+        ports = tuple(sorted(self.published_ports(cont)))
+        if self.tunnel.running and self.tunnel.ports == ports:
+            return
+        self.tunnel.start(ports)
+
+    def container_stats(self, progress=None, stopped=None):
+        """Return a snapshot of the server container statistics, or None."""
+        cont = self.container
+        if cont is None:
+            return None
+        stats = cont.stats(stream=False)
+        self._stats_sample = (time.monotonic(), stats)
+        return stats
+
+    def _collect_final_stats(self, cont, max_age=120):
+        """Collect the final statistics of the container.
+
+        A sample taken within `max_age` seconds is used if available, else
+        the statistics are collected in a background thread such that the
+        container can be stopped concurrently.
+
+        :returns: a function returning the statistics, waiting up to a
+            given timeout for their collection.
+        """
+        sampled, stats = self._stats_sample
+        if stats is not None and time.monotonic() - sampled < max_age:
+            return lambda timeout=None: stats
+        result = [stats]
+
+        def collect():
+            try:
+                result[0] = cont.stats(stream=False)
+            except Exception:
+                self.logger.exception("Failed to collect container stats.")
+        thread = threading.Thread(target=collect, daemon=True)
+        thread.start()
+
+        def get(timeout=None):
+            thread.join(timeout)
+            return result[0]
+        return get
+
+    def _terminate(self, cont, progress=None, start=0, end=100):
+        """Stop the container, killing it after the stop grace period.
+
+        SIGTERM is sent to allow the notebook server to shut down and save
+        its state, SIGKILL is sent if it has not exited after
+        `stop_timeout` seconds.
+
+        :param cont: the container.
+        :param progress: signal to which progress is emitted.
+        :param start: progress value at the start of the grace period.
+        :param end: progress value at the end of the grace period.
+        """
+        self.logger.info(
+            "Stopping container, grace period {}s.".format(
+                self.stop_timeout))
+        deadline = time.monotonic() + self.stop_timeout
+        try:
+            cont.kill(signal='SIGTERM')
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if progress is not None:
+                    progress.emit(
+                        end - (end - start) * remaining
+                        / max(self.stop_timeout, 1))
+                try:
+                    cont.wait(timeout=min(remaining, 0.5))
+                except requests.exceptions.RequestException:
+                    pass
+                else:
+                    self.logger.info("Container stopped.")
+                    return
+            self.logger.warning(
+                "Container did not stop within {}s, killing.".format(
+                    self.stop_timeout))
+            cont.kill()
+        except docker.errors.APIError as e:
+            # the container exited between requests
+            if e.status_code != 409:
+                raise
+        self.logger.info("Container stopped.")
+
+    def _remove(self, cont):
+        """Remove a container, and those left by previous removals."""
+        with tracing.span("docker.remove_container"):
+            try:
+                cont.remove(force=True)
+                self.logger.info("Container removed.")
+                for old in self.docker.containers.list(
+                        all=True, filters={
+                            'name': self.server_name + REMOVING_SUFFIX}):
+                    old.remove(force=True)
+            except Exception:
+                self.logger.exception("Failed to remove container.")
+
+    def _container_config(self, mount, token, port, aux_port):
+        """Return the arguments with which to run the server container.
+
+        :returns: tuple of keyword arguments for `containers.run` and a hash
+            of the configuration.
+        :raises ValueError: if the extra mounts are invalid.
+        """
+        name = self.full_image_name()
         CMD = self.container_cmd.split() + [
             "--NotebookApp.token={}".format(token),
             "--port={}".format(port)]
+        # note: colab requires the port in the container to be equal
+        ports = {int(port): int(port), int(aux_port): int(aux_port)}
+        if self.host_only:
+            ports = {
+                int(port): ('127.0.0.1', int(port)),
+                int(aux_port): ('127.0.0.1', int(aux_port))}
+        volumes = {mount: {'bind': self.data_bind, 'mode': 'rw'}}
+        if self.staging is not None:
+            volumes.update(self.staging.volumes())
+        kwargs = dict(
+            image=name, command=CMD, ports=ports,
+            environment=['JUPYTER_ENABLE_LAB=yes'], volumes=volumes,
+            name=self.server_name)
+        extra = mounts.parse(self.extra_mounts)
+        if len(extra) > 0:
+            kwargs['mounts'] = mounts.docker_mounts(extra)
+        tmpfs = mounts.scratch(self.scratch_bind, self.scratch_size)
+        if len(tmpfs) > 0:
+            kwargs['tmpfs'] = tmpfs
+        # the image ID distinguishes a tag which has been pulled again
+        try:
+            image_id = self.docker.images.get(name).id
+        except docker.errors.ImageNotFound:
+            image_id = name
+        config = dict(kwargs, image=image_id)
+        digest = hashlib.sha256(
+            json.dumps(config, sort_keys=True).encode()).hexdigest()
+        return kwargs, digest
 
+    def _resume_container(self, cont, progress=None):
+        """Start, unpause or restart an existing container.
+
+        A running container is stopped within `stop_timeout`, see
+        `_terminate`, and started again.
+
+        :param progress: signal to which progress is emitted.
+
+        :returns: True if the container was resumed.
+        """
+        self.logger.info(
+            "Reusing container with unchanged configuration, "
+            "status: {}.".format(cont.status))
         try:
-            # note: colab requires the port in the container to be equal
-            ports = {int(port): int(port), int(aux_port): int(aux_port)}
-            if self.host_only:
-                ports = {
-                    int(port): ('127.0.0.1', int(port)),
-                    int(aux_port): ('127.0.0.1', int(aux_port))}
-            self.docker.containers.run(
-                self.full_image_name(),
-                CMD,
-                detach=True,
-                ports=ports,
-                environment=['JUPYTER_ENABLE_LAB=yes'],
-                volumes={
-                    mount: {
-                        'bind': self.data_bind, 'mode': 'rw'}},
-                name=self.server_name)
-        except Exception:
-            self.logger.exception(
-                    "Failed to start container.")
-            self.last_failure = traceback.format_exc()
-            self.last_failure_type = 'unknown'
-            win_fs_msg = "Filesharing has been cancelled"
-            osx_fs_msg = "Mounts denied"
-            if (win_fs_msg in self.last_failure) \
-                    or (osx_fs_msg in self.last_failure):
-                self.logger.warning("Detected that sharing was disabled.")
-                self.last_failure_type = "file_share"
-        else:
+            if cont.status == "paused":
+                cont.unpause()
+            elif cont.status == "running":
+                self._terminate(cont, progress=progress, start=0, end=90)
+                cont.start()
+            else:
+                cont.start()
+        except docker.errors.APIError:
+            self.logger.exception("Failed to reuse container.")
+            return False
+        return True
+
+    @tracing.traced('docker.start_container')
+    def start_container(
+            self, mount, token, port, aux_port, progress=None, stopped=None):
+        """Start the server container.
+
+        An existing container is reused if it was created with the same
+        image, command, ports and mount, else it is removed and a new
+        container is created. An existing container is stopped gracefully,
+        this should therefore be called from a worker thread.
+
+        :param progress: signal to which progress is emitted whilst an
+            existing container is stopped.
+
+        .. note:: The behaviour of docker.run is that a pull will be invoked if
+            the image is not available locally. To ensure more controlled
+            behaviour check .fetch_local_image() first.
+        """
+        self.logger.info("Starting container.")
+        try:
+            kwargs, digest = self._container_config(
+                mount, token, port, aux_port)
+        except ValueError as e:
+            self.logger.error("Invalid container configuration: {}".format(e))
+            self.last_failure = str(e)
+            self.last_failure_type = 'config'
+            self.set_status()
+            return
+        cont = self.container
+        resumed = False
+        if cont is not None and cont.labels.get(CONFIG_LABEL) == digest:
+            resumed = self._resume_container(cont, progress=progress)
+        started = time.monotonic()
+        if not resumed:
+            self.clear_container(progress=progress)
+            started = time.monotonic()
+            try:
+                self.docker.containers.run(
+                    detach=True, labels={CONFIG_LABEL: digest}, **kwargs)
+            except Exception:
+                self.logger.exception(
+                        "Failed to start container.")
+                self.last_failure = traceback.format_exc()
+                self.last_failure_type = 'unknown'
+                win_fs_msg = "Filesharing has been cancelled"
+                osx_fs_msg = "Mounts denied"
+                if (win_fs_msg in self.last_failure) \
+                        or (osx_fs_msg in self.last_failure):
+                    self.logger.warning("Detected that sharing was disabled.")
+                    self.last_failure_type = "file_share"
+                started = None
+        if started is not None:
             self.logger.info("Container started.")
+            context = tracing.current()
+            thread = threading.Thread(
+                target=self._wait_ready,
+                args=(port, started),
+                kwargs={
+                    "trace": (context, tracing.flow_start(context))},
+                daemon=True)
+            thread.start()
         self.final_stats = None
         self.set_status()
 
-    def clear_container(self, *args):
-        """Kill and remove the server container."""
+    def _wait_ready(self, port, started, timeout=120, trace=(None, None)):
+        """Wait for the notebook server to respond after starting.
+
+        :param port: the port of the notebook server.
+        :param started: time (`time.monotonic()`) the container was started.
+        :param timeout: time (s) after which to give up.
+        :param trace: trace context and flow of the starting thread.
+        """
+        with tracing.attach(*trace), tracing.span("server.wait_ready"):
+            self._poll_ready(port, started, timeout)
+
+    def _poll_ready(self, port, started, timeout):
+        """Poll the notebook server until it responds."""
+        addr = "http://{}:{}/api".format(
+            self.server_host or '127.0.0.1', port)
+        while time.monotonic() - started < timeout:
+            try:
+                requests.get(addr, timeout=2)
+            except requests.exceptions.RequestException:
+                time.sleep(0.5)
+            else:
+                duration = time.monotonic() - started
+                metrics.START_READY.observe(duration)
+                self.logger.info(
+                    "Notebook server ready after {:.1f}s.".format(duration))
+                return
+        self.logger.warning(
+            "Notebook server did not respond within {}s.".format(timeout))
+
+    @profiled('stop')
+    @tracing.traced('docker.stop_container')
+    def stop_container(
+            self, pause=False, remove=False, progress=None, stopped=None):
+        """Stop or pause the server container.
+
+        Final statistics of the container are collected whilst it is
+        stopped. A removed container is renamed, such that a new container
+        can be created immediately, and is removed in the background.
+
+        :param pause: pause the container rather than stopping it, such
+            that the state of the notebook server's kernels is kept.
+        :param remove: remove the container once stopped.
+        :param progress: signal to which progress is emitted.
+        """
         cont = self.container
-        if cont is not None:
-            if cont.status == "running":
-                self.logger.info("Stopping container.")
-                self.final_stats = cont.stats(stream=False)
-                cont.kill()
-                self.logger.info("Container stopped.")
+        if cont is None:
+            self.set_status()
+            return
+        if progress is not None:
+            progress.emit(0)
+        final_stats = None
+        if cont.status == "paused" and not pause:
+            # signals are not delivered to a paused container
+            cont.unpause()
+            cont.reload()
+        if cont.status == "running":
+            final_stats = self._collect_final_stats(cont)
+            if pause:
+                self.logger.info("Pausing container.")
+                cont.pause()
+                self.logger.info("Container paused.")
+            else:
+                self._terminate(cont, progress=progress, start=5, end=90)
+        if remove:
             self.logger.info("Removing container.")
-            cont.remove()
-            self.logger.info("Container removed.")
+            cont.rename("{}{}-{}".format(
+                self.server_name, REMOVING_SUFFIX, cont.short_id))
+            threading.Thread(
+                target=self._remove, args=(cont,), daemon=True).start()
+        if final_stats is not None:
+            self.final_stats = final_stats(timeout=5)
+        if progress is not None:
+            progress.emit(100)
         self.set_status()
 
+    def clear_container(self, *args, progress=None, stopped=None):
+        """Stop and remove the server container."""
+        self.stop_container(remove=True, progress=progress)
+
+    @staticmethod
+    def _stopped_cleanly(cont):
+        """Return whether an exited container was stopped by the launcher.
+
+        Containers created by the launcher which were stopped, rather than
+        having failed, can be resumed.
+        """
+        state = cont.attrs['State']
+        return (
+            CONFIG_LABEL in cont.labels
+            and state.get('ExitCode') in STOP_EXIT_CODES
+            and not state.get('OOMKilled', False))
+
     def set_status(self, new=None):
         """Set the container status property."""
         # store the old and the new status
         if self._available.value and new is None:
             c = self.container
             new = "inactive" if c is None else c.status
+            self.container_id = None if c is None else c.id
+            if new == "exited" and self._stopped_cleanly(c):
+                new = "stopped"
         self.status.value = (self.status.value[1], new)
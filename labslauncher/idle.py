@@ -0,0 +1,199 @@
+"""Shutdown of an idle notebook server.
+
+The notebook server's activity is polled through the Jupyter REST API.
+Once no kernel is busy and the server has seen no activity for the idle
+period the server is stopped or, alternatively, its idle kernels are
+shut down, freeing memory and CPU for other users of the computer.
+"""
+import time
+
+from PyQt5.QtCore import (
+    pyqtSignal as Signal, pyqtSlot as Slot, QObject, QTimer)
+import requests
+
+import labslauncher
+from labslauncher.qtext import Worker
+from labslauncher.usage import parse_time
+
+
+STOP = 'stop'
+CULL = 'cull'
+ACTIONS = (STOP, CULL)
+# requests of the monitor are not counted as activity by the server
+UNTRACKED = {'no_track_activity': 1}
+
+
+def server_address(cont, host=None):
+    """Return the address and token of the notebook server in a container.
+
+    :param cont: the server container.
+    :param host: the host publishing the server's port, by default this
+        computer.
+
+    :returns: tuple (address, token), token is None if not set.
+    """
+    port, token = None, None
+    for arg in cont.attrs['Args']:
+        if arg.startswith('--port='):
+            port = int(arg.split('=')[1])
+        elif arg.startswith('--NotebookApp.token='):
+            token = arg.split('=', 1)[1]
+    if port is None:
+        return None, token
+    return "http://{}:{}".format(host or '127.0.0.1', port), token
+
+
+class IdleMonitor(QObject):
+    """Poll the activity of the notebook server and act when it is idle.
+
+    idle - emitted with a message when the server should be stopped
+    culled - emitted with a message once idle kernels were shut down
+    """
+
+    idle = Signal(str)
+    culled = Signal(str)
+
+    def __init__(self, client, pool, timeout=0, action=STOP, interval=60):
+        """Initialize the monitor.
+
+        :param client: a `dockerutil.DockerClient`.
+        :param pool: a `QThreadPool` on which to query the server.
+        :param timeout: idle time (minutes) after which to act, 0 to
+            disable the monitor.
+        :param action: one of `ACTIONS`.
+        :param interval: time (s) between polls of the server.
+        """
+        super().__init__()
+        self.client = client
+        self.pool = pool
+        self.timeout = timeout
+        self.action = action
+        self.interval = interval
+        self.logger = labslauncher.get_named_logger("IdleMon")
+        self.last_activity = None
+        self.busy = 0
+        self.worker = None
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.poll)
+        self._session = requests.Session()
+
+    @property
+    def enabled(self):
+        """Return whether the monitor acts on an idle server."""
+        return self.timeout > 0 and self.action in ACTIONS
+
+    @property
+    def active(self):
+        """Return whether the server is being polled."""
+        return self._timer.isActive()
+
+    def start(self):
+        """Start polling the running server, if enabled."""
+        if not self.enabled or self.active:
+            return
+        self.logger.info(
+            "Monitoring server activity, idle {} after {}min.".format(
+                self.action, self.timeout))
+        self.last_activity = None
+        self.busy = 0
+        self._timer.start(int(1000 * self.interval))
+
+    def stop(self):
+        """Stop polling the server."""
+        self._timer.stop()
+
+    def poll(self):
+        """Query the activity of the server in the background."""
+        if self.worker is not None:
+            return
+        self.worker = Worker(self._query, self.timeout * 60, self.action)
+        self.worker.setAutoDelete(True)
+        self.worker.signals.result.connect(self.on_activity)
+        self.worker.signals.error.connect(self.on_error)
+        self.worker.signals.finished.connect(self.on_finished)
+        self.pool.start(self.worker)
+
+    def _get(self, address, path, token):
+        response = self._session.get(
+            "{}{}".format(address, path), params=UNTRACKED, timeout=10,
+            headers={'Authorization': 'token {}'.format(token)})
+        response.raise_for_status()
+        return response.json()
+
+    def _query(self, timeout, action, progress=None, stopped=None):
+        """Query the server status and kernels, culling idle kernels.
+
+        :param timeout: idle time (s) after which to act.
+        :param action: one of `ACTIONS`.
+
+        :returns: dictionary with the server's `last_activity`, the
+            number of `kernels` and `busy` kernels and the names of
+            `culled` kernels, or None if the server is not running.
+        """
+        cont = self.client.container
+        if cont is None or cont.status != 'running':
+            return None
+        address, token = server_address(cont, self.client.server_host)
+        if address is None:
+            return None
+        status = self._get(address, '/api/status', token)
+        kernels = self._get(address, '/api/kernels', token)
+        now = time.time()
+        last = [parse_time(status['last_activity'])]
+        busy = 0
+        culled = list()
+        for kernel in kernels:
+            active = parse_time(kernel['last_activity'])
+            last.append(active)
+            if kernel['execution_state'] == 'busy':
+                busy += 1
+            elif action == CULL and now - active >= timeout:
+                self.logger.info(
+                    "Shutting down kernel {} idle since {}.".format(
+                        kernel['id'], kernel['last_activity']))
+                self._session.delete(
+                    "{}/api/kernels/{}".format(address, kernel['id']),
+                    params=UNTRACKED, timeout=10,
+                    headers={'Authorization': 'token {}'.format(token)}
+                ).raise_for_status()
+                culled.append(kernel['name'])
+        return {
+            'last_activity': max(last), 'kernels': len(kernels),
+            'busy': busy, 'culled': culled}
+
+    @Slot(object)
+    def on_activity(self, activity):
+        """Act on the activity of the server."""
+        if activity is None or not self.active:
+            return
+        self.last_activity = activity['last_activity']
+        self.busy = activity['busy']
+        idle = time.time() - self.last_activity
+        self.logger.debug(
+            "{} kernel(s), {} busy, idle for {:.0f}s.".format(
+                activity['kernels'], self.busy, idle))
+        if len(activity['culled']) > 0:
+            self.culled.emit(
+                "{} kernel(s) of the notebook server were shut down after "
+                "{} minutes without activity: {}.".format(
+                    len(activity['culled']), self.timeout,
+                    ", ".join(activity['culled'])))
+        elif self.action == STOP and self.busy == 0 \
+                and idle >= self.timeout * 60:
+            self.logger.info("Server idle for {:.0f}min, stopping.".format(
+                idle / 60))
+            self.stop()
+            self.idle.emit(
+                "The notebook server was stopped after {} minutes without "
+                "activity, it can be resumed from the launcher.".format(
+                    self.timeout))
+
+    @Slot(tuple)
+    def on_error(self, error):
+        """Log a failure to query the server, which may be starting."""
+        self.logger.warning(
+            "Failed to query server activity: {}".format(error[1]))
+
+    def on_finished(self):
+        """Allow the next poll once the query completes."""
+        self.worker = None
@@ -0,0 +1,366 @@
+"""Lightweight application metrics, served in Prometheus text format.
+
+Metrics are plain in-memory counters updated under a lock; nothing is
+computed or formatted until the endpoint is scraped.
+"""
+import bisect
+import contextlib
+import http.server
+import os
+import re
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import labslauncher
+
+
+REGISTRY = list()
+logger = labslauncher.get_named_logger("Metrics")
+
+
+class _Metric():
+    """Base class for metrics, which register themselves on creation."""
+
+    type = None
+
+    def __init__(self, name, doc, labels=()):
+        """Initialize the metric.
+
+        :param name: the metric name.
+        :param doc: help text for the metric.
+        :param labels: names of the metric's labels.
+        """
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self._values = dict()
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[x]) for x in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra is not None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ""
+        return "{{{}}}".format(",".join(
+            '{}="{}"'.format(
+                k, v.replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in pairs))
+
+    def labelsets(self):
+        """Return the label values for which data has been recorded."""
+        with self._lock:
+            keys = list(self._values.keys())
+        return [dict(zip(self.labelnames, key)) for key in keys]
+
+    def samples(self):
+        """Yield the lines of the metric's samples."""
+        raise NotImplementedError
+
+    def render(self):
+        """Return the metric in Prometheus text format."""
+        lines = [
+            "# HELP {} {}".format(self.name, self.doc),
+            "# TYPE {} {}".format(self.name, self.type)]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Increment the counter.
+
+        :param amount: the increment.
+        :param labels: values of the metric labels.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the current value of the counter."""
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Yield the lines of the metric's samples."""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield "{}{} {}".format(self.name, self._labels(key), value)
+
+
+class Gauge(Counter):
+    """A value which can go up and down, or is computed when scraped."""
+
+    type = "gauge"
+
+    def __init__(self, name, doc, labels=(), func=None):
+        """Initialize the gauge.
+
+        :param func: a function returning the value of an unlabelled
+            gauge, called when the metric is scraped. The gauge is omitted
+            if the function returns None.
+        """
+        super().__init__(name, doc, labels=labels)
+        self.func = func
+
+    def set(self, value, **labels):
+        """Set the gauge value."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        """Yield the lines of the metric's samples."""
+        if self.func is not None:
+            value = self.func()
+            if value is not None:
+                yield "{} {}".format(self.name, value)
+        else:
+            yield from super().samples()
+
+
+class Histogram(_Metric):
+    """Counts of observations in buckets."""
+
+    type = "histogram"
+    default_buckets = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, doc, labels=(), buckets=None):
+        """Initialize the histogram.
+
+        :param buckets: upper bounds of the buckets.
+        """
+        super().__init__(name, doc, labels=labels)
+        if buckets is None:
+            buckets = self.default_buckets
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record an observation.
+
+        :param value: the observed value.
+        :param labels: values of the metric labels.
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [
+                    [0] * (len(self.buckets) + 1), 0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block of code."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def totals(self, **labels):
+        """Return the sum and count of observations."""
+        data = self._values.get(self._key(labels))
+        if data is None:
+            return 0, 0
+        return data[1], data[2]
+
+    def samples(self):
+        """Yield the lines of the metric's samples."""
+        with self._lock:
+            values = [
+                (k, (list(v[0]), v[1], v[2]))
+                for k, v in self._values.items()]
+        for key, (counts, total, count) in sorted(values):
+            cumulative = 0
+            for upper, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                yield "{}_bucket{} {}".format(
+                    self.name, self._labels(key, ("le", str(upper))),
+                    cumulative)
+            yield "{}_sum{} {}".format(self.name, self._labels(key), total)
+            yield "{}_count{} {}".format(self.name, self._labels(key), count)
+
+
+def render():
+    """Return all metrics in Prometheus text format."""
+    text = list()
+    for metric in REGISTRY:
+        try:
+            text.append(metric.render())
+        except Exception:
+            logger.exception("Failed to render metric: {}".format(
+                metric.name))
+    return "\n".join(text) + "\n"
+
+
+_endpoint_patterns = (
+    (re.compile(r'^/v[0-9.]+'), ''),
+    (re.compile(
+        r'^/images/(?!json$|create$|prune$|search$|load$|get$)'
+        r'.+?(/json|/history|/push|/tag|/get)?$'), r'/images/{name}\1'),
+    (re.compile(
+        r'^/(containers|volumes|networks|exec)/(?!json$|create$|prune$)'
+        r'[^/]+'), r'/\1/{id}'))
+
+
+def api_endpoint(method, url):
+    """Return a docker API endpoint name with identifiers removed.
+
+    :param method: the HTTP method.
+    :param url: the request URL.
+    """
+    path = urlsplit(url).path
+    for pattern, repl in _endpoint_patterns:
+        path = pattern.sub(repl, path)
+    return "{} {}".format(method, path)
+
+
+def _rss():
+    """Return the resident set size of the process in bytes."""
+    try:
+        with open('/proc/self/statm', 'r') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # not the current size, but the maximum
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return rss
+
+
+HEARTBEAT = Histogram(
+    "labslauncher_heartbeat_seconds",
+    "Duration of docker heartbeat checks.")
+DOCKER_RTT = Histogram(
+    "labslauncher_docker_rtt_seconds",
+    "Round trip time of docker daemon version queries.")
+API_CALLS = Counter(
+    "labslauncher_docker_api_calls_total",
+    "Docker API requests by endpoint and status.",
+    labels=("endpoint", "status"))
+API_ERRORS = Counter(
+    "labslauncher_docker_api_errors_total",
+    "Failed docker API requests by endpoint.",
+    labels=("endpoint",))
+HUB_SYNC = Histogram(
+    "labslauncher_hub_sync_seconds",
+    "Duration of fetching image tags from Docker Hub.")
+HUB_CACHE_REQUESTS = Counter(
+    "labslauncher_hub_cache_requests_total",
+    "Lookups of Docker Hub image tags.")
+HUB_CACHE_MISSES = Counter(
+    "labslauncher_hub_cache_misses_total",
+    "Lookups of Docker Hub image tags not served from the cache.")
+REGISTRY_PULLS_REMAINING = Gauge(
+    "labslauncher_registry_pulls_remaining",
+    "Pulls remaining within the registry's rate limit, when last reported.",
+    labels=("registry",))
+PULL_BYTES = Counter(
+    "labslauncher_pull_bytes_total",
+    "Bytes downloaded by image pulls.")
+PULL_DURATION = Histogram(
+    "labslauncher_pull_seconds",
+    "Duration of completed image pulls.",
+    buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+PULL_THROUGHPUT = Gauge(
+    "labslauncher_pull_throughput_bytes_per_second",
+    "Average download rate of the most recent image pull.")
+START_READY = Histogram(
+    "labslauncher_container_start_ready_seconds",
+    "Time from starting the server container to the server responding.",
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120))
+WORKER_TASKS = Histogram(
+    "labslauncher_worker_task_seconds",
+    "Duration of background tasks.", labels=("task",),
+    buckets=(0.01, 0.1, 1, 10, 60, 300, 1800, 3600))
+WORKER_ERRORS = Counter(
+    "labslauncher_worker_task_errors_total",
+    "Background tasks which raised an exception.", labels=("task",))
+PROCESS_RSS = Gauge(
+    "labslauncher_process_resident_memory_bytes",
+    "Resident memory size of the launcher.", func=_rss)
+PROCESS_CPU = Gauge(
+    "labslauncher_process_cpu_seconds_total",
+    "CPU time used by the launcher.", func=time.process_time)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serve the metrics page."""
+
+    def do_GET(self):
+        """Respond to a GET request."""
+        if urlsplit(self.path).path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Silence per-request logging."""
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer():
+    """HTTP server for metrics, bound to localhost."""
+
+    def __init__(self, port):
+        """Initialize the server.
+
+        :param port: the port on which to listen.
+        """
+        self.port = port
+        self.server = None
+
+    def start(self):
+        """Start serving metrics in a background thread."""
+        try:
+            self.server = _Server(('127.0.0.1', self.port), _Handler)
+        except OSError:
+            logger.exception(
+                "Could not start metrics server on port {}.".format(
+                    self.port))
+            self.server = None
+            return
+        thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        thread.start()
+        logger.info("Serving metrics at http://127.0.0.1:{}/metrics".format(
+            self.port))
+
+    def stop(self):
+        """Stop serving metrics."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
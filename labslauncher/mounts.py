@@ -0,0 +1,105 @@
+"""Additional mounts of the server container.
+
+Besides the data mount, host folders can be mounted in the server, for
+example read-only reference data, and a size-limited in-memory scratch
+area can be provided for intermediate files. Mounts are specified as
+in `docker run --mount`, separated by `SEPARATOR`, e.g.::
+
+    source=/data/genomes,target=/references,readonly;
+    source=/fast/disk,target=/work,consistency=delegated
+"""
+import collections
+import os
+import posixpath
+
+import docker
+
+
+SEPARATOR = ';'
+CONSISTENCY = ('consistent', 'cached', 'delegated')
+
+Mount = collections.namedtuple(
+    'Mount', ['source', 'target', 'read_only', 'consistency'])
+Mount.__doc__ = """A bind mount of a host folder.
+
+:param source: the host folder.
+:param target: location in the server container.
+:param read_only: whether the mount is read-only.
+:param consistency: one of `CONSISTENCY`, or None for docker's default.
+"""
+
+
+def parse(spec):
+    """Parse a specification of mounts.
+
+    :param spec: mounts separated by `SEPARATOR`, each a comma separated
+        list of `source=`, `target=`, and optionally `readonly` and
+        `consistency=`. `src`, `dst`, `destination` and `ro` are accepted
+        as in `docker run --mount`.
+
+    :returns: list of `Mount`.
+    :raises ValueError: if the specification is invalid.
+    """
+    mounts = list()
+    for item in spec.split(SEPARATOR):
+        item = item.strip()
+        if item == '':
+            continue
+        fields = dict(read_only=False, consistency=None)
+        for option in item.split(','):
+            key, _, value = option.strip().partition('=')
+            if key in ('source', 'src'):
+                fields['source'] = os.path.expanduser(value)
+            elif key in ('target', 'dst', 'destination'):
+                fields['target'] = value
+            elif key in ('readonly', 'ro'):
+                fields['read_only'] = value.lower() not in ('0', 'false')
+            elif key == 'consistency':
+                if value not in CONSISTENCY:
+                    raise ValueError(
+                        "Mount consistency must be one of: {}.".format(
+                            ", ".join(CONSISTENCY)))
+                fields['consistency'] = value
+            else:
+                raise ValueError(
+                    "Unknown mount option '{}' in '{}'.".format(key, item))
+        if 'source' not in fields or 'target' not in fields:
+            raise ValueError(
+                "Mount '{}' requires a source and target.".format(item))
+        if not posixpath.isabs(fields['target']):
+            raise ValueError(
+                "Mount target '{}' is not an absolute path.".format(
+                    fields['target']))
+        mounts.append(Mount(**fields))
+    targets = [posixpath.normpath(x.target) for x in mounts]
+    if len(set(targets)) != len(targets):
+        raise ValueError("Mount targets must be distinct.")
+    return mounts
+
+
+def docker_mounts(mounts):
+    """Return arguments of `containers.run` for mounts.
+
+    :param mounts: list of `Mount`.
+
+    :returns: list of `docker.types.Mount`.
+    """
+    return [
+        docker.types.Mount(
+            x.target, x.source, type='bind', read_only=x.read_only,
+            consistency=x.consistency)
+        for x in mounts]
+
+
+def scratch(target, size):
+    """Return the tmpfs specification of a scratch area.
+
+    :param target: location in the server container.
+    :param size: size (Mb) of the area, 0 for none.
+
+    :returns: dictionary for the `tmpfs` argument of `containers.run`.
+    """
+    if size <= 0:
+        return dict()
+    # writable by the notebook user, as /tmp
+    return {target: 'size={}m,mode=1777'.format(size)}
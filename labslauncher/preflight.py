@@ -0,0 +1,377 @@
+"""Checks of the conditions required to start the notebook server.
+
+Checks are independent and run concurrently, such that all problems are
+found within a small time budget before starting the server, rather than
+one at a time from the failure of `docker run`.
+"""
+import collections
+import concurrent.futures
+import os
+import shutil
+import socket
+import time
+
+import docker
+
+import labslauncher
+from labslauncher import mounts, tracing
+from labslauncher.dockerutil import normalize_arch
+from labslauncher.registry import format_wait
+
+
+CheckResult = collections.namedtuple(
+    'CheckResult', ['name', 'title', 'level', 'message', 'duration'])
+CheckResult.__doc__ = """Result of a pre-flight check.
+
+:param name: identifier of the check.
+:param title: description of the check for display.
+:param level: one of `OK`, `WARNING`, `ERROR` or `SKIPPED`.
+:param message: details of the result.
+:param duration: time (s) taken by the check.
+"""
+
+OK = 'ok'
+WARNING = 'warning'
+ERROR = 'error'
+SKIPPED = 'skipped'
+# messages indicating that a path is not shared with the docker VM
+FILE_SHARE_ERRORS = ("Filesharing has been cancelled", "Mounts denied")
+MIN_CPUS = 2
+MIN_MEMORY = 4 * 1024 ** 3
+# free space kept in addition to downloads
+DISK_MARGIN = 2 * 1024 ** 3
+
+
+class CheckFailed(Exception):
+    """A check found a problem.
+
+    :param message: description of the problem.
+    :param level: severity of the problem.
+    """
+
+    def __init__(self, message, level=ERROR):
+        """Initialize the exception."""
+        super().__init__(message)
+        self.level = level
+
+
+def _size(size):
+    """Format a size in bytes."""
+    return "{:.1f}Gb".format(size / 1024 ** 3)
+
+
+class Preflight():
+    """Run the checks required before starting the server container."""
+
+    checks = (
+        ('docker', "Docker is running"),
+        ('image', "Server image is available"),
+        ('platform', "Server image runs natively"),
+        ('ports', "Ports are free"),
+        ('mount', "Data folders can be shared with docker"),
+        ('disk', "Free disk space"),
+        ('resources', "Docker CPU and memory"))
+
+    def __init__(self, client, mount, port, aux_port, timeout=10):
+        """Initialize the checks.
+
+        :param client: a `dockerutil.DockerClient`.
+        :param mount: the host path to mount in the container.
+        :param port: the notebook server port.
+        :param aux_port: the auxiliary port.
+        :param timeout: time (s) after which unfinished checks are
+            reported as skipped.
+        """
+        self.client = client
+        self.mount = mount
+        self.ports = (int(port), int(aux_port))
+        self.timeout = timeout
+        self.logger = labslauncher.get_named_logger("Prflight")
+        self._info = None
+        self._image = None
+
+    def run(self, progress=None, stopped=None):
+        """Run all checks concurrently.
+
+        :param progress: signal to which progress is emitted.
+
+        :returns: list of `CheckResult`, in the order of `checks`.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.checks) + 2)
+        context = tracing.current()
+        deadline = time.monotonic() + self.timeout
+        with tracing.span("preflight.run", root=False):
+            # results shared by several checks
+            self._info = executor.submit(
+                self._traced, context, "docker.info",
+                lambda: self.client.docker.info())
+            self._image = executor.submit(
+                self._traced, context, "preflight.find_image",
+                self._find_image)
+            futures = [
+                executor.submit(self._check, context, name, title)
+                for name, title in self.checks]
+            results = list()
+            for i, (future, (name, title)) in enumerate(
+                    zip(futures, self.checks)):
+                try:
+                    result = future.result(
+                        timeout=max(deadline - time.monotonic(), 0))
+                except concurrent.futures.TimeoutError:
+                    result = CheckResult(
+                        name, title, SKIPPED,
+                        "Not completed within {}s.".format(self.timeout),
+                        self.timeout)
+                results.append(result)
+                if progress is not None:
+                    progress.emit(100 * (i + 1) / len(self.checks))
+        # don't wait for unfinished checks, their results are discarded
+        executor.shutdown(wait=False)
+        for result in results:
+            self.logger.info("{}: {} ({:.0f}ms) {}".format(
+                result.name, result.level, 1000 * result.duration,
+                result.message))
+        return results
+
+    @staticmethod
+    def _traced(context, name, func):
+        with tracing.attach(context), tracing.span(name, root=False):
+            return func()
+
+    def _check(self, context, name, title):
+        """Run a check, timing it and capturing its result."""
+        start = time.perf_counter()
+        try:
+            with tracing.attach(context), \
+                    tracing.span("preflight.{}".format(name), root=False):
+                message = getattr(self, "check_{}".format(name))()
+        except CheckFailed as e:
+            level, message = e.level, str(e)
+        except Exception as e:
+            self.logger.exception("Check '{}' failed:".format(name))
+            level, message = ERROR, "Check failed: {}".format(e)
+        else:
+            level = OK
+        return CheckResult(
+            name, title, level, message, time.perf_counter() - start)
+
+    def _docker_info(self):
+        try:
+            return self._info.result()
+        except Exception:
+            raise CheckFailed("Docker is not available.", level=SKIPPED)
+
+    def _find_image(self):
+        """Return the local image to be run, or None."""
+        self._docker_info()
+        tag = self.client.latest_available_tag
+        if tag is None:
+            return None
+        try:
+            return self.client.docker.images.get(
+                self.client.full_image_name(tag=tag))
+        except docker.errors.ImageNotFound:
+            return None
+
+    def check_docker(self):
+        """Check that the docker daemon responds."""
+        try:
+            info = self._info.result()
+        except Exception:
+            raise CheckFailed(
+                "Could not communicate with docker, please check that "
+                "docker is installed and running.")
+        return "Docker {} on {}.".format(
+            info.get('ServerVersion', 'unknown'),
+            info.get('OperatingSystem', 'unknown'))
+
+    def check_image(self):
+        """Check whether the server image is present, else its size.
+
+        The registry's pull limit is queried, without counting against
+        it, as a download is refused once the limit is reached.
+        """
+        self._docker_info()
+        if self._image.result() is not None:
+            return "Version {} is present.".format(
+                self.client.latest_available_tag)
+        try:
+            budget = self.client.pull_budget()
+        except Exception as e:
+            self.logger.warning(
+                "Failed to query the pull limit: {}".format(e))
+        else:
+            if budget.remaining() == 0:
+                wait = budget.retry_after()
+                raise CheckFailed(
+                    "The server must be downloaded but the pull limit of "
+                    "Docker Hub has been reached{}.".format(
+                        "" if wait is None
+                        else ", retry after {}".format(format_wait(wait))))
+        needed, _ = self.client.pull_size()
+        raise CheckFailed(
+            "The server will be downloaded before starting, {}.".format(
+                _size(needed)), level=WARNING)
+
+    def _own_ports(self):
+        """Return ports published by the existing server container."""
+        cont = self.client.container
+        if cont is None or cont.status not in ("running", "paused"):
+            return set()
+        return self.client.published_ports(cont)
+
+    def check_platform(self):
+        """Check that the server image is built for the docker host.
+
+        Images for another architecture run under emulation, which is
+        several times slower.
+        """
+        self._docker_info()
+        arch = self.client.arch
+        image = self._image.result()
+        if image is not None:
+            tag = self.client.latest_available_tag
+            image_arch = normalize_arch(image.attrs.get('Architecture', arch))
+        else:
+            tag = self.client.latest_tag
+            image_arch, _ = self.client.pull_arch(tag)
+        if image_arch != arch:
+            raise CheckFailed(
+                "Version {} of the server is built for {} and will run "
+                "under emulation on this {} computer, notebooks will run "
+                "several times slower.".format(tag, image_arch, arch),
+                level=WARNING)
+        return "Version {} is built for {}.".format(tag, arch)
+
+    def check_ports(self):
+        """Check that the ports are not in use by another program.
+
+        The ports of a server on a remote host are checked by docker when
+        it is started, only ports forwarded to this computer are checked.
+        """
+        remote = self.client.remote_host
+        if remote is not None and self.client.tunnel is None:
+            if self.client.host_only:
+                raise CheckFailed(
+                    "The server will be accessible only from {} as "
+                    "'Local access only' is set and its ports are not "
+                    "forwarded.".format(remote), level=WARNING)
+            raise CheckFailed(
+                "Ports are checked by docker on {}.".format(remote),
+                level=SKIPPED)
+        try:
+            own = self._own_ports()
+        except Exception:
+            own = set()
+        host = '127.0.0.1' if self.client.host_only else ''
+        used = list()
+        for port in self.ports:
+            if port in own:
+                continue
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.bind((host, port))
+                except OSError:
+                    used.append(port)
+        if len(used) > 0:
+            raise CheckFailed(
+                "Port(s) {} are in use by another program.".format(
+                    ", ".join(str(x) for x in used)))
+        if len(own) > 0:
+            return "Ports are used by the current server."
+        return "Ports {} are free.".format(
+            ", ".join(str(x) for x in self.ports))
+
+    def check_mount(self):
+        """Check that the data folders can be mounted in a container.
+
+        A short-lived container, running only `true`, is run from the
+        server image with the data folder and extra mounts mounted.
+        """
+        # folders of a remote host are checked only by the probe
+        local = self.client.remote_host is None
+        if local and not os.path.isdir(self.mount):
+            raise CheckFailed("The data folder does not exist.")
+        if local and not os.access(self.mount, os.R_OK | os.W_OK):
+            raise CheckFailed("The data folder is not writable.")
+        try:
+            extra = mounts.parse(self.client.extra_mounts)
+        except ValueError as e:
+            raise CheckFailed("Extra mounts are invalid: {}".format(e))
+        volumes = {self.mount: {'bind': '/mnt/probe', 'mode': 'rw'}}
+        for i, item in enumerate(extra):
+            if local and not os.path.isdir(item.source):
+                raise CheckFailed(
+                    "The folder {} to be mounted does not exist.".format(
+                        item.source))
+            volumes[item.source] = {
+                'bind': '/mnt/probe{}'.format(i),
+                'mode': 'ro' if item.read_only else 'rw'}
+        self._docker_info()
+        image = self._image.result()
+        if image is None:
+            raise CheckFailed(
+                "Sharing with docker is checked once the server is "
+                "downloaded.", level=SKIPPED)
+        try:
+            self.client.docker.containers.run(
+                image.id, entrypoint=['true'], remove=True,
+                network_disabled=True, volumes=volumes)
+        except docker.errors.APIError as e:
+            if any(x in str(e) for x in FILE_SHARE_ERRORS):
+                raise CheckFailed(
+                    "The data folders are not shared with docker. Sharing "
+                    "can be configured from Docker > Settings > Resources "
+                    "> File sharing.")
+            raise
+        return "The data folder can be shared."
+
+    def check_disk(self):
+        """Check free space for downloads and data."""
+        needed = 0
+        if self._image.result() is None:
+            needed, _ = self.client.pull_size()
+        info = self._docker_info()
+        if self.client.remote_host is not None:
+            raise CheckFailed(
+                "Disk space is not checked on {}.".format(
+                    self.client.remote_host), level=SKIPPED)
+        paths = list()
+        if os.path.isdir(self.mount):
+            paths.append((self.mount, DISK_MARGIN))
+        # docker's storage is only accessible when docker runs natively
+        root = info.get('DockerRootDir')
+        if root is not None and os.path.isdir(root):
+            paths.append((root, needed + DISK_MARGIN))
+        messages = list()
+        for path, required in paths:
+            free = shutil.disk_usage(path).free
+            if free < required:
+                raise CheckFailed(
+                    "Only {} free at {}, {} recommended.".format(
+                        _size(free), path, _size(required)), level=WARNING)
+            messages.append("{} free at {}.".format(_size(free), path))
+        return " ".join(messages)
+
+    def check_resources(self):
+        """Check the CPUs and memory available to docker."""
+        info = self._docker_info()
+        cpus = info.get('NCPU', 0)
+        memory = info.get('MemTotal', 0)
+        message = "{} CPUs, {} memory.".format(cpus, _size(memory))
+        if cpus < MIN_CPUS or memory < MIN_MEMORY:
+            raise CheckFailed(
+                "Docker has {} CPUs and {} memory, at least {} CPUs and "
+                "{} are recommended. Resources can be configured from "
+                "Docker > Settings > Resources.".format(
+                    cpus, _size(memory), MIN_CPUS, _size(MIN_MEMORY)),
+                level=WARNING)
+        # the scratch area is held in docker's memory
+        scratch = self.client.scratch_size * 1024 ** 2
+        if scratch > memory / 2:
+            raise CheckFailed(
+                "The scratch area ({}) may use more than half of docker's "
+                "memory ({}).".format(_size(scratch), _size(memory)),
+                level=WARNING)
+        return message
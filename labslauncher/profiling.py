@@ -0,0 +1,112 @@
+"""Optional profiling of application operations."""
+import collections
+import contextlib
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+
+import labslauncher
+
+
+_state = threading.local()
+_lock = threading.Lock()
+_counts = collections.Counter()
+_directory = None
+logger = labslauncher.get_named_logger("Profile")
+
+
+def enable(directory):
+    """Enable profiling of operations.
+
+    :param directory: directory under which to write profiles. A
+        subdirectory is created for each run of the application.
+    """
+    global _directory
+    _directory = os.path.join(
+        os.path.expanduser(directory), time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(_directory, exist_ok=True)
+    logger.info("Writing profiles to: {}.".format(_directory))
+
+
+def enabled():
+    """Return whether profiling is enabled."""
+    return _directory is not None
+
+
+@contextlib.contextmanager
+def profile(name):
+    """Profile a block of code, if profiling is enabled.
+
+    A cProfile `.prof` file and a summary of the top functions are
+    written for each profiled block. Profiling of blocks nested within
+    another profiled block on the same thread is included in the outer
+    profile.
+
+    :param name: name of the operation.
+    """
+    if _directory is None or getattr(_state, 'active', False):
+        yield
+        return
+    _state.active = True
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall = time.perf_counter() - start
+        _state.active = False
+        try:
+            _write(name, profiler, wall)
+        except Exception:
+            logger.exception("Failed to write profile for: {}.".format(name))
+
+
+def profiled(name):
+    """Decorate a function to profile it, if profiling is enabled.
+
+    :param name: name of the operation.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _write(name, profiler, wall, top=25):
+    """Write profile data and a summary."""
+    with _lock:
+        _counts[name] += 1
+        stem = os.path.join(
+            _directory, "{}-{:03d}".format(name, _counts[name]))
+    profiler.dump_stats("{}.prof".format(stem))
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(top)
+    with open("{}.txt".format(stem), 'w') as fh:
+        fh.write("{}: wall time {:.3f}s, thread {}\n\n".format(
+            name, wall, threading.current_thread().name))
+        fh.write(stream.getvalue())
+
+    # most expensive functions by their own time
+    funcs = sorted(
+        stats.stats.items(), key=lambda x: x[1][2], reverse=True)[:3]
+    hot = ", ".join(
+        "{}:{}({}) {:.3f}s".format(
+            os.path.basename(fname), line, func, data[2])
+        for (fname, line, func), data in funcs)
+    summary = "{} wall={:.3f}s top: {}".format(
+        os.path.basename(stem), wall, hot)
+    with _lock:
+        with open(os.path.join(_directory, 'summary.txt'), 'a') as fh:
+            fh.write("{}\n".format(summary))
+    logger.info(summary)
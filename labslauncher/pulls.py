@@ -0,0 +1,365 @@
+"""Management of image pulls.
+
+All pulls are requested from a `PullManager`, which runs them one at a
+time in order of priority. A request for an image tag which is already
+queued or being pulled returns the existing job, such that the tag is
+downloaded once. The job counts its requesters and is cancelled once all
+have released it. Failed pulls are retried after an increasing delay,
+layers completed by docker in a failed attempt are not downloaded again.
+Pulls refused due to the registry's rate limit are not retried, as they
+would be refused until the limit resets.
+"""
+import collections
+import functools
+import heapq
+import itertools
+import time
+
+from PyQt5.QtCore import (
+    pyqtSignal as Signal, pyqtSlot as Slot, QObject, QTimer)
+
+import labslauncher
+from labslauncher.qtext import Worker
+from labslauncher.registry import RateLimited
+
+
+LOW, NORMAL, HIGH = range(3)
+QUEUED = 'queued'
+RUNNING = 'running'
+RETRYING = 'retrying'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class PullJob(QObject):
+    """A pull of an image tag.
+
+    progress - float indicating % progress of the current attempt
+    result - the pulled image
+    error - tuple (exception type, exception) of the last attempt
+    finished - emitted once the pull completes, fails or is cancelled
+    """
+
+    progress = Signal(float)
+    result = Signal(object)
+    error = Signal(tuple)
+    finished = Signal()
+
+    def __init__(self, manager, image, tag, priority):
+        """Initialize the job.
+
+        :param manager: the `PullManager`.
+        :param image: the image name.
+        :param tag: the image tag.
+        :param priority: one of `LOW`, `NORMAL` or `HIGH`.
+        """
+        super().__init__()
+        self.manager = manager
+        self.image = image
+        self.tag = tag
+        self.priority = priority
+        self.state = QUEUED
+        self.attempts = 0
+        self.created = time.time()
+        self.started = None
+        self.ended = None
+        self.size = None
+        self.last_error = None
+        self.requesters = 0
+        # the running worker or engine job
+        self.task = None
+
+    @property
+    def key(self):
+        """Return the image and tag pulled."""
+        return "{}:{}".format(self.image, self.tag)
+
+    @property
+    def active(self):
+        """Return whether the job is yet to finish."""
+        return self.state in (QUEUED, RUNNING, RETRYING)
+
+    @property
+    def duration(self):
+        """Return the time (s) from the first attempt to the end."""
+        if self.started is None:
+            return 0
+        end = self.ended if self.ended is not None else time.time()
+        return end - self.started
+
+    @property
+    def throughput(self):
+        """Return the mean download rate (bytes/s), or None."""
+        if self.size is None or self.state != DONE or self.duration <= 0:
+            return None
+        return self.size / self.duration
+
+    def cancel(self):
+        """Cancel the job, closing the pull stream if it is running.
+
+        The pull is cancelled for all requesters, see `release`.
+        """
+        self.manager.cancel(self)
+
+    def attach(self):
+        """Register a requester of the job."""
+        self.requesters += 1
+
+    @Slot()
+    def release(self):
+        """Release the job, cancelling it if no other requester remains."""
+        self.requesters = max(0, self.requesters - 1)
+        if self.requesters == 0:
+            self.cancel()
+
+    # slots of the running task, such that its signals are delivered on
+    # the thread of the job rather than that of the task
+
+    @Slot(object)
+    def _on_result(self, image):
+        self.manager._on_result(self, image)
+
+    @Slot(tuple)
+    def _on_error(self, error):
+        self.manager._on_error(self, error)
+
+    @Slot()
+    def _on_finished(self):
+        self.manager._on_finished(self)
+
+    def summary(self):
+        """Return a dictionary describing the job."""
+        return {
+            "image": self.image, "tag": self.tag, "state": self.state,
+            "priority": self.priority, "attempts": self.attempts,
+            "created": self.created, "duration": self.duration,
+            "size": self.size, "throughput": self.throughput,
+            "error": None if self.last_error is None
+            else str(self.last_error)}
+
+
+class PullManager(QObject):
+    """Queue and run image pulls.
+
+    Pulls run on the asynchronous engine client if available, where
+    cancelling closes the pull stream, else in a worker thread, where the
+    stream is closed on the next progress update.
+    """
+
+    changed = Signal()
+    pulled = Signal(object)
+
+    def __init__(self, client, pool, engine=None, retries=3, backoff=5,
+                 history=50):
+        """Initialize the manager.
+
+        :param client: a `dockerutil.DockerClient`.
+        :param pool: a `QThreadPool` on which to run pulls.
+        :param engine: an `aioengine.EngineThread`, or None.
+        :param retries: attempts made after the first has failed.
+        :param backoff: delay (s) before the first retry, doubling for
+            each subsequent retry.
+        :param history: number of finished jobs to keep.
+        """
+        super().__init__()
+        self.client = client
+        self.pool = pool
+        self.engine = engine
+        self.retries = retries
+        self.backoff = backoff
+        self.logger = labslauncher.get_named_logger("PullMngr")
+        self._queue = list()
+        self._seq = itertools.count()
+        self._jobs = dict()
+        self.current = None
+        self.history = collections.deque(maxlen=history)
+
+    def request(self, tag, priority=NORMAL):
+        """Request the pull of an image tag.
+
+        The requester should `release` the job once it no longer requires
+        the pull, such as when its progress dialog is closed.
+
+        :param tag: the tag to pull, see `DockerClient.latest_tag`.
+        :param priority: one of `LOW`, `NORMAL` or `HIGH`.
+
+        :returns: a `PullJob`, shared with other requests of the tag.
+        """
+        key = "{}:{}".format(self.client.image_name, tag)
+        job = self._jobs.get(key)
+        if job is not None and job.active:
+            self.logger.info("Pull of {} already {}.".format(key, job.state))
+            job.attach()
+            if priority > job.priority:
+                job.priority = priority
+                if job.state == QUEUED:
+                    self._push(job)
+            return job
+        job = PullJob(self, self.client.image_name, tag, priority)
+        job.attach()
+        self._jobs[key] = job
+        self.logger.info("Queued pull of {}.".format(key))
+        self._push(job)
+        self._next()
+        return job
+
+    def _push(self, job):
+        # entries of a reprioritised job are skipped when popped
+        heapq.heappush(self._queue, (-job.priority, next(self._seq), job))
+
+    @property
+    def queued(self):
+        """Return the queued jobs, in the order in which they will run."""
+        jobs = list()
+        for _, _, job in sorted(self._queue):
+            if job.state == QUEUED and job not in jobs:
+                jobs.append(job)
+        return jobs
+
+    def jobs(self):
+        """Return the active jobs, then finished jobs most recent first."""
+        jobs = list()
+        if self.current is not None:
+            jobs.append(self.current)
+        jobs.extend(self.queued)
+        jobs.extend(
+            x for x in self._jobs.values()
+            if x.state == RETRYING and x not in jobs)
+        jobs.extend(reversed(self.history))
+        return jobs
+
+    def _next(self):
+        """Start the next queued job, if none is running."""
+        if self.current is not None:
+            return
+        while len(self._queue) > 0:
+            _, _, job = heapq.heappop(self._queue)
+            if job.state == QUEUED:
+                self._start(job)
+                break
+        self.changed.emit()
+
+    def _start(self, job):
+        """Start an attempt of a job."""
+        self.current = job
+        job.state = RUNNING
+        job.attempts += 1
+        if job.started is None:
+            job.started = time.time()
+        self.logger.info("Pulling {}, attempt {}.".format(
+            job.key, job.attempts))
+        if self.engine is not None:
+            task = self.engine.submit(
+                self.client.pull_image_async, self.engine.engine, job.tag,
+                streaming="progress", defer=True)
+            signals = task
+        else:
+            task = Worker(self.client.pull_image, job.tag)
+            task.setAutoDelete(True)
+            signals = task.signals
+        job.task = task
+        signals.progress.connect(job.progress)
+        signals.result.connect(job._on_result)
+        signals.error.connect(job._on_error)
+        signals.finished.connect(job._on_finished)
+        if self.engine is not None:
+            task.start()
+        else:
+            self.pool.start(task)
+
+    def _on_result(self, job, image):
+        if job.state != RUNNING:
+            return
+        if image is None:
+            # the worker was stopped
+            job.state = CANCELLED
+            return
+        if job.size is None:
+            job.size = self.client.total_size
+        job.state = DONE
+        job.result.emit(image)
+        self.pulled.emit(image)
+
+    def _on_error(self, job, error):
+        if job.state != RUNNING:
+            return
+        job.last_error = error[1]
+        if job.attempts <= self.retries and \
+                not isinstance(error[1], RateLimited):
+            delay = self.backoff * 2 ** (job.attempts - 1)
+            self.logger.warning(
+                "Pull of {} failed, retrying in {}s: {}".format(
+                    job.key, delay, error[1]))
+            job.state = RETRYING
+            QTimer.singleShot(
+                int(1000 * delay), functools.partial(self._retry, job))
+        else:
+            self.logger.error("Pull of {} failed after {} attempts.".format(
+                job.key, job.attempts))
+            job.state = FAILED
+            job.error.emit(error)
+
+    def _on_finished(self, job):
+        """Finish a job once its attempt ends, unless it is retried."""
+        job.task = None
+        if self.current is job:
+            self.current = None
+        if job.state == RUNNING:
+            # cancelled on the engine, neither result nor error
+            job.state = CANCELLED
+        if job.state != RETRYING:
+            self._finish(job)
+        self._next()
+
+    def _retry(self, job):
+        """Queue a job again after a failed attempt."""
+        if job.state != RETRYING:
+            return
+        # the size is that of the first attempt, later attempts reuse the
+        # layers already downloaded
+        if job.size is None:
+            job.size = self.client.total_size
+        job.state = QUEUED
+        self._push(job)
+        self._next()
+
+    def _finish(self, job):
+        job.ended = time.time()
+        # finished jobs are kept only in the history
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        self.history.append(job)
+        throughput = job.throughput
+        self.logger.info(
+            "Pull of {} {} after {} attempt(s) in {:.1f}s{}.".format(
+                job.key, job.state, job.attempts, job.duration,
+                "" if throughput is None
+                else " ({:.1f}Mb/s)".format(throughput / 1024 ** 2)))
+        job.finished.emit()
+        self.changed.emit()
+
+    def cancel(self, job):
+        """Cancel a job.
+
+        :param job: a `PullJob`.
+        """
+        if not job.active:
+            return
+        self.logger.info("Cancelling pull of {}.".format(job.key))
+        state, job.state = job.state, CANCELLED
+        if state == RUNNING:
+            task = job.task
+            if task is not None:
+                # the job finishes with its task
+                if self.engine is not None:
+                    task.cancel()
+                else:
+                    task.stop()
+                return
+        self._finish(job)
+
+    def cancel_all(self):
+        """Cancel all queued and running jobs."""
+        for job in list(self._jobs.values()):
+            self.cancel(job)
@@ -5,11 +5,13 @@ import threading
 import traceback
 
 from PyQt5.QtCore import (
-    pyqtSignal as Signal, pyqtSlot as Slot, QObject, QRunnable, QSettings, Qt)
+    pyqtSignal as Signal, pyqtSlot as Slot,
+    QObject, QRunnable, QSettings, Qt, QTimer)
 from PyQt5.QtGui import QCursor
 from PyQt5.QtWidgets import QLabel
 
 import labslauncher
+from labslauncher import metrics, tracing
 
 
 class Property(QObject):
@@ -100,13 +102,21 @@ class Worker(QRunnable):
         self.stopped = threading.Event()
         self.kwargs['stopped'] = self.stopped
         self.logger = labslauncher.get_named_logger('Runnabl')
+        # continue the trace of the creating thread when run
+        self.trace_context = tracing.current()
+        self.trace_flow = tracing.flow_start(self.trace_context)
 
     @Slot()
     def run(self):
         """Run the function."""
+        task = getattr(self.fn, '__qualname__', str(self.fn))
         try:
-            result = self.fn(*self.args, **self.kwargs)
+            with tracing.attach(self.trace_context, self.trace_flow), \
+                    tracing.span("worker.{}".format(task), root=False), \
+                    metrics.WORKER_TASKS.time(task=task):
+                result = self.fn(*self.args, **self.kwargs)
         except Exception:
+            metrics.WORKER_ERRORS.inc(task=task)
             self.logger.exception(
                "Failed to execute runnable:\nfn: {}\nargs: {}\nkwargs: {}"
                .format(
@@ -155,22 +165,54 @@ class ClickLabel(QLabel):
             self.setCursor(QCursor(Qt.ArrowCursor))
 
 
-class Settings():
-    """Wrapper around QSettings to provide defaults."""
+class Settings(QObject):
+    """Wrapper around QSettings to provide defaults.
 
-    def __init__(self, specification):
+    All values are read from QSettings once and served from memory
+    thereafter. Writes update the in-memory values immediately and are
+    written back to QSettings in a background thread after a short delay,
+    such that several changes in quick succession are coalesced into a
+    single write.
+    """
+
+    changed = Signal(str, object)
+    _qsettings_args = ("EPIME Labs", "Launcher")
+
+    def __init__(self, specification, sync_delay=500):
         """Initialize settings.
 
         :param specification: an item like `labslauncher.Settings`.
+        :param sync_delay: delay (ms) after a change before writing back.
 
         """
-        self.qsettings = QSettings("EPIME Labs", "Launcher")
+        super().__init__()
+        self.qsettings = QSettings(*self._qsettings_args)
         self.spec = specification
+        self._values = dict()
+        self._dirty = dict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
 
         for item in self.spec:
             key = item["key"]
-            if not self.qsettings.contains(key):
-                self.qsettings.setValue(key, item["default"])
+            if self.qsettings.contains(key):
+                try:
+                    value = self._convert(key, self.qsettings.value(key))
+                except (TypeError, ValueError):
+                    value = item["default"]
+                    self._dirty[key] = value
+            else:
+                value = item["default"]
+                self._dirty[key] = value
+            self._values[key] = value
+        if len(self._dirty) > 0:
+            self._flush()
+
+        self._sync_timer = QTimer()
+        self._sync_timer.setSingleShot(True)
+        self._sync_timer.setInterval(sync_delay)
+        self._sync_timer.timeout.connect(self._write_back)
+
         self.overrides = None
         self.parser = argparse.ArgumentParser(
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -184,20 +226,65 @@ class Settings():
                 "--{}".format(key), type=arg_type,
                 help=self.spec.get_description(key))
 
+    def _convert(self, key, value):
+        """Convert a value to the type given in the specification.
+
+        :param key: the key of the setting.
+        :param value: the raw value, e.g. as stored by QSettings.
+        """
+        type = self.spec.get_type(key)
+        if type == bool and isinstance(value, str):
+            # QSettings stores booleans as strings for some backends
+            return value.lower() in ("true", "1")
+        return type(value)
+
     def __getitem__(self, key):
         """Get the value of a setting."""
-        type = self.spec.get_type(key)
         if self.overrides is not None and self.overrides[key] is not None:
             value = self.overrides[key]
-            if type == bool:
+            if self.spec.get_type(key) == bool:
                 value = bool(value)
-        else:
-            value = type(self.qsettings.value(key))
-        return value
+            return value
+        return self._values[key]
 
     def __setitem__(self, key, value):
-        """Set the value of a setting."""
-        self.qsettings.setValue(key, value)
+        """Set the value of a setting.
+
+        :raises: ValueError if the value cannot be converted to the type
+            of the setting.
+        """
+        value = self._convert(key, value)
+        with self._lock:
+            if self._values[key] == value:
+                return
+            self._values[key] = value
+            self._dirty[key] = value
+        self._sync_timer.start()
+        self.changed.emit(key, value)
+
+    def _write_back(self):
+        """Write changed values to QSettings in a background thread."""
+        thread = threading.Thread(target=self._flush, daemon=True)
+        thread.start()
+
+    def _flush(self):
+        """Write changed values to QSettings."""
+        with self._write_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, dict()
+            if len(dirty) == 0:
+                return
+            # QSettings is reentrant, each thread requires its own instance
+            qsettings = QSettings(*self._qsettings_args)
+            for key, value in dirty.items():
+                qsettings.setValue(key, value)
+            qsettings.sync()
+
+    def sync(self):
+        """Write any pending changes to QSettings immediately."""
+        self._sync_timer.stop()
+        self._flush()
+        self.qsettings.sync()
 
     def override(self, args):
         """Set command line overrides."""
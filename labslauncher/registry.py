@@ -0,0 +1,349 @@
+"""Access to container registries within their pull rate limits.
+
+Docker Hub limits the number of image manifests fetched from an address
+in a period, a budget shared by all computers behind the same NAT. The
+remaining budget is reported in the `RateLimit-Limit` and
+`RateLimit-Remaining` headers of manifest responses, including those of
+HEAD requests, which are not counted against the limit.
+
+A `RegistryClient` reuses a connection and the bearer tokens granted for
+each repository, and records the budget of its registry. Requests made
+only for information, such as estimating a download size, are skipped
+when the budget is low such that it is kept for pulls.
+"""
+import re
+import threading
+import time
+
+import requests
+
+import labslauncher
+from labslauncher import metrics, tracing
+
+
+URLS = {'docker.io': 'https://registry-1.docker.io'}
+MANIFEST_TYPES = (
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.manifest.v1+json')
+# errors of the docker daemon when a pull is refused by the registry
+LIMIT_MESSAGES = ('toomanyrequests', 'pull rate limit')
+# time (s) to wait after a refused pull if the registry does not say
+HOLDOFF = 600
+_clients = dict()
+_clients_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """A registry request was refused, or skipped, due to the rate limit."""
+
+    def __init__(self, message, retry_after=None):
+        """Initialize the error.
+
+        :param message: description of the error.
+        :param retry_after: time (s) after which the budget is restored,
+            or None if not known.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_limit(value):
+    """Parse a rate limit header, e.g. '100;w=21600'.
+
+    :returns: tuple (count, window (s)), window is None if not given.
+    """
+    count, _, policy = value.partition(';')
+    window = re.search(r'w=(\d+)', policy)
+    return int(count), None if window is None else int(window.group(1))
+
+
+def is_limit_error(error):
+    """Return whether an error of a pull is due to the rate limit.
+
+    :param error: an exception or error message.
+    """
+    text = str(error).lower()
+    return any(x in text for x in LIMIT_MESSAGES)
+
+
+def format_wait(seconds):
+    """Return a time to wait in words, e.g. '2h 5min'."""
+    minutes = max(1, int(round(seconds / 60)))
+    if minutes < 60:
+        return "{}min".format(minutes)
+    if minutes % 60 == 0:
+        return "{}h".format(minutes // 60)
+    return "{}h {}min".format(minutes // 60, minutes % 60)
+
+
+class PullBudget():
+    """The pull rate limit budget of a registry.
+
+    The budget is that last reported by the registry, it is considered
+    unknown once its period has elapsed.
+    """
+
+    def __init__(self):
+        """Initialize the budget."""
+        self.limit = None
+        self.window = None
+        self._remaining = None
+        self._reset = None
+        self._observed = None
+        self._lock = threading.Lock()
+
+    def update(self, headers, now=None):
+        """Record the budget reported in the headers of a response.
+
+        :param headers: the response headers.
+        :param now: the time of the response, by default the current time.
+
+        :returns: whether the headers contained the budget.
+        """
+        if 'RateLimit-Remaining' not in headers:
+            return False
+        now = time.time() if now is None else now
+        remaining, window = parse_limit(headers['RateLimit-Remaining'])
+        limit = None
+        if 'RateLimit-Limit' in headers:
+            limit, window = parse_limit(headers['RateLimit-Limit'])
+        reset = headers.get('RateLimit-Reset', headers.get('Retry-After'))
+        with self._lock:
+            self._remaining = remaining
+            self.limit = limit
+            self.window = window
+            self._observed = now
+            self._reset = None
+            if reset is not None and reset.isdigit():
+                self._reset = now + int(reset)
+        return True
+
+    def exhaust(self, retry_after=None, now=None):
+        """Record that the registry refused a request.
+
+        :param retry_after: time (s) until the budget is restored, by
+            default `HOLDOFF`.
+        """
+        now = time.time() if now is None else now
+        if retry_after is None:
+            retry_after = HOLDOFF
+        with self._lock:
+            self._remaining = 0
+            self._observed = now
+            self._reset = now + retry_after
+
+    def consume(self, count=1):
+        """Record requests counted against the budget.
+
+        :param count: the number of manifests fetched.
+        """
+        with self._lock:
+            if self._remaining is not None:
+                self._remaining = max(0, self._remaining - count)
+
+    def _expiry(self):
+        if self._reset is not None:
+            return self._reset
+        if self._observed is not None and self.window is not None:
+            return self._observed + self.window
+        return None
+
+    def remaining(self, now=None):
+        """Return the remaining budget, or None if not known."""
+        now = time.time() if now is None else now
+        with self._lock:
+            expiry = self._expiry()
+            if self._remaining is None or \
+                    (expiry is not None and now >= expiry):
+                return None
+            return self._remaining
+
+    def retry_after(self, now=None):
+        """Return the time (s) until an exhausted budget is restored.
+
+        :returns: the time, or None if the budget is not exhausted or the
+            time is not known.
+        """
+        now = time.time() if now is None else now
+        if self.remaining(now) != 0:
+            return None
+        with self._lock:
+            expiry = self._expiry()
+        return None if expiry is None else max(0, expiry - now)
+
+    def describe(self):
+        """Return the budget in words."""
+        remaining = self.remaining()
+        if remaining is None:
+            return "Pull limit: unknown"
+        if remaining == 0:
+            wait = self.retry_after()
+            return "Pull limit reached{}".format(
+                "" if wait is None
+                else ", retry after {}".format(format_wait(wait)))
+        text = "Pull limit: {}".format(remaining)
+        if self.limit is not None:
+            text = "{} of {}".format(text, self.limit)
+        text = "{} remaining".format(text)
+        if self.window is not None:
+            text = "{} per {}".format(text, format_wait(self.window))
+        return text
+
+
+class RegistryClient():
+    """Make requests to a registry, tracking its rate limit budget."""
+
+    def __init__(self, base_url, reserve=10):
+        """Initialize the client.
+
+        :param base_url: the address of the registry.
+        :param reserve: budget kept for pulls, informational requests are
+            skipped when no more remains.
+        """
+        self.base_url = base_url
+        self.reserve = reserve
+        self.budget = PullBudget()
+        self.logger = labslauncher.get_named_logger("Registry")
+        self.session = requests.Session()
+        # bearer tokens by repository, tuples (token, expiry)
+        self._tokens = dict()
+        self._lock = threading.Lock()
+
+    def refused(self, error):
+        """Return the error for a pull refused due to the rate limit.
+
+        :param error: the error reported by the docker daemon.
+
+        :returns: a `RateLimited` error.
+        """
+        self.budget.exhaust()
+        metrics.REGISTRY_PULLS_REMAINING.set(0, registry=self.base_url)
+        self.logger.warning("Pull refused by {}: {}".format(
+            self.base_url, error))
+        wait = self.budget.retry_after()
+        return RateLimited(
+            "The registry's pull limit has been reached, retry after "
+            "{}: {}".format(format_wait(wait), error), retry_after=wait)
+
+    def check(self, essential=True):
+        """Check that a request counted against the budget may be made.
+
+        :param essential: whether the request is required, such as for a
+            pull, rather than for information.
+
+        :raises RateLimited: if the budget is exhausted, or is within the
+            reserve for a non-essential request.
+        """
+        remaining = self.budget.remaining()
+        if remaining is None:
+            return
+        if remaining == 0:
+            wait = self.budget.retry_after()
+            raise RateLimited(
+                "The registry's pull limit has been reached{}.".format(
+                    "" if wait is None
+                    else ", retry after {}".format(format_wait(wait))),
+                retry_after=wait)
+        if not essential and remaining <= self.reserve:
+            raise RateLimited(
+                "Only {} pulls remain within the registry's limit.".format(
+                    remaining))
+
+    def _token(self, repository):
+        with self._lock:
+            token, expiry = self._tokens.get(repository, (None, 0))
+        return token if time.time() < expiry else None
+
+    def _authenticate(self, repository, challenge):
+        """Request an anonymous bearer token as directed by a challenge."""
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop('realm')
+        response = self.session.get(realm, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        token = data.get('token', data.get('access_token'))
+        # tokens are valid for 60s unless stated, renew them early
+        expiry = time.time() + 0.9 * data.get('expires_in', 60)
+        with self._lock:
+            self._tokens[repository] = (token, expiry)
+        return token
+
+    def request(self, method, path, repository, essential=True, **kwargs):
+        """Make a request to the registry.
+
+        :param method: the HTTP method.
+        :param path: path of the request, relative to the repository.
+        :param repository: the repository, e.g. 'ontresearch/nanolabs'.
+        :param essential: whether a manifest request is required, see
+            `check`. Only GET requests for manifests count against the
+            budget.
+        :param kwargs: passed to `requests.Session.request`.
+
+        :raises RateLimited: if the request is refused or skipped.
+        """
+        counted = method == 'GET' and path.startswith('/manifests/')
+        if counted:
+            self.check(essential)
+        url = '{}/v2/{}{}'.format(self.base_url, repository, path)
+        headers = dict(kwargs.pop('headers', dict()))
+        kwargs.setdefault('timeout', 30)
+        token = self._token(repository)
+        with tracing.span("registry.request", root=False):
+            if token is not None:
+                headers['Authorization'] = 'Bearer {}'.format(token)
+            response = self.session.request(
+                method, url, headers=headers, **kwargs)
+            challenge = response.headers.get('WWW-Authenticate', '')
+            if response.status_code == 401 and \
+                    challenge.startswith('Bearer '):
+                token = self._authenticate(repository, challenge)
+                headers['Authorization'] = 'Bearer {}'.format(token)
+                response = self.session.request(
+                    method, url, headers=headers, **kwargs)
+        if self.budget.update(response.headers):
+            remaining = self.budget.remaining()
+            # unknown if the reported budget has already been reset
+            if remaining is not None:
+                metrics.REGISTRY_PULLS_REMAINING.set(
+                    remaining, registry=self.base_url)
+        if response.status_code == 429:
+            retry = response.headers.get('Retry-After', '')
+            self.budget.exhaust(int(retry) if retry.isdigit() else None)
+            metrics.REGISTRY_PULLS_REMAINING.set(0, registry=self.base_url)
+            self.logger.warning("Pull limit of {} reached.".format(
+                self.base_url))
+            self.check()
+        response.raise_for_status()
+        return response
+
+    def get(self, path, repository, essential=True, **kwargs):
+        """Make a GET request to the registry, see `request`."""
+        return self.request(
+            'GET', path, repository, essential=essential, **kwargs)
+
+    def refresh(self, repository, tag='latest'):
+        """Query the budget without consuming it.
+
+        :param repository: a repository of the registry.
+        :param tag: a tag of the repository.
+
+        :returns: the `PullBudget`.
+        """
+        self.request(
+            'HEAD', '/manifests/{}'.format(tag), repository,
+            headers={'Accept': ', '.join(MANIFEST_TYPES)})
+        return self.budget
+
+
+def get_client(registry='docker.io'):
+    """Return the client shared by users of a registry.
+
+    :param registry: the registry name, e.g. 'docker.io'.
+    """
+    with _clients_lock:
+        if registry not in _clients:
+            _clients[registry] = RegistryClient(
+                URLS.get(registry, 'https://{}'.format(registry)))
+        return _clients[registry]
@@ -0,0 +1,163 @@
+"""Use of a docker daemon on another computer.
+
+The notebook server can run on a remote docker host, for example a large
+server holding the data to be analysed. Folders are then mounted from
+the remote host's filesystem, and the server's ports are published on the
+remote host. These are forwarded to this computer through an ssh tunnel,
+such that the server is accessed as if it were local; otherwise the
+server is accessed at the remote host's address.
+"""
+import os
+import shutil
+import subprocess
+from urllib.parse import urlsplit
+
+import labslauncher
+
+
+LOCAL_NAMES = ('localhost', '127.0.0.1', '::1')
+# when to forward ports, see `use_tunnel`
+AUTO = 'auto'
+ALWAYS = 'always'
+NEVER = 'never'
+FORWARD_MODES = (AUTO, ALWAYS, NEVER)
+
+
+def host_name(base_url):
+    """Return the name of a remote docker host.
+
+    :param base_url: the docker host, e.g. 'tcp://server:2376'.
+
+    :returns: the host name, or None if the daemon runs on this computer.
+    """
+    if not base_url:
+        return None
+    url = urlsplit(base_url)
+    if url.scheme not in ('tcp', 'ssh', 'http', 'https'):
+        # unix sockets and named pipes
+        return None
+    if url.hostname is None or url.hostname in LOCAL_NAMES:
+        return None
+    return url.hostname
+
+
+def ssh_destination(base_url):
+    """Return the ssh destination through which to reach a docker host.
+
+    :param base_url: a remote docker host, see `host_name`.
+
+    :returns: list of ssh arguments, the user and port of an ssh docker
+        host are used, else those of the ssh configuration.
+    """
+    url = urlsplit(base_url)
+    args = list()
+    if url.scheme == 'ssh' and url.port is not None:
+        args.extend(['-p', str(url.port)])
+    if url.scheme == 'ssh' and url.username is not None:
+        args.append('{}@{}'.format(url.username, url.hostname))
+    else:
+        args.append(url.hostname)
+    return args
+
+
+def use_tunnel(base_url, mode=AUTO):
+    """Return whether to forward ports from a remote docker host.
+
+    Ports are forwarded with ssh, by default only from ssh docker hosts
+    as tcp hosts often do not allow ssh access.
+
+    :param base_url: a remote docker host, see `host_name`.
+    :param mode: one of `FORWARD_MODES`.
+    """
+    if mode == ALWAYS:
+        return True
+    return mode == AUTO and urlsplit(base_url).scheme == 'ssh'
+
+
+def configure(client, base_url, forward=AUTO):
+    """Configure a client for the docker host on which it runs the server.
+
+    :param client: a `dockerutil.DockerClient`.
+    :param base_url: the docker host, or None for that of the environment.
+    :param forward: when to forward ports, one of `FORWARD_MODES`.
+
+    :returns: the client's `Tunnel`, or None if ports are not forwarded.
+    """
+    if not base_url:
+        base_url = os.environ.get('DOCKER_HOST')
+    client.remote_host = host_name(base_url)
+    client.tunnel = None
+    if client.remote_host is not None and use_tunnel(base_url, forward):
+        client.tunnel = Tunnel(base_url)
+    return client.tunnel
+
+
+class Tunnel():
+    """Forward ports of a remote host to this computer with ssh.
+
+    Authentication must not require input, for example by using an ssh
+    agent or a key without a passphrase, as for docker's ssh hosts.
+    """
+
+    def __init__(self, base_url):
+        """Initialize the tunnel.
+
+        :param base_url: the remote docker host.
+        """
+        self.base_url = base_url
+        self.logger = labslauncher.get_named_logger("Tunnel")
+        self.process = None
+        self.ports = ()
+
+    @property
+    def running(self):
+        """Return whether the tunnel is open."""
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, ports, timeout=2):
+        """Open the tunnel.
+
+        :param ports: ports forwarded to the same port on this computer.
+        :param timeout: time (s) to wait for ssh to fail, for example if
+            a port is in use.
+
+        :raises RuntimeError: if ssh is not available or fails.
+        """
+        self.stop()
+        ssh = shutil.which('ssh')
+        if ssh is None:
+            raise RuntimeError("The ssh command was not found.")
+        cmd = [
+            ssh, '-N', '-o', 'BatchMode=yes',
+            '-o', 'ExitOnForwardFailure=yes',
+            '-o', 'ServerAliveInterval=30']
+        for port in ports:
+            cmd.extend(['-L', '127.0.0.1:{0}:127.0.0.1:{0}'.format(port)])
+        cmd.extend(ssh_destination(self.base_url))
+        self.logger.info("Opening tunnel: {}".format(" ".join(cmd)))
+        self.process = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE)
+        try:
+            _, err = self.process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # still running, the ports are forwarded
+            self.ports = tuple(ports)
+            return
+        self.process = None
+        raise RuntimeError("Failed to forward ports: {}".format(
+            err.decode(errors='replace').strip()))
+
+    def stop(self):
+        """Close the tunnel."""
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.logger.info("Closing tunnel.")
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.ports = ()
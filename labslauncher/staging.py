@@ -0,0 +1,456 @@
+"""Staging of data in a docker volume for fast access from notebooks.
+
+On Docker Desktop bind mounts are served from the host through a file
+sharing layer, which is many times slower than a volume in the docker VM.
+Selected folders can instead be copied into a named volume, mounted in the
+server container, and files created or changed there are copied back to
+the host when the server is stopped.
+
+Copies are incremental: a manifest records the size, modification times
+on the host and in the volume, and hash of each file copied. A file whose
+size and modification time are unchanged is not copied, nor is a file
+with only a changed modification time whose content hash is unchanged.
+Files are copied as tar streams to and from a short-lived helper
+container which mounts the volume.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
+import labslauncher
+from labslauncher import tracing
+
+
+MANIFEST_DIR = os.path.join(labslauncher.__LOGDIR__, 'staging')
+HELPER_LABEL = 'org.epi2melabs.launcher.staging'
+# path of the volume in the helper container
+VOLUME_PATH = '/staging'
+# owner of staged files, the notebook user of the server image
+STAGING_UID = 1000
+STAGING_GID = 100
+# fields of manifest entries: size, mtime in the volume, sha256, mtime on
+# the host. The mtimes differ only if the file was touched on the host.
+SIZE, MTIME, SHA256, HOST_MTIME = range(4)
+# suffix of files copied back which conflict with changes on the host
+CONFLICT_SUFFIX = '.staged'
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def _hash(path):
+    """Return the sha256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _IterStream(io.RawIOBase):
+    """A readable file object over an iterable of bytes."""
+
+    def __init__(self, chunks):
+        """Initialize the stream.
+
+        :param chunks: iterable of bytes.
+        """
+        super().__init__()
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def readable(self):
+        """Return True, the stream is readable."""
+        return True
+
+    def readinto(self, b):
+        """Read bytes into a buffer."""
+        while len(self.buffer) == 0:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+class Stager():
+    """Copy folders to and from a docker volume."""
+
+    def __init__(self, client, volume, folders, bind):
+        """Initialize the stager.
+
+        :param client: a `dockerutil.DockerClient`.
+        :param volume: name of the docker volume.
+        :param folders: host folders to stage, each is copied to a folder
+            of the volume named as the host folder.
+        :param bind: location of the volume in the server container.
+        """
+        self.client = client
+        self.volume = volume
+        self.folders = [
+            os.path.abspath(os.path.expanduser(x)) for x in folders]
+        self.bind = bind
+        self.logger = labslauncher.get_named_logger("Staging")
+        self.manifest_file = os.path.join(
+            MANIFEST_DIR, "{}.json".format(volume))
+        # statistics of the last copy, for display
+        self.transferred = 0
+        self.rate = 0
+
+    @classmethod
+    def from_settings(cls, client, settings):
+        """Create a stager from application settings.
+
+        :param client: a `dockerutil.DockerClient`.
+        :param settings: a `qtext.Settings`.
+
+        :returns: a `Stager`, or None if staging is disabled.
+        """
+        if not settings["stage_data"]:
+            return None
+        folders = [
+            x.strip() for x in settings["stage_folders"].split(os.pathsep)
+            if x.strip() != '']
+        return cls(
+            client, settings["stage_volume"], folders,
+            settings["stage_bind"])
+
+    @property
+    def names(self):
+        """Return the volume folder names of the host folders.
+
+        :raises ValueError: if folders have the same name.
+        """
+        names = dict()
+        for path in self.folders:
+            name = os.path.basename(path)
+            if name in names:
+                raise ValueError(
+                    "Staged folders {} and {} have the same name.".format(
+                        names[name], path))
+            names[name] = path
+        return names
+
+    def volumes(self):
+        """Return the volume specification for the server container."""
+        return {self.volume: {'bind': self.bind, 'mode': 'rw'}}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r') as fh:
+                manifest = json.load(fh)
+        except FileNotFoundError:
+            manifest = dict()
+        except Exception:
+            self.logger.exception("Failed to read manifest, copying all.")
+            manifest = dict()
+        return manifest
+
+    def _save_manifest(self, manifest):
+        tmp = "{}.tmp".format(self.manifest_file)
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        with open(tmp, 'w') as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp, self.manifest_file)
+
+    def _helper(self):
+        """Start a helper container with the volume mounted."""
+        return self.client.docker.containers.run(
+            self.client.full_image_name(
+                tag=self.client.latest_available_tag),
+            entrypoint=['tail', '-f', '/dev/null'], detach=True,
+            network_disabled=True, labels={HELPER_LABEL: self.volume},
+            volumes={self.volume: {'bind': VOLUME_PATH, 'mode': 'rw'}})
+
+    @staticmethod
+    def _list_volume(helper, name):
+        """List the files of a folder of the volume.
+
+        :returns: dictionary of relative path to (size, mtime).
+        """
+        path = '/'.join((VOLUME_PATH, name))
+        code, output = helper.exec_run(
+            ['sh', '-c', 'test ! -d "$1" || find "$1" -type f '
+             '-printf "%P\\t%s\\t%T@\\n"', 'list', path])
+        if code != 0:
+            raise RuntimeError("Failed to list staged files: {}".format(
+                output.decode(errors='replace')))
+        files = dict()
+        for line in output.decode('utf-8', errors='surrogateescape') \
+                .splitlines():
+            rel, size, mtime = line.rsplit('\t', 2)
+            files[rel] = (int(size), int(float(mtime)))
+        return files
+
+    @staticmethod
+    def _list_host(root):
+        """List the files of a host folder.
+
+        :returns: dictionary of relative path to (size, mtime).
+        """
+        files = dict()
+        for dirpath, _, fnames in os.walk(root):
+            for fname in fnames:
+                path = os.path.join(dirpath, fname)
+                if not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                rel = os.path.relpath(path, root).replace(os.sep, '/')
+                files[rel] = (stat.st_size, int(stat.st_mtime))
+        return files
+
+    def _progress(self, total, started, progress):
+        """Update statistics and emit progress of a copy."""
+        elapsed = time.monotonic() - started
+        self.rate = self.transferred / elapsed if elapsed > 0 else 0
+        if progress is not None:
+            progress.emit(
+                100 * self.transferred / total if total > 0 else 100)
+
+    def _tar(self, name, root, files, entries, total, started, progress,
+             stopped):
+        """Generate a tar stream of files of a host folder.
+
+        :param name: the volume folder name.
+        :param root: the host folder.
+        :param files: relative paths to copy with their (size, mtime).
+        :param entries: dictionary to which the manifest entries of the
+            copied files are written.
+        """
+        dirs = {name}
+        for rel in files:
+            parts = rel.split('/')[:-1]
+            for i in range(len(parts)):
+                dirs.add('/'.join([name] + parts[:i + 1]))
+        for path in sorted(dirs):
+            info = tarfile.TarInfo(path)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o775
+            info.uid, info.gid = STAGING_UID, STAGING_GID
+            info.mtime = time.time()
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+        for rel, (size, mtime) in files.items():
+            if stopped is not None and stopped.is_set():
+                return
+            info = tarfile.TarInfo('/'.join((name, rel)))
+            info.size, info.mtime = size, mtime
+            info.mode = 0o664
+            info.uid, info.gid = STAGING_UID, STAGING_GID
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+            digest = hashlib.sha256()
+            remaining = size
+            with open(os.path.join(root, rel), 'rb') as fh:
+                while remaining > 0:
+                    chunk = fh.read(min(CHUNK_SIZE, remaining))
+                    if len(chunk) == 0:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                    self.transferred += len(chunk)
+                    self._progress(total, started, progress)
+                    yield chunk
+            if remaining > 0:
+                # the file was truncated whilst being copied, it is
+                # copied again next time
+                self.logger.warning(
+                    "File changed whilst copying: {}.".format(rel))
+                yield bytes(remaining)
+                entries[rel] = None
+            else:
+                entries[rel] = [size, mtime, digest.hexdigest(), mtime]
+            if size % BLOCK_SIZE > 0:
+                yield bytes(BLOCK_SIZE - size % BLOCK_SIZE)
+        yield bytes(2 * BLOCK_SIZE)
+
+    def _changed(self, root, files, known):
+        """Return host files which differ from the manifest.
+
+        Files with an unchanged size but changed modification time are
+        hashed, if the hash is unchanged the manifest entry is updated.
+        """
+        changed = dict()
+        for rel, (size, mtime) in files.items():
+            entry = known.get(rel)
+            if entry is not None and entry[SIZE] == size:
+                if entry[HOST_MTIME] == mtime:
+                    continue
+                if _hash(os.path.join(root, rel)) == entry[SHA256]:
+                    entry[HOST_MTIME] = mtime
+                    continue
+            changed[rel] = (size, mtime)
+        return changed
+
+    @tracing.traced("staging.sync_in")
+    def sync_in(self, progress=None, stopped=None):
+        """Copy the host folders to the volume.
+
+        Files in the volume which were copied previously, but which have
+        since been removed from the host folder, are removed. Files
+        created in the volume which have not been copied back are kept.
+
+        :param progress: signal to which progress is emitted.
+        :param stopped: a `threading.Event` to cancel the copy.
+
+        :returns: True if the copy completed.
+        """
+        names = self.names
+        manifest = self._load_manifest()
+        helper = self._helper()
+        try:
+            plan = list()
+            for name, root in names.items():
+                folder = manifest.get(name, dict())
+                known = folder.get('files', dict()) \
+                    if folder.get('source') == root else dict()
+                host = self._list_host(root)
+                staged = self._list_volume(helper, name)
+                # copies modified in the volume take precedence, files
+                # missing from the volume are copied again
+                known = {
+                    k: v for k, v in known.items()
+                    if v is not None and staged.get(k) == (v[SIZE], v[MTIME])}
+                removed = [
+                    x for x in known if x not in host and x in staged]
+                plan.append(
+                    (name, root, self._changed(root, host, known), known,
+                     removed))
+            total = sum(
+                size for _, _, changed, _, _ in plan
+                for size, _ in changed.values())
+            count = sum(len(changed) for _, _, changed, _, _ in plan)
+            self.logger.info(
+                "Copying {} files ({:.1f}Mb) to volume '{}'.".format(
+                    count, total / 1024 ** 2, self.volume))
+            self.transferred = 0
+            started = time.monotonic()
+            self._progress(total, started, progress)
+            for name, root, changed, known, removed in plan:
+                for i in range(0, len(removed), 100):
+                    helper.exec_run(
+                        ['rm', '-f', '--'] + removed[i:i + 100],
+                        workdir='/'.join((VOLUME_PATH, name)))
+                for rel in removed:
+                    del known[rel]
+                entries = dict()
+                if len(changed) > 0:
+                    helper.put_archive(VOLUME_PATH, self._tar(
+                        name, root, changed, entries, total, started,
+                        progress, stopped))
+                known.update(entries)
+                manifest[name] = {'source': root, 'files': known}
+                self._save_manifest(manifest)
+                if stopped is not None and stopped.is_set():
+                    self.logger.info("Copy to volume cancelled.")
+                    return False
+            self.logger.info(
+                "Copied {:.1f}Mb in {:.1f}s ({:.1f}Mb/s).".format(
+                    self.transferred / 1024 ** 2,
+                    time.monotonic() - started, self.rate / 1024 ** 2))
+            return True
+        finally:
+            helper.remove(force=True)
+
+    def _extract(self, helper, name, rel, dest, mtime, entries):
+        """Copy a file from the volume to the host."""
+        chunks, _ = helper.get_archive(
+            '/'.join((VOLUME_PATH, name, rel)), chunk_size=CHUNK_SIZE)
+        with tarfile.open(fileobj=_IterStream(chunks), mode='r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                tmp = "{}.tmp".format(dest)
+                digest = hashlib.sha256()
+                with tar.extractfile(member) as src, open(tmp, 'wb') as dst:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                        dst.write(chunk)
+                        self.transferred += len(chunk)
+                        yield
+                os.replace(tmp, dest)
+                os.utime(dest, (mtime, mtime))
+                entries[rel] = [
+                    member.size, mtime, digest.hexdigest(), mtime]
+                break
+
+    @tracing.traced("staging.sync_out")
+    def sync_out(self, progress=None, stopped=None):
+        """Copy files created or changed in the volume to the host.
+
+        Files which have also changed on the host since they were copied
+        to the volume are not overwritten, the copy from the volume is
+        written alongside with the suffix `CONFLICT_SUFFIX`. Files removed
+        from the volume are not removed from the host.
+
+        :param progress: signal to which progress is emitted.
+        :param stopped: a `threading.Event` to cancel the copy.
+
+        :returns: True if the copy completed.
+        """
+        names = self.names
+        manifest = self._load_manifest()
+        helper = self._helper()
+        try:
+            plan = list()
+            for name, root in names.items():
+                folder = manifest.get(name, dict())
+                if folder.get('source') != root:
+                    continue
+                known = folder['files']
+                staged = self._list_volume(helper, name)
+                changed = {
+                    k: v for k, v in staged.items()
+                    if known.get(k) is None
+                    or (known[k][SIZE], known[k][MTIME]) != v}
+                plan.append((name, root, changed, known))
+            total = sum(
+                size for _, _, changed, _ in plan
+                for size, _ in changed.values())
+            count = sum(len(changed) for _, _, changed, _ in plan)
+            self.logger.info(
+                "Copying {} files ({:.1f}Mb) from volume '{}'.".format(
+                    count, total / 1024 ** 2, self.volume))
+            self.transferred = 0
+            started = time.monotonic()
+            self._progress(total, started, progress)
+            conflicts = 0
+            for name, root, changed, known in plan:
+                entries = dict()
+                for rel, (size, mtime) in changed.items():
+                    if stopped is not None and stopped.is_set():
+                        break
+                    dest = os.path.join(root, *rel.split('/'))
+                    entry = known.get(rel)
+                    if os.path.exists(dest) and (
+                            entry is None
+                            or (entry[SIZE], entry[HOST_MTIME]) != (
+                                os.path.getsize(dest),
+                                int(os.path.getmtime(dest)))):
+                        conflicts += 1
+                        self.logger.warning(
+                            "File changed on host and in volume: {}, "
+                            "writing copy with suffix '{}'.".format(
+                                dest, CONFLICT_SUFFIX))
+                        dest += CONFLICT_SUFFIX
+                    for _ in self._extract(
+                            helper, name, rel, dest, mtime, entries):
+                        self._progress(total, started, progress)
+                known.update(entries)
+                self._save_manifest(manifest)
+                if stopped is not None and stopped.is_set():
+                    self.logger.info("Copy from volume cancelled.")
+                    return False
+            self.logger.info(
+                "Copied {:.1f}Mb in {:.1f}s ({:.1f}Mb/s), {} conflicts."
+                .format(
+                    self.transferred / 1024 ** 2,
+                    time.monotonic() - started, self.rate / 1024 ** 2,
+                    conflicts))
+            return True
+        finally:
+            helper.remove(force=True)
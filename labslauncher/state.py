@@ -0,0 +1,71 @@
+"""Persistence of the last known state of the server.
+
+A snapshot of the server state is saved whenever it changes, such that at
+the next launch the window can show it immediately, marked as stale,
+whilst docker is queried in the background.
+"""
+import json
+import os
+import time
+
+import labslauncher
+
+
+STATE_FILE = os.path.join(labslauncher.__LOGDIR__, 'state.json')
+FIELDS = (
+    'container_id', 'status', 'tag', 'latest_tag', 'update_available',
+    'address')
+logger = labslauncher.get_named_logger("State")
+
+
+def load(image_name, server_name, fname=None):
+    """Load the last known state.
+
+    :param image_name: the configured server image.
+    :param server_name: the configured server container name.
+    :param fname: the state file.
+
+    :returns: a dictionary of `FIELDS`, or None if there is no state for
+        the configured image and container.
+    """
+    if fname is None:
+        fname = STATE_FILE
+    try:
+        with open(fname, 'r') as fh:
+            state = json.load(fh)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception("Failed to read saved state.")
+        return None
+    if (state.get('image_name'), state.get('server_name')) != \
+            (image_name, server_name):
+        return None
+    if any(x not in state for x in FIELDS):
+        return None
+    logger.info("Loaded state saved at {}.".format(
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['saved']))))
+    return state
+
+
+def save(state, image_name, server_name, fname=None):
+    """Save the current state.
+
+    :param state: a dictionary of `FIELDS`.
+    :param image_name: the configured server image.
+    :param server_name: the configured server container name.
+    :param fname: the state file.
+    """
+    if fname is None:
+        fname = STATE_FILE
+    data = {k: state[k] for k in FIELDS}
+    data.update(
+        image_name=image_name, server_name=server_name, saved=time.time())
+    tmp = "{}.tmp".format(fname)
+    try:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(tmp, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp, fname)
+    except Exception:
+        logger.exception("Failed to save state.")
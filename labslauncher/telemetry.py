@@ -0,0 +1,171 @@
+"""Asynchronous sending of usage statistics."""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from epi2melabs import ping
+import requests
+
+import labslauncher
+
+
+class Telemetry():
+    """Queue usage pings and send them from a background thread.
+
+    Pings are collected into batches and sent over a single HTTP session
+    with a timeout on each request. Pings which cannot be sent, for example
+    when the computer is offline, are spooled to disk and sent along with
+    a later batch.
+    """
+
+    _stop = object()
+    ping_version = '1.1.0'
+
+    def __init__(
+            self, spool=None, timeout=10, batch_delay=2, max_spool=1000):
+        """Initialize the sender.
+
+        :param spool: file in which to store unsent pings.
+        :param timeout: timeout (s) for each HTTP request.
+        :param batch_delay: time (s) to wait for further pings before
+            sending a batch.
+        :param max_spool: maximum number of pings kept in the spool, older
+            pings are discarded first.
+        """
+        if spool is None:
+            spool = os.path.join(labslauncher.__LOGDIR__, 'pings.spool')
+        self.spool = spool
+        self.timeout = timeout
+        self.batch_delay = batch_delay
+        self.max_spool = max_spool
+        self.logger = labslauncher.get_named_logger("Telemtry")
+        # used only to assemble ping data, sending is done here
+        self.pinger = ping.Pingu()
+        self.pinger.enabled = False
+        self._queue = queue.Queue()
+        self._session = requests.Session()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def container_ping(self, action, image_name, stats=None):
+        """Queue a container status ping.
+
+        :param action: one of 'start', 'stop', or 'update'.
+        :param image_name: the name of the image associated with the
+            container.
+        :param stats: container statistics, or a callable returning them.
+            A callable is evaluated on the sending thread.
+        """
+        self._queue.put((action, image_name, stats))
+
+    def close(self, timeout=5):
+        """Send outstanding pings and stop the sending thread.
+
+        :param timeout: time (s) to wait for outstanding pings to be sent.
+            Pings not sent within this time remain in the spool.
+        """
+        self._queue.put(self._stop)
+        self._thread.join(timeout)
+
+    def _run(self):
+        """Collect pings into batches and send them."""
+        closing = False
+        while not closing:
+            batch = list()
+            item = self._queue.get()
+            deadline = time.monotonic() + self.batch_delay
+            while True:
+                if item is self._stop:
+                    closing = True
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if len(batch) > 0:
+                try:
+                    self._send_batch(batch)
+                except Exception:
+                    self.logger.exception("Failed to send ping batch.")
+
+    def _make_ping(self, action, image_name, stats):
+        """Assemble the body of a ping request."""
+        if callable(stats):
+            try:
+                stats = stats()
+            except Exception:
+                self.logger.exception("Failed to collect container stats.")
+                stats = None
+        data = self.pinger.send_container_ping(action, stats, image_name)
+        body = {
+            "tracking_id": {
+                "msg_id": str(uuid.uuid4()), "version": self.ping_version},
+            "hostname": data["hostname"],
+            "os": data["opsys"],
+            "session": str(data["session"])}
+        body.update(data["data"])
+        return body
+
+    def _read_spool(self):
+        """Read unsent pings from the spool."""
+        pings = list()
+        if not os.path.exists(self.spool):
+            return pings
+        try:
+            with open(self.spool, 'r') as fh:
+                for line in fh:
+                    pings.append(json.loads(line))
+        except Exception:
+            self.logger.exception("Failed to read ping spool.")
+        return pings
+
+    def _write_spool(self, pings):
+        """Replace the spool contents with unsent pings."""
+        pings = pings[-self.max_spool:]
+        try:
+            if len(pings) == 0:
+                if os.path.exists(self.spool):
+                    os.remove(self.spool)
+                return
+            os.makedirs(os.path.dirname(self.spool), exist_ok=True)
+            tmp = "{}.tmp".format(self.spool)
+            with open(tmp, 'w') as fh:
+                for item in pings:
+                    fh.write("{}\n".format(json.dumps(item)))
+            os.replace(tmp, self.spool)
+        except Exception:
+            self.logger.exception("Failed to write ping spool.")
+
+    def _send_batch(self, batch):
+        """Send a batch of pings along with any spooled pings."""
+        spooled = self._read_spool()
+        pings = spooled + [self._make_ping(*item) for item in batch]
+        self.logger.info("Sending {} ping(s), {} from spool.".format(
+            len(pings), len(spooled)))
+        unsent = list()
+        for i, body in enumerate(pings):
+            try:
+                response = self._session.post(
+                    ping.ENDPOINT, json=body, timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                # most likely offline, keep the rest for later
+                self.logger.warning(
+                    "Could not send pings, spooling {}.".format(
+                        len(pings) - i))
+                unsent.extend(pings[i:])
+                break
+            if response.status_code >= 500:
+                unsent.append(body)
+            elif response.status_code >= 400:
+                self.logger.warning(
+                    "Ping was rejected with status {}.".format(
+                        response.status_code))
+        if len(unsent) > 0 or len(spooled) > 0:
+            self._write_spool(unsent)
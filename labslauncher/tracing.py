@@ -0,0 +1,188 @@
+"""Lightweight tracing of operations, exported as Chrome trace events.
+
+Spans are recorded as complete ("X") events with the thread on which
+they ran. Spans opened while another span is active on the same thread
+are children of that span. To continue a trace on another thread, capture
+the context with `current()` and `attach()` it on the other thread. The
+trace of an application session is written as JSON to
+`~/.labslauncher/traces`, for viewing in `chrome://tracing` or Perfetto.
+"""
+import collections
+import contextlib
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+import labslauncher
+
+
+TRACE_DIR = os.path.join(labslauncher.__LOGDIR__, 'traces')
+_local = threading.local()
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_events = collections.deque(maxlen=100000)
+_threads = set()
+_ids = itertools.count(1)
+_pid = os.getpid()
+_state = {"path": None, "last_write": 0, "dirty": False}
+logger = labslauncher.get_named_logger("Tracing")
+
+
+def _now():
+    """Return a timestamp in microseconds."""
+    return time.perf_counter() * 1e6
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = list()
+    return stack
+
+
+def _append(event):
+    tid = threading.get_ident()
+    event["pid"] = _pid
+    event["tid"] = tid
+    with _lock:
+        if tid not in _threads:
+            _threads.add(tid)
+            _events.append({
+                "name": "thread_name", "ph": "M", "pid": _pid, "tid": tid,
+                "args": {"name": threading.current_thread().name}})
+        _events.append(event)
+        _state["dirty"] = True
+
+
+def current():
+    """Return the context of the active span on this thread, or None."""
+    stack = _stack()
+    if len(stack) == 0:
+        return None
+    return stack[-1]
+
+
+@contextlib.contextmanager
+def span(name, root=True, **args):
+    """Record a span around a block of code.
+
+    :param name: name of the span.
+    :param root: if False, the span is recorded only when it is part of
+        an existing trace.
+    :param args: additional data to record with the span.
+    """
+    parent = current()
+    if parent is None and not root:
+        yield
+        return
+    trace_id = next(_ids) if parent is None else parent[0]
+    context = (trace_id, next(_ids))
+    stack = _stack()
+    stack.append(context)
+    start = _now()
+    try:
+        yield
+    finally:
+        end = _now()
+        stack.pop()
+        args["trace"] = trace_id
+        _append({
+            "name": name, "cat": name.split('.')[0], "ph": "X",
+            "ts": start, "dur": end - start, "args": args})
+        if parent is None:
+            _write_soon()
+
+
+def traced(name):
+    """Decorate a function to record it as a span.
+
+    :param name: name of the span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flow_start(context):
+    """Mark that a trace is handed to another thread.
+
+    :param context: context from `current()`.
+
+    :returns: an identifier to pass to `attach`.
+    """
+    if context is None:
+        return None
+    flow = next(_ids)
+    _append({
+        "name": "handoff", "cat": "flow", "ph": "s", "id": flow,
+        "ts": _now()})
+    return flow
+
+
+@contextlib.contextmanager
+def attach(context, flow=None):
+    """Continue a trace from another thread on this thread.
+
+    :param context: context from `current()` on the other thread.
+    :param flow: identifier from `flow_start`, to link the threads in the
+        trace viewer.
+    """
+    if context is None:
+        yield
+        return
+    if flow is not None:
+        _append({
+            "name": "handoff", "cat": "flow", "ph": "f", "bp": "e",
+            "id": flow, "ts": _now()})
+    stack = _stack()
+    stack.append(context)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def _write_soon(interval=10):
+    """Write the trace in the background, at most every `interval` s."""
+    if time.monotonic() - _state["last_write"] < interval:
+        return
+    _state["last_write"] = time.monotonic()
+    threading.Thread(target=write, daemon=True).start()
+
+
+def write(keep=10):
+    """Write the trace of this session to file.
+
+    :param keep: number of trace files to keep, older files are removed.
+    """
+    with _write_lock:
+        with _lock:
+            if not _state["dirty"]:
+                return
+            events = list(_events)
+            _state["dirty"] = False
+        try:
+            if _state["path"] is None:
+                os.makedirs(TRACE_DIR, exist_ok=True)
+                _state["path"] = os.path.join(
+                    TRACE_DIR, "labslauncher-{}-{}.json".format(
+                        time.strftime('%Y%m%d-%H%M%S'), _pid))
+                old = sorted(
+                    x for x in os.listdir(TRACE_DIR)
+                    if x.startswith("labslauncher-"))
+                for fname in old[:max(0, len(old) - keep + 1)]:
+                    os.remove(os.path.join(TRACE_DIR, fname))
+            tmp = "{}.tmp".format(_state["path"])
+            with open(tmp, 'w') as fh:
+                json.dump(
+                    {"traceEvents": events, "displayTimeUnit": "ms"}, fh)
+            os.replace(tmp, _state["path"])
+        except Exception:
+            logger.exception("Failed to write trace.")
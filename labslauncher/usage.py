@@ -0,0 +1,441 @@
+"""History of the resource usage of the server container.
+
+Statistics of the server container are downsampled to one sample per
+interval and stored in a local SQLite database, along with a summary of
+each session: a run of the container from its start until it is stopped.
+Samples are written in batches from a background thread and those older
+than the retention period are removed.
+"""
+import calendar
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from PyQt5.QtCore import pyqtSlot as Slot, QObject, QTimer
+
+import labslauncher
+from labslauncher.qtext import Worker
+
+
+DB_FILE = os.path.join(labslauncher.__LOGDIR__, 'usage.sqlite')
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY, container_id TEXT, image TEXT, tag TEXT,
+    started REAL NOT NULL, ended REAL NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    cpu_seconds REAL NOT NULL DEFAULT 0, cpu_peak REAL NOT NULL DEFAULT 0,
+    mem_peak INTEGER NOT NULL DEFAULT 0, mem_limit INTEGER,
+    blk_read INTEGER NOT NULL DEFAULT 0, blk_write INTEGER NOT NULL DEFAULT 0,
+    net_rx INTEGER NOT NULL DEFAULT 0, net_tx INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE INDEX IF NOT EXISTS sessions_ended ON sessions (ended);
+CREATE TABLE IF NOT EXISTS samples (
+    session_id TEXT NOT NULL, time REAL NOT NULL, cpu REAL, mem INTEGER,
+    blk_read INTEGER, blk_write INTEGER, net_rx INTEGER, net_tx INTEGER);
+CREATE UNIQUE INDEX IF NOT EXISTS samples_key ON samples (session_id, time);
+CREATE INDEX IF NOT EXISTS samples_time ON samples (time);
+"""
+COUNTERS = ('cpu_ns', 'blk_read', 'blk_write', 'net_rx', 'net_tx')
+
+
+def parse_stats(stats):
+    """Extract the values recorded from a container statistics sample.
+
+    Counters are cumulative from the start of the container.
+
+    :param stats: statistics, as returned by the docker API.
+
+    :returns: dictionary with the CPU time (ns), memory use and limit
+        (bytes) excluding the page cache, bytes read and written to block
+        devices and bytes received and sent over the network, or None if
+        the container is not running.
+    """
+    cpu = stats.get('cpu_stats', dict()).get('cpu_usage', dict())
+    memory = stats.get('memory_stats', dict())
+    if 'total_usage' not in cpu or 'usage' not in memory:
+        return None
+    detail = memory.get('stats', dict())
+    # cgroups v1 and v2, as reported by `docker stats`
+    cache = detail.get('total_inactive_file', detail.get('inactive_file', 0))
+    values = dict(
+        cpu_ns=cpu['total_usage'],
+        mem=max(0, memory['usage'] - cache), mem_limit=memory.get('limit'),
+        blk_read=0, blk_write=0, net_rx=0, net_tx=0)
+    blkio = stats.get('blkio_stats', dict())
+    for item in blkio.get('io_service_bytes_recursive') or ():
+        op = item.get('op', '').lower()
+        if op in ('read', 'write'):
+            values['blk_{}'.format(op)] += item.get('value', 0)
+    for net in (stats.get('networks') or dict()).values():
+        values['net_rx'] += net.get('rx_bytes', 0)
+        values['net_tx'] += net.get('tx_bytes', 0)
+    return values
+
+
+def parse_time(text):
+    """Return the epoch time of a docker timestamp, to the second.
+
+    :param text: timestamp, e.g. '2020-10-19T10:15:20.123456789Z'.
+    """
+    return calendar.timegm(time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+class UsageStore():
+    """SQLite storage of container resource usage.
+
+    Writes are queued and committed in batches on a background thread,
+    which holds the only writing connection. Queries open their own
+    connection and may be run from any thread.
+    """
+
+    _stop = object()
+
+    def __init__(self, fname=None, retention=365, batch_delay=30):
+        """Initialize the store.
+
+        :param fname: the database file.
+        :param retention: number of days for which usage is kept.
+        :param batch_delay: time (s) to collect samples before writing.
+        """
+        if fname is None:
+            fname = DB_FILE
+        self.fname = fname
+        self.retention = retention
+        self.batch_delay = batch_delay
+        self.logger = labslauncher.get_named_logger("UsageDB")
+        self._pruned = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, session, sample):
+        """Queue a sample of a session.
+
+        :param session: dictionary with the session `id`, `container_id`,
+            `image`, `tag` and `started` time.
+        :param sample: dictionary with the sample `time`, mean `cpu`
+            (cores) over the sample interval, peak `mem` (bytes), and
+            `cpu_seconds`, `mem_limit`, `blk_read`, `blk_write`, `net_rx`
+            and `net_tx` totals of the session.
+        """
+        if self._thread.is_alive():
+            self._queue.put((session, sample))
+
+    def close(self, timeout=5):
+        """Write outstanding samples and stop the writing thread.
+
+        :param timeout: time (s) to wait for outstanding samples.
+        """
+        self._queue.put(self._stop)
+        self._thread.join(timeout)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        conn = sqlite3.connect(self.fname, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _run(self):
+        """Collect samples into batches and write them."""
+        try:
+            conn = self._connect()
+            # readers are not blocked by the writer
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._migrate(conn)
+            conn.executescript(SCHEMA)
+            self._prune(conn)
+        except Exception:
+            self.logger.exception("Failed to open usage database.")
+            return
+        closing = False
+        while not closing:
+            batch = list()
+            item = self._queue.get()
+            deadline = time.monotonic() + self.batch_delay
+            while True:
+                if item is self._stop:
+                    closing = True
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            try:
+                if len(batch) > 0:
+                    self._write(conn, batch)
+                if time.time() - self._pruned > 24 * 60 * 60:
+                    self._prune(conn)
+            except Exception:
+                self.logger.exception("Failed to write usage.")
+        conn.close()
+
+    @staticmethod
+    def _migrate(conn):
+        """Remove repeated samples stored before samples were unique."""
+        table = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'samples'").fetchone()
+        key = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'samples_key'"
+        ).fetchone()
+        if table is None or key is not None:
+            return
+        with conn:
+            conn.execute(
+                'DELETE FROM samples WHERE rowid NOT IN ('
+                'SELECT MIN(rowid) FROM samples GROUP BY session_id, time)')
+            conn.execute('DROP INDEX IF EXISTS samples_session')
+
+    def _write(self, conn, batch):
+        """Write a batch of samples in a single transaction."""
+        rows = [dict(sample, **session) for session, sample in batch]
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO sessions '
+                '(id, container_id, image, tag, started, ended) '
+                'VALUES (:id, :container_id, :image, :tag, :started, :time)',
+                rows)
+            # a repeated sample is stored once, and as totals are
+            # cumulative it does not change those of the session
+            conn.executemany(
+                'INSERT OR IGNORE INTO samples VALUES (:id, :time, :cpu, '
+                ':mem, :blk_read, :blk_write, :net_rx, :net_tx)', rows)
+            conn.executemany(
+                'UPDATE sessions SET ended = MAX(ended, :time), '
+                'samples = (SELECT COUNT(*) FROM samples '
+                'WHERE session_id = :id), '
+                'cpu_seconds = MAX(cpu_seconds, :cpu_seconds), '
+                'cpu_peak = MAX(cpu_peak, IFNULL(:cpu, 0)), '
+                'mem_peak = MAX(mem_peak, :mem), mem_limit = :mem_limit, '
+                'blk_read = MAX(blk_read, :blk_read), '
+                'blk_write = MAX(blk_write, :blk_write), '
+                'net_rx = MAX(net_rx, :net_rx), '
+                'net_tx = MAX(net_tx, :net_tx) WHERE id = :id', rows)
+
+    def _prune(self, conn):
+        """Remove usage older than the retention period."""
+        cutoff = time.time() - self.retention * 24 * 60 * 60
+        with conn:
+            n = conn.execute(
+                'DELETE FROM sessions WHERE ended < ?', (cutoff,)).rowcount
+            conn.execute('DELETE FROM samples WHERE time < ?', (cutoff,))
+        self._pruned = time.time()
+        if n > 0:
+            self.logger.info(
+                "Removed {} session(s) older than {} days.".format(
+                    n, self.retention))
+
+    def sessions(self, limit=100):
+        """Return the most recent sessions.
+
+        :param limit: the maximum number of sessions.
+
+        :returns: list of dictionaries, most recent first.
+        """
+        if not os.path.exists(self.fname):
+            return list()
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT * FROM sessions ORDER BY started DESC LIMIT ?',
+                (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(x) for x in rows]
+
+    def samples(self, session_id):
+        """Return the samples of a session, in time order.
+
+        :param session_id: the session `id`.
+        """
+        if not os.path.exists(self.fname):
+            return list()
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT * FROM samples WHERE session_id = ? ORDER BY time',
+                (session_id,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(x) for x in rows]
+
+    def summary(self):
+        """Return peak usage across all sessions.
+
+        :returns: dictionary with the number of `sessions`, their total
+            `duration`, the maximum and 95th percentile of the peak memory
+            (`mem_max`, `mem_p95`) and peak CPU (`cpu_max`, `cpu_p95`).
+        """
+        summary = dict(
+            sessions=0, duration=0, mem_max=0, mem_p95=0, cpu_max=0,
+            cpu_p95=0)
+        if not os.path.exists(self.fname):
+            return summary
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT ended - started, mem_peak, cpu_peak FROM sessions '
+                'WHERE samples > 0').fetchall()
+        finally:
+            conn.close()
+        if len(rows) == 0:
+            return summary
+        summary['sessions'] = len(rows)
+        summary['duration'] = sum(x[0] for x in rows)
+        for i, key in ((1, 'mem'), (2, 'cpu')):
+            values = sorted(x[i] for x in rows)
+            summary['{}_max'.format(key)] = values[-1]
+            summary['{}_p95'.format(key)] = values[
+                min(len(values) - 1, int(0.95 * len(values)))]
+        return summary
+
+
+class UsageRecorder(QObject):
+    """Sample the resource usage of the running server container.
+
+    Statistics are streamed from the asynchronous engine client if
+    available, else polled once per interval in a worker thread.
+    """
+
+    def __init__(self, client, pool, store, engine=None, interval=60):
+        """Initialize the recorder.
+
+        :param client: a `dockerutil.DockerClient`.
+        :param pool: a `QThreadPool` on which to poll statistics.
+        :param store: a `UsageStore`.
+        :param engine: an `aioengine.EngineThread`, or None.
+        :param interval: time (s) between stored samples.
+        """
+        super().__init__()
+        self.client = client
+        self.pool = pool
+        self.store = store
+        self.engine = engine
+        self.interval = interval
+        self.logger = labslauncher.get_named_logger("UsageRec")
+        self.session = None
+        self._job = None
+        self._window = None
+        self._last = None
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._poll)
+
+    @property
+    def active(self):
+        """Return whether a session is being recorded."""
+        return self.session is not None
+
+    def start(self):
+        """Start recording the running server container."""
+        if self.active:
+            return
+        worker = Worker(self._inspect)
+        worker.setAutoDelete(True)
+        worker.signals.result.connect(self._begin)
+        self.pool.start(worker)
+
+    def _inspect(self, progress=None, stopped=None):
+        """Return the running container's session, or None."""
+        cont = self.client.container
+        if cont is None or cont.status != 'running':
+            return None
+        started = cont.attrs['State']['StartedAt']
+        return {
+            # a run of the container, the same after a restart of the app
+            'id': "{}-{}".format(cont.id[:12], started),
+            'container_id': cont.id, 'image': self.client.image_name,
+            'tag': self.client.tag.value, 'started': parse_time(started)}
+
+    @Slot(object)
+    def _begin(self, session):
+        if session is None or self.active:
+            return
+        self.session = session
+        self._window = None
+        self._last = None
+        self.logger.info("Recording usage of session {}.".format(
+            session['id']))
+        if self.engine is not None:
+            self._job = self.engine.submit(
+                self.engine.engine.stats, session['container_id'],
+                streaming=True, defer=True)
+            self._job.item.connect(self.add)
+            self._job.start()
+        else:
+            self._timer.start(int(1000 * self.interval))
+            self._poll()
+
+    def _poll(self):
+        worker = Worker(self.client.container_stats)
+        worker.setAutoDelete(True)
+        worker.signals.result.connect(self.add)
+        self.pool.start(worker)
+
+    @Slot(object)
+    def add(self, stats):
+        """Add a statistics sample of the container.
+
+        Samples are combined over each interval, keeping the mean CPU use
+        and peak memory use.
+
+        :param stats: statistics, as returned by the docker API.
+        """
+        if self.session is None or stats is None:
+            return
+        values = parse_stats(stats)
+        if values is None:
+            return
+        now = time.time()
+        window = self._window
+        if window is None:
+            window = self._window = dict(start=now, mem=0, cpu_ns=None)
+            if self._last is not None:
+                window['start'], window['cpu_ns'] = self._last
+        if window['cpu_ns'] is None:
+            window['cpu_ns'] = values['cpu_ns']
+        window['mem'] = max(window['mem'], values['mem'])
+        window['values'] = values
+        window['time'] = now
+        if now - window['start'] >= self.interval:
+            self._flush()
+
+    def _flush(self):
+        """Store the sample of the current interval."""
+        window, self._window = self._window, None
+        if window is None or 'values' not in window:
+            return
+        values = window['values']
+        elapsed = window['time'] - window['start']
+        cpu = None
+        if elapsed > 0:
+            cpu = (values['cpu_ns'] - window['cpu_ns']) / (elapsed * 1e9)
+        self._last = (window['time'], values['cpu_ns'])
+        sample = {k: values[k] for k in COUNTERS if k != 'cpu_ns'}
+        sample.update(
+            time=window['time'], cpu=cpu, mem=window['mem'],
+            mem_limit=values['mem_limit'],
+            cpu_seconds=values['cpu_ns'] / 1e9)
+        self.store.record(self.session, sample)
+
+    def stop(self, final_stats=None):
+        """Stop recording, storing the partial final interval.
+
+        :param final_stats: the last statistics of the container.
+        """
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        self._timer.stop()
+        if self.session is None:
+            return
+        if final_stats is not None:
+            self.add(final_stats)
+        self._flush()
+        self.logger.info("Stopped recording session {}.".format(
+            self.session['id']))
+        self.session = None
@@ -0,0 +1,137 @@
+"""Detection of stalls in the Qt event loop."""
+import bisect
+import os
+import sys
+import threading
+import time
+import traceback
+
+from PyQt5.QtCore import QObject, QTimer
+
+import labslauncher
+
+
+class StallDetector(QObject):
+    """Report when the Qt event loop is blocked.
+
+    A high frequency timer on the GUI thread records when the event loop
+    last ran. A monitor thread checks this regularly and, when the event
+    loop has not run for longer than a threshold, captures the Python stack
+    of the GUI thread. When the event loop resumes the stall duration and
+    the captured stack are logged and added to a histogram.
+    """
+
+    buckets = (0.25, 0.5, 1, 2, 5, 10, 30, 60)
+
+    def __init__(self, threshold=0.25, interval=0.05, report=None):
+        """Initialize the detector.
+
+        :param threshold: event loop latency (s) considered a stall.
+        :param interval: interval (s) of the event loop timer.
+        :param report: file to which the stall histogram is written.
+        """
+        super().__init__()
+        if report is None:
+            report = os.path.join(labslauncher.__LOGDIR__, 'stalls.txt')
+        self.threshold = threshold
+        self.interval = interval
+        self.report_file = report
+        self.logger = labslauncher.get_named_logger("Watchdog")
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.max_latency = 0
+        self.stalls = list()
+        self._gui_thread = threading.get_ident()
+        self._lock = threading.Lock()
+        self._last_tick = time.monotonic()
+        self._stack = None
+        self._stopped = threading.Event()
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(1000 * interval))
+        self.timer.timeout.connect(self._tick)
+        self._monitor = threading.Thread(target=self._watch, daemon=True)
+
+    def start(self):
+        """Start monitoring."""
+        self.logger.info(
+            "Monitoring event loop, stall threshold {:.0f}ms.".format(
+                1000 * self.threshold))
+        self._last_tick = time.monotonic()
+        self.timer.start()
+        self._monitor.start()
+
+    def stop(self):
+        """Stop monitoring and write the stall report."""
+        self._stopped.set()
+        self.timer.stop()
+        self.logger.info("Event loop stalls:\n{}".format(self.histogram()))
+        self.write_report()
+
+    def _tick(self):
+        """Record that the event loop ran, and any stall that ended."""
+        now = time.monotonic()
+        with self._lock:
+            latency = now - self._last_tick - self.interval
+            self._last_tick = now
+            stack, self._stack = self._stack, None
+        self.max_latency = max(self.max_latency, latency)
+        if latency < self.threshold:
+            return
+        self.counts[bisect.bisect_right(self.buckets, latency)] += 1
+        self.stalls.append((time.time(), latency, stack))
+        self.stalls = self.stalls[-20:]
+        if stack is None:
+            stack = "(stack not captured)\n"
+        self.logger.warning(
+            "Event loop stalled for {:.0f}ms, GUI thread was in:\n{}".format(
+                1000 * latency, stack.rstrip()))
+
+    def _watch(self):
+        """Capture the GUI thread stack when the event loop stalls."""
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                blocked = time.monotonic() - self._last_tick - self.interval
+                captured = self._stack is not None
+            if blocked < self.threshold or captured:
+                continue
+            frame = sys._current_frames().get(self._gui_thread)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            del frame
+            with self._lock:
+                self._stack = stack
+
+    def histogram(self):
+        """Return a text histogram of stall durations."""
+        lines = list()
+        lower = self.threshold
+        for upper, count in zip(self.buckets + (None,), self.counts):
+            if upper is not None and upper <= lower:
+                continue
+            if upper is None:
+                label = ">{}s".format(lower)
+            else:
+                label = "{}-{}s".format(lower, upper)
+                lower = upper
+            lines.append("{:>12}: {}".format(label, count))
+        lines.append("max latency: {:.3f}s".format(self.max_latency))
+        return "\n".join(lines)
+
+    def write_report(self):
+        """Write the stall histogram and recent stalls to file."""
+        try:
+            with open(self.report_file, 'w') as fh:
+                fh.write("Launcher version: {}\n".format(
+                    labslauncher.__version__))
+                fh.write("Event loop stalls:\n{}\n".format(self.histogram()))
+                for timestamp, latency, stack in self.stalls:
+                    fh.write("\n{} stalled {:.0f}ms:\n{}".format(
+                        time.strftime(
+                            '%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+                        1000 * latency, stack or "(stack not captured)\n"))
+        except Exception:
+            self.logger.exception("Failed to write stall report.")
+        else:
+            self.logger.info(
+                "Stall report written to: {}.".format(self.report_file))
@@ -0,0 +1,111 @@
+"""Fixtures for tests of labslauncher against fake servers."""
+import os
+import sys
+import time
+
+import pytest
+
+# the fake servers are shared with the benchmarks
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    os.pardir, "benchmarks"))
+from fakes import FakeEngine, FakeHub  # noqa: E402
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+IMAGE = "ontresearch/nanolabs-notebook"
+
+
+def wait_for(condition, timeout=5):
+    """Process Qt events until a condition holds."""
+    from PyQt5.QtCore import QCoreApplication
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        QCoreApplication.processEvents()
+        time.sleep(0.01)
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    """Return a Qt application, required for timers and signals."""
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication.instance()
+    if app is None:
+        app = QCoreApplication([])
+    return app
+
+
+@pytest.fixture
+def engine_factory(monkeypatch):
+    """Return a function to start fake Docker Engines.
+
+    The environment is pointed at the most recently started engine.
+    """
+    engines = list()
+
+    def factory(**kwargs):
+        engine = FakeEngine(**kwargs).start()
+        engines.append(engine)
+        monkeypatch.setenv("DOCKER_HOST", engine.base_url)
+        return engine
+
+    yield factory
+    for engine in engines:
+        engine.stop()
+
+
+@pytest.fixture
+def hub_factory(monkeypatch):
+    """Return a function to start fake Docker Hubs.
+
+    `dockerutil` is pointed at the most recently started hub and its tag
+    caches are cleared.
+    """
+    from labslauncher import dockerutil
+    hubs = list()
+
+    def factory(**kwargs):
+        hub = FakeHub(**kwargs).start()
+        hubs.append(hub)
+        monkeypatch.setattr(dockerutil, "HUB_URL", hub.base_url)
+        dockerutil.clear_tag_cache()
+        return hub
+
+    yield factory
+    for hub in hubs:
+        hub.stop()
+    dockerutil.clear_tag_cache()
+
+
+@pytest.fixture
+def hub(hub_factory):
+    """Start a fake Docker Hub, to which `dockerutil` is pointed."""
+    return hub_factory(tags=20)
+
+
+@pytest.fixture
+def client_factory(qapp):
+    """Return a function creating a DockerClient.
+
+    Start the fake servers with `engine_factory` and `hub` first.
+    """
+    from labslauncher.dockerutil import DockerClient
+    clients = list()
+    # the properties of clients are shared by the class, the app has one
+    DockerClient.status.value = ('', 'unknown')
+    DockerClient.tag.value = ''
+    DockerClient._available.value = False
+    DockerClient.stale.value = False
+
+    def factory(**kwargs):
+        client = DockerClient(
+            IMAGE, "Epi2Me-Labs-Server", "/epi2melabs/",
+            "start-notebook.sh", host_only=True, **kwargs)
+        client.heartbeat.stop()
+        clients.append(client)
+        return client
+
+    yield factory
+    for client in clients:
+        client.heartbeat.stop()
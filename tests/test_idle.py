@@ -0,0 +1,179 @@
+"""Tests of labslauncher.idle, against fake docker and notebook servers."""
+import collections
+import time
+
+from PyQt5.QtCore import QThreadPool
+import pytest
+
+from conftest import wait_for
+from fakes import FakeNotebook
+from labslauncher import idle
+
+
+Container = collections.namedtuple('Container', ['attrs'])
+
+
+@pytest.mark.parametrize("args, host, expected", [
+    (["--NotebookApp.token=EPI2MELabs", "--port=8888"], None,
+        ("http://127.0.0.1:8888", "EPI2MELabs")),
+    (["--port=9000", "--NotebookApp.token=a=b"], "server",
+        ("http://server:9000", "a=b")),
+    (["--NotebookApp.token=EPI2MELabs"], None, (None, "EPI2MELabs")),
+    (["--port=8888"], None, ("http://127.0.0.1:8888", None))])
+def test_server_address(args, host, expected):
+    """The address and token are those given to the server."""
+    assert idle.server_address(Container({'Args': args}), host) == expected
+
+
+@pytest.fixture
+def notebook(engine_factory):
+    """Start a fake notebook server, run by the server container."""
+    engine = engine_factory()
+    with FakeNotebook() as notebook:
+        engine.containers[-1]["Args"] = [
+            "--NotebookApp.token=EPI2MELabs",
+            "--port={}".format(notebook.port)]
+        notebook.engine = engine
+        yield notebook
+
+
+@pytest.fixture
+def monitor_factory(hub, client_factory):
+    """Return a function creating monitors of the server container."""
+    pools = list()
+
+    def factory(**kwargs):
+        pool = QThreadPool()
+        pools.append(pool)
+        return idle.IdleMonitor(client_factory(), pool, **kwargs)
+
+    yield factory
+    for pool in pools:
+        pool.waitForDone()
+
+
+def test_query(notebook, monitor_factory):
+    """Activity is the latest of the server and its kernels."""
+    now = time.time()
+    notebook.last_activity = now - 3600
+    notebook.add_kernel(now - 7200, busy=True)
+    notebook.add_kernel(now - 60)
+    notebook.add_kernel(now - 1800)
+    monitor = monitor_factory(timeout=10)
+    activity = monitor._query(600, idle.STOP)
+    assert activity == {
+        'last_activity': int(now - 60), 'kernels': 3, 'busy': 1,
+        'culled': []}
+    # the monitor's requests are not counted as activity
+    assert all(x == {'no_track_activity': '1'} for x in notebook.queries)
+
+
+def test_query_cull(notebook, monitor_factory):
+    """Kernels idle for the timeout are shut down, unless busy."""
+    now = time.time()
+    busy = notebook.add_kernel(now - 7200, busy=True)
+    recent = notebook.add_kernel(now - 60)
+    notebook.add_kernel(now - 1800, name="ir")
+    monitor = monitor_factory(timeout=10, action=idle.CULL)
+    activity = monitor._query(600, idle.CULL)
+    assert activity['culled'] == ["ir"]
+    assert [x['id'] for x in notebook.kernels] == [busy, recent]
+
+
+def test_query_stopped(notebook, monitor_factory):
+    """A server which is not running is not queried."""
+    notebook.engine.containers[-1]["State"]["Status"] = "exited"
+    monitor = monitor_factory(timeout=10)
+    assert monitor._query(600, idle.STOP) is None
+    assert notebook.requests == 0
+
+
+def activity(idle_time, busy=0, culled=()):
+    """Return the activity of a server idle for a time (s)."""
+    return {
+        'last_activity': time.time() - idle_time, 'kernels': 2,
+        'busy': busy, 'culled': list(culled)}
+
+
+@pytest.mark.parametrize("action, idle_time, busy, stopped", [
+    (idle.STOP, 601, 0, True),
+    (idle.STOP, 590, 0, False),
+    # a busy kernel is active, though it may not report activity
+    (idle.STOP, 3600, 1, False),
+    (idle.CULL, 3600, 0, False)])
+def test_on_activity(qapp, action, idle_time, busy, stopped):
+    """The server is stopped once idle, unless only kernels are culled."""
+    monitor = idle.IdleMonitor(None, None, timeout=10, action=action)
+    messages = list()
+    monitor.idle.connect(messages.append)
+    monitor.start()
+    monitor.on_activity(activity(idle_time, busy=busy))
+    assert monitor.busy == busy
+    assert len(messages) == int(stopped)
+    assert monitor.active != stopped
+    monitor.stop()
+
+
+def test_on_activity_culled(qapp):
+    """Culled kernels are reported."""
+    monitor = idle.IdleMonitor(None, None, timeout=10, action=idle.CULL)
+    messages = list()
+    monitor.culled.connect(messages.append)
+    monitor.start()
+    monitor.on_activity(activity(60, culled=["python3", "ir"]))
+    assert len(messages) == 1
+    assert messages[0].startswith("2 kernel(s)")
+    assert messages[0].endswith("python3, ir.")
+    assert monitor.active
+    monitor.stop()
+
+
+def test_on_activity_ignored(qapp):
+    """Activity is ignored once stopped, or if the server is not running."""
+    monitor = idle.IdleMonitor(None, None, timeout=10)
+    messages = list()
+    monitor.idle.connect(messages.append)
+    monitor.on_activity(activity(3600))
+    monitor.start()
+    monitor.on_activity(None)
+    assert messages == []
+    assert monitor.last_activity is None
+    monitor.stop()
+
+
+@pytest.mark.parametrize("timeout, action", [
+    (0, idle.STOP), (10, 'hibernate')])
+def test_disabled(qapp, timeout, action):
+    """A monitor without a timeout or valid action does not poll."""
+    monitor = idle.IdleMonitor(None, None, timeout=timeout, action=action)
+    monitor.start()
+    assert not monitor.enabled
+    assert not monitor.active
+
+
+def test_poll(notebook, monitor_factory):
+    """An idle server is found by polling."""
+    notebook.last_activity = time.time() - 120
+    monitor = monitor_factory(timeout=1)
+    messages = list()
+    monitor.idle.connect(messages.append)
+    monitor.start()
+    monitor.poll()
+    wait_for(lambda: monitor.worker is None)
+    assert len(messages) == 1
+    assert not monitor.active
+
+
+def test_poll_error(notebook, monitor_factory):
+    """A failed query does not stop polling."""
+    notebook.token = "other"
+    notebook.last_activity = time.time() - 120
+    monitor = monitor_factory(timeout=1)
+    messages = list()
+    monitor.idle.connect(messages.append)
+    monitor.start()
+    monitor.poll()
+    wait_for(lambda: monitor.worker is None)
+    assert messages == []
+    assert monitor.active
+    monitor.stop()
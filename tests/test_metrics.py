@@ -0,0 +1,126 @@
+"""Tests of labslauncher.metrics."""
+import pytest
+import requests
+
+from labslauncher import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Register metrics created by a test apart from those of the app."""
+    registry = list()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    return registry
+
+
+@pytest.mark.parametrize("method, url, expected", [
+    ("GET", "http+docker://localhost/v1.40/version", "GET /version"),
+    ("GET", "http+docker://localhost/v1.40/images/json?all=1",
+        "GET /images/json"),
+    ("POST", "http+docker://localhost/v1.40/images/create"
+        "?fromImage=ontresearch%2Fnanolabs-notebook&tag=latest",
+        "POST /images/create"),
+    ("GET", "http+docker://localhost/v1.40/images/"
+        "ontresearch/nanolabs-notebook:v0.1.9/json",
+        "GET /images/{name}/json"),
+    ("DELETE", "http+docker://localhost/v1.40/images/sha256:0123abcd",
+        "DELETE /images/{name}"),
+    ("GET", "http+docker://localhost/v1.40/containers/json",
+        "GET /containers/json"),
+    ("POST", "http+docker://localhost/v1.40/containers/create?name=x",
+        "POST /containers/create"),
+    ("POST", "http+docker://localhost/v1.40/containers/0123abcd/start",
+        "POST /containers/{id}/start"),
+    ("GET", "http+docker://localhost/v1.40/containers/0123abcd/json",
+        "GET /containers/{id}/json"),
+    ("DELETE", "tcp://127.0.0.1:2375/volumes/scratch", "DELETE /volumes/{id}"),
+    ("GET", "http+docker://localhost/_ping", "GET /_ping")])
+def test_api_endpoint(method, url, expected):
+    """Versions, queries and identifiers are removed from endpoints."""
+    assert metrics.api_endpoint(method, url) == expected
+
+
+def test_counter(registry):
+    """Counters are rendered per label set, with escaped values."""
+    counter = metrics.Counter(
+        "test_total", "A test counter.", labels=("endpoint", "status"))
+    assert counter.value(endpoint="GET /version", status=200) == 0
+    counter.inc(endpoint="GET /version", status=200)
+    counter.inc(2, endpoint="GET /version", status=200)
+    counter.inc(endpoint='GET /"quoted"', status=500)
+    assert counter.value(endpoint="GET /version", status=200) == 3
+    assert counter.render().splitlines() == [
+        "# HELP test_total A test counter.",
+        "# TYPE test_total counter",
+        'test_total{endpoint="GET /\\"quoted\\"",status="500"} 1',
+        'test_total{endpoint="GET /version",status="200"} 3']
+    assert registry == [counter]
+
+
+def test_gauge(registry):
+    """Gauges are set, or computed when rendered unless None."""
+    gauge = metrics.Gauge("test_gauge", "A test gauge.")
+    gauge.set(5)
+    gauge.set(2)
+    assert gauge.render().splitlines()[-1] == "test_gauge 2"
+    values = [1.5, None]
+    computed = metrics.Gauge(
+        "test_computed", "A computed gauge.", func=values.pop)
+    assert computed.render().splitlines()[2:] == []
+    assert computed.render().splitlines()[2:] == ["test_computed 1.5"]
+
+
+def test_histogram(registry):
+    """Histogram buckets are cumulative, with a sum and count."""
+    histogram = metrics.Histogram(
+        "test_seconds", "A test histogram.", buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 20):
+        histogram.observe(value)
+    assert histogram.totals() == (20.65, 4)
+    assert histogram.render().splitlines()[2:] == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 20.65",
+        "test_seconds_count 4"]
+
+
+def test_histogram_time(registry):
+    """The duration of a block is observed, even if it raises."""
+    histogram = metrics.Histogram(
+        "test_seconds", "A test histogram.", labels=("task",))
+    with pytest.raises(RuntimeError):
+        with histogram.time(task="fail"):
+            raise RuntimeError()
+    assert histogram.totals(task="fail")[1] == 1
+    assert histogram.totals(task="other") == (0, 0)
+    assert histogram.labelsets() == [{"task": "fail"}]
+
+
+def test_render_failure(registry):
+    """A metric which cannot be rendered does not prevent the others."""
+    def fail():
+        raise RuntimeError()
+    metrics.Gauge("test_failing", "A failing gauge.", func=fail)
+    counter = metrics.Counter("test_total", "A test counter.")
+    counter.inc()
+    text = metrics.render()
+    assert "test_failing" not in text
+    assert text.endswith("test_total 1\n")
+
+
+def test_server(registry):
+    """Metrics are served at /metrics, other paths are not found."""
+    metrics.Counter("test_total", "A test counter.").inc()
+    server = metrics.MetricsServer(0)
+    server.start()
+    try:
+        url = "http://127.0.0.1:{}".format(server.server.server_address[1])
+        response = requests.get(url + "/metrics", timeout=5)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain")
+        assert response.text == metrics.render()
+        assert requests.get(url + "/other", timeout=5).status_code == 404
+    finally:
+        server.stop()
+    assert server.server is None
@@ -0,0 +1,81 @@
+"""Tests of labslauncher.mounts."""
+import os
+
+import pytest
+
+from conftest import IMAGE
+from labslauncher import mounts
+
+
+def test_parse_empty():
+    """An empty specification has no mounts."""
+    assert mounts.parse("") == []
+    assert mounts.parse(" ; ;") == []
+
+
+def test_parse():
+    """Mounts are separated, with options as `docker run --mount`."""
+    spec = (
+        "source=/data/genomes,target=/references,readonly;\n"
+        " src=~/work, dst=/work, consistency=delegated ;"
+        "source=/tmp,destination=/tmp2,ro=false")
+    assert mounts.parse(spec) == [
+        mounts.Mount("/data/genomes", "/references", True, None),
+        mounts.Mount(
+            os.path.expanduser("~/work"), "/work", False, "delegated"),
+        mounts.Mount("/tmp", "/tmp2", False, None)]
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("source=/data", "requires a source and target"),
+    ("target=/data", "requires a source and target"),
+    ("source=/data,target=data", "not an absolute path"),
+    ("source=/data,target=/data,type=volume", "Unknown mount option"),
+    ("source=/data,target=/data,consistency=fast", "must be one of"),
+    ("source=/a,target=/data;source=/b,target=/data/",
+        "targets must be distinct")])
+def test_parse_invalid(spec, message):
+    """Invalid specifications are rejected with a reason."""
+    with pytest.raises(ValueError, match=message):
+        mounts.parse(spec)
+
+
+def test_docker_mounts():
+    """Mounts are converted to docker bind mounts."""
+    result = mounts.docker_mounts(
+        mounts.parse("source=/data,target=/references,readonly"))
+    assert result == [{
+        'Target': '/references', 'Source': '/data', 'Type': 'bind',
+        'ReadOnly': True}]
+    result = mounts.docker_mounts(
+        mounts.parse("source=/data,target=/work,consistency=cached"))
+    assert result[0]['Consistency'] == 'cached'
+
+
+@pytest.mark.parametrize("size, expected", [
+    (0, {}), (-1, {}), (512, {'/scratch/': 'size=512m,mode=1777'})])
+def test_scratch(size, expected):
+    """A scratch area is a tmpfs of the given size, if any."""
+    assert mounts.scratch('/scratch/', size) == expected
+
+
+def test_container_config(engine_factory, hub, client_factory):
+    """Extra mounts and the scratch area are given to the server."""
+    engine_factory(images=["{}:v0.1.9".format(IMAGE)])
+    client = client_factory()
+    kwargs, digest = client._container_config("/data", "token", 8888, 8889)
+    assert 'mounts' not in kwargs and 'tmpfs' not in kwargs
+
+    client.extra_mounts = "source=/references,target=/references,readonly"
+    client.scratch_size = 512
+    extra, extra_digest = client._container_config(
+        "/data", "token", 8888, 8889)
+    assert extra['mounts'] == mounts.docker_mounts(
+        mounts.parse(client.extra_mounts))
+    assert extra['tmpfs'] == {client.scratch_bind: 'size=512m,mode=1777'}
+    # a running server with other mounts is out of date
+    assert extra_digest != digest
+
+    client.extra_mounts = "source=/references"
+    with pytest.raises(ValueError):
+        client._container_config("/data", "token", 8888, 8889)
@@ -0,0 +1,110 @@
+"""Tests of the selection of images by platform in labslauncher.dockerutil."""
+import pytest
+
+from conftest import IMAGE
+from labslauncher import dockerutil
+
+
+GB = 1024 ** 3
+
+
+@pytest.mark.parametrize("arch, expected", [
+    ("x86_64", "amd64"), ("X86-64", "amd64"), ("aarch64", "arm64"),
+    ("armv7l", "arm"), ("i686", "386"), ("arm64", "arm64"),
+    ("ppc64le", "ppc64le")])
+def test_normalize_arch(arch, expected):
+    """Architectures are given their registry names."""
+    assert dockerutil.normalize_arch(arch) == expected
+
+
+def meta(*images, full_size=10 * GB):
+    """Return tag meta data, images are tuples (os, architecture, size)."""
+    return {
+        "name": "v0.1.9", "full_size": full_size,
+        "images": [
+            {"os": os, "architecture": arch, "size": size}
+            for os, arch, size in images]}
+
+
+def test_tag_architectures():
+    """Architectures are those of linux images."""
+    assert dockerutil.tag_architectures(meta(
+        ("linux", "amd64", GB), ("linux", "aarch64", GB),
+        ("windows", "386", GB))) == {"amd64", "arm64"}
+    assert dockerutil.tag_architectures(meta()) is None
+    assert dockerutil.tag_architectures({"name": "v0.1.9"}) is None
+
+
+def test_image_size():
+    """The size is that of the image, or of the tag if not available."""
+    data = meta(
+        ("linux", "amd64", 2 * GB), ("linux", "aarch64", 3 * GB),
+        ("windows", "arm", 4 * GB))
+    assert dockerutil.image_size(data, "amd64") == 2 * GB
+    assert dockerutil.image_size(data, "arm64") == 3 * GB
+    assert dockerutil.image_size(data, "arm") == 10 * GB
+    assert dockerutil.image_size(data) == 10 * GB
+    assert dockerutil.image_size(meta(), "amd64") == 10 * GB
+
+
+ARCHITECTURES = {
+    "v0.1.9": ["amd64"], "v0.1.8": ["amd64", "arm64"], "v0.1.7": []}
+
+
+def test_get_image_tags(hub_factory):
+    """Tags without an image for the architecture are excluded."""
+    hub_factory(tags=20, architectures=ARCHITECTURES)
+    tags = dockerutil.get_image_tags(IMAGE)
+    assert tags[:3] == ["v0.1.9", "v0.1.8", "v0.1.7"]
+    # tags of unknown architectures are included
+    assert dockerutil.get_image_tags(IMAGE, arch="arm64") == [
+        "v0.1.8", "v0.1.7"]
+    assert dockerutil.get_image_tags(IMAGE, arch="amd64") == tags
+
+
+def test_arch(engine_factory, hub, client_factory):
+    """The architecture is that of the daemon's host."""
+    engine_factory(arch="aarch64")
+    client = client_factory()
+    assert client.arch == "arm64"
+    assert client.platform == "linux/arm64"
+
+
+@pytest.mark.parametrize("host, architectures, expected", [
+    ("x86_64", ["amd64", "arm64"], ("amd64", False)),
+    ("aarch64", ["amd64", "arm64"], ("arm64", False)),
+    # the architectures of the tag are unknown
+    ("aarch64", [], ("arm64", False)),
+    ("aarch64", ["amd64", "arm"], ("amd64", True)),
+    ("x86_64", ["arm64", "arm", "ppc64le"], ("arm", True))])
+def test_pull_arch(
+        engine_factory, hub_factory, client_factory, host, architectures,
+        expected):
+    """Images for another architecture are run under emulation."""
+    engine_factory(arch=host)
+    hub_factory(tags=20, architectures={"v0.1.9": architectures})
+    client = client_factory()
+    assert client.pull_arch("v0.1.9") == expected
+
+
+def test_pull_arch_error(engine_factory, hub, client_factory):
+    """The native image is pulled if the tag cannot be retrieved."""
+    engine_factory(arch="aarch64")
+    client = client_factory()
+    assert client.pull_arch("v9.9.9") == ("arm64", False)
+    hub.stop()
+    dockerutil.clear_tag_cache()
+    assert client.pull_arch("v0.1.9") == ("arm64", False)
+
+
+def test_latest_tag(engine_factory, hub_factory, client_factory):
+    """The latest tag is that with a native image, if any."""
+    engine_factory(arch="aarch64")
+    hub = hub_factory(tags=20, architectures=ARCHITECTURES)
+    client = client_factory()
+    assert client.latest_tag == "v0.1.8"
+    hub.architectures = {
+        tag: ["amd64"] for tag in hub.tags if tag.startswith("v")}
+    dockerutil.clear_tag_cache()
+    assert client.latest_tag == "v0.1.9"
+    assert client.pull_arch("v0.1.9") == ("amd64", True)
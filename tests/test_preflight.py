@@ -0,0 +1,183 @@
+"""Tests of labslauncher.preflight, against a fake docker daemon."""
+import socket
+import time
+
+import docker
+import pytest
+
+from conftest import IMAGE
+from labslauncher import preflight
+from labslauncher.registry import PullBudget
+
+
+def free_ports(count=2):
+    """Return ports not in use on localhost."""
+    socks = list()
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        socks.append(sock)
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+    return ports
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """Record the volumes of containers run by the mount check."""
+    volumes = list()
+
+    def run(self, image, **kwargs):
+        volumes.append(kwargs['volumes'])
+        return b''
+    monkeypatch.setattr(
+        docker.models.containers.ContainerCollection, 'run', run)
+    return volumes
+
+
+@pytest.fixture
+def client(engine_factory, hub, client_factory):
+    """Return a client of a fake engine with the server image present."""
+    engine_factory(images=["{}:v0.1.9".format(IMAGE)])
+    return client_factory()
+
+
+def run(client, mount, **kwargs):
+    """Run the checks, returning results by name."""
+    results = preflight.Preflight(
+        client, str(mount), *free_ports(), **kwargs).run()
+    assert [x.name for x in results] == \
+        [name for name, _ in preflight.Preflight.checks]
+    return {x.name: x for x in results}
+
+
+def test_ready(client, probes, tmp_path):
+    """All checks pass when docker is ready to run the server."""
+    results = run(client, tmp_path)
+    for result in results.values():
+        assert result.level == preflight.OK, result
+    assert results["docker"].message == "Docker 19.03.8 on Fake OS."
+    assert results["image"].message == "Version v0.1.9 is present."
+    assert probes == [{str(tmp_path): {'bind': '/mnt/probe', 'mode': 'rw'}}]
+
+
+def test_extra_mounts(client, probes, tmp_path):
+    """Extra mounts are included in the probe, and must exist."""
+    data = tmp_path / "data"
+    data.mkdir()
+    client.extra_mounts = "source={},target=/data,readonly".format(tmp_path)
+    results = run(client, data)
+    assert results["mount"].level == preflight.OK
+    assert probes[0][str(tmp_path)] == {'bind': '/mnt/probe0', 'mode': 'ro'}
+
+    client.extra_mounts = "source={},target=/data".format(
+        tmp_path / "missing")
+    results = run(client, data)
+    assert results["mount"].level == preflight.ERROR
+    assert "does not exist" in results["mount"].message
+
+    client.extra_mounts = "source={},target=relative".format(tmp_path)
+    results = run(client, data)
+    assert results["mount"].level == preflight.ERROR
+    assert results["mount"].message.startswith("Extra mounts are invalid")
+
+
+def test_mount_missing(client, probes, tmp_path):
+    """The data folder must exist."""
+    results = run(client, tmp_path / "missing")
+    assert results["mount"].level == preflight.ERROR
+    assert probes == []
+
+
+def test_mount_not_shared(monkeypatch, client, tmp_path):
+    """Folders not shared with the docker VM are reported."""
+    def refuse(self, image, **kwargs):
+        raise docker.errors.APIError(
+            "Mounts denied: the path is not shared from the host")
+    monkeypatch.setattr(
+        docker.models.containers.ContainerCollection, 'run', refuse)
+    results = run(client, tmp_path)
+    assert results["mount"].level == preflight.ERROR
+    assert "File sharing" in results["mount"].message
+
+
+def test_docker_unavailable(monkeypatch, client, probes, tmp_path):
+    """Checks requiring docker are skipped if it is not available."""
+    def info():
+        raise docker.errors.APIError("Cannot connect to the daemon")
+    monkeypatch.setattr(client.docker, "info", info)
+    results = run(client, tmp_path)
+    assert results["docker"].level == preflight.ERROR
+    for name in ("image", "platform", "mount", "disk", "resources"):
+        assert results[name].level == preflight.SKIPPED, name
+    assert results["ports"].level == preflight.OK
+    assert probes == []
+
+
+@pytest.mark.parametrize("remaining, level", [
+    (None, preflight.WARNING), (0, preflight.ERROR)])
+def test_image_missing(
+        monkeypatch, engine_factory, hub, client_factory, probes, tmp_path,
+        remaining, level):
+    """An image to download is a warning, unless it cannot be pulled."""
+    engine_factory()
+    client = client_factory()
+    budget = PullBudget()
+    if remaining is not None:
+        budget.update({'RateLimit-Remaining': str(remaining)})
+    monkeypatch.setattr(client, "pull_budget", lambda: budget)
+    monkeypatch.setattr(client, "pull_size", lambda: (2 * 1024 ** 3, 0))
+    results = run(client, tmp_path)
+    assert results["image"].level == level
+    if level == preflight.WARNING:
+        assert results["image"].message.endswith("2.0Gb.")
+    else:
+        assert "pull limit" in results["image"].message
+    # the platform is that of the tag to be pulled
+    assert results["platform"].level == preflight.OK
+    assert results["mount"].level == preflight.SKIPPED
+    assert probes == []
+
+
+def test_ports_in_use(client, probes, tmp_path):
+    """Ports used by another program are an error."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        results = preflight.Preflight(
+            client, str(tmp_path), port, free_ports(1)[0]).run()
+    result = results[3]
+    assert result.name == "ports"
+    assert result.level == preflight.ERROR
+    assert str(port) in result.message
+
+
+def test_scratch_size(client, probes, tmp_path):
+    """A scratch area of more than half of docker's memory is a warning."""
+    client.scratch_size = 5 * 1024
+    results = run(client, tmp_path)
+    assert results["resources"].level == preflight.WARNING
+    assert "scratch area" in results["resources"].message
+
+
+def test_timeout(monkeypatch, client, probes, tmp_path):
+    """Checks not completed in time are skipped."""
+    def slow(self):
+        time.sleep(2)
+    monkeypatch.setattr(preflight.Preflight, "check_resources", slow)
+    start = time.monotonic()
+    results = run(client, tmp_path, timeout=0.5)
+    assert time.monotonic() - start < 2
+    assert results["resources"].level == preflight.SKIPPED
+    assert results["docker"].level == preflight.OK
+
+
+def test_check_error(monkeypatch, client, probes, tmp_path):
+    """Unexpected errors of a check are reported as an error."""
+    def fail(self):
+        raise RuntimeError("unexpected")
+    monkeypatch.setattr(preflight.Preflight, "check_disk", fail)
+    results = run(client, tmp_path)
+    assert results["disk"].level == preflight.ERROR
+    assert results["disk"].message == "Check failed: unexpected"
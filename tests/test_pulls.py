@@ -0,0 +1,183 @@
+"""Tests of labslauncher.pulls."""
+import threading
+
+from PyQt5.QtCore import QThreadPool
+import pytest
+
+from conftest import IMAGE, wait_for
+from labslauncher import pulls
+from labslauncher.registry import RateLimited
+
+
+class FakeClient():
+    """Pull images, holding pulls until released and failing as told."""
+
+    image_name = IMAGE
+    total_size = 1024
+
+    def __init__(self):
+        """Initialize the client."""
+        self.pulled = list()
+        self.failures = dict()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def pull_image(self, tag, progress=None, stopped=None):
+        """Pull a tag, see `dockerutil.DockerClient.pull_image`."""
+        self.pulled.append(tag)
+        progress.emit(50.0)
+        while not self.gate.wait(0.01):
+            if stopped.is_set():
+                return None
+        errors = self.failures.get(tag, [])
+        if len(errors) > 0:
+            raise errors.pop(0)
+        return "image {}".format(tag)
+
+
+@pytest.fixture
+def client():
+    """Return a fake client, its pulls are held until released."""
+    client = FakeClient()
+    client.gate.clear()
+    yield client
+    client.gate.set()
+
+
+@pytest.fixture
+def manager(qapp, client):
+    """Return a pull manager of the fake client."""
+    pool = QThreadPool()
+    manager = pulls.PullManager(client, pool, retries=2, backoff=0.01)
+    yield manager
+    manager.cancel_all()
+    client.gate.set()
+    pool.waitForDone()
+
+
+def test_pull(manager, client):
+    """A pull reports its progress and result."""
+    client.gate.set()
+    job = manager.request("v0.1.9")
+    results, progress = list(), list()
+    job.result.connect(results.append)
+    job.progress.connect(progress.append)
+    wait_for(lambda: not job.active)
+    assert job.state == pulls.DONE
+    assert results == ["image v0.1.9"]
+    assert progress == [50.0]
+    assert job.size == client.total_size
+    assert job.throughput > 0
+    assert manager.jobs() == [job]
+    assert manager._jobs == dict()
+
+
+def test_dedup(manager, client):
+    """Requests of a tag share a job, the tag is pulled once."""
+    first = manager.request("v0.1.9")
+    second = manager.request("v0.1.9")
+    assert second is first
+    assert first.requesters == 2
+    client.gate.set()
+    wait_for(lambda: not first.active)
+    assert client.pulled == ["v0.1.9"]
+    # a finished pull is requested anew
+    third = manager.request("v0.1.9")
+    assert third is not first
+    wait_for(lambda: not third.active)
+    assert client.pulled == ["v0.1.9", "v0.1.9"]
+
+
+def test_priority(manager, client):
+    """Queued pulls run in order of priority, then of request."""
+    running = manager.request("v0.1.0", pulls.LOW)
+    wait_for(lambda: client.pulled == ["v0.1.0"])
+    low = manager.request("v0.1.1", pulls.LOW)
+    normal = manager.request("v0.1.2")
+    high = manager.request("v0.1.3", pulls.HIGH)
+    assert manager.queued == [high, normal, low]
+    # a request at a higher priority raises that of the queued job
+    assert manager.request("v0.1.1", pulls.HIGH) is low
+    assert manager.queued == [high, low, normal]
+    assert manager.jobs() == [running, high, low, normal]
+    client.gate.set()
+    wait_for(lambda: not normal.active)
+    assert client.pulled == ["v0.1.0", "v0.1.3", "v0.1.1", "v0.1.2"]
+
+
+def test_retry(manager, client):
+    """Failed pulls are retried, until the retries are exhausted."""
+    client.gate.set()
+    client.failures["v0.1.9"] = [IOError("reset")]
+    job = manager.request("v0.1.9")
+    wait_for(lambda: not job.active)
+    assert job.state == pulls.DONE
+    assert job.attempts == 2
+
+    client.failures["v0.2.0"] = [IOError("reset")] * 3
+    errors = list()
+    job = manager.request("v0.2.0")
+    job.error.connect(errors.append)
+    wait_for(lambda: not job.active)
+    assert job.state == pulls.FAILED
+    assert job.attempts == 3
+    assert len(errors) == 1 and isinstance(errors[0][1], IOError)
+    assert job.summary()["error"] == "reset"
+
+
+def test_rate_limited(manager, client):
+    """Pulls refused due to the rate limit are not retried."""
+    client.gate.set()
+    client.failures["v0.1.9"] = [RateLimited("limit reached")]
+    job = manager.request("v0.1.9")
+    wait_for(lambda: not job.active)
+    assert job.state == pulls.FAILED
+    assert job.attempts == 1
+
+
+def test_release(manager, client):
+    """A shared job is cancelled once all requesters release it."""
+    job = manager.request("v0.1.9")
+    manager.request("v0.1.9")
+    wait_for(lambda: job.state == pulls.RUNNING)
+    job.release()
+    assert job.state == pulls.RUNNING
+    job.release()
+    assert job.state == pulls.CANCELLED
+    # the job finishes with its worker, which is stopped
+    wait_for(lambda: job.ended is not None)
+    assert job.state == pulls.CANCELLED
+    assert manager.current is None
+
+
+def test_cancel_queued(manager, client):
+    """Cancelled queued jobs are not run."""
+    running = manager.request("v0.1.0")
+    queued = manager.request("v0.1.1")
+    finished = list()
+    queued.finished.connect(lambda: finished.append(True))
+    queued.cancel()
+    assert finished == [True]
+    assert manager.queued == []
+    client.gate.set()
+    wait_for(lambda: not running.active)
+    assert client.pulled == ["v0.1.0"]
+
+
+def test_pull_engine(monkeypatch, engine_factory, hub, client_factory):
+    """An image is pulled from the docker daemon."""
+    engine = engine_factory(pull_layers=2, pull_steps=5, layer_size=1024)
+    client = client_factory()
+    monkeypatch.setattr(
+        client, "pull_size", lambda tag, arch: (2048, 2048))
+    pool = QThreadPool()
+    manager = pulls.PullManager(client, pool)
+    pulled = list()
+    manager.pulled.connect(pulled.append)
+    job = manager.request("v0.1.9")
+    wait_for(lambda: not job.active)
+    pool.waitForDone()
+    assert job.state == pulls.DONE, job.last_error
+    assert "{}:v0.1.9".format(IMAGE) in engine.images
+    assert len(pulled) == 1
+    assert job.size == 2048
@@ -0,0 +1,180 @@
+"""Tests of labslauncher.registry, against a fake registry."""
+import pytest
+
+from fakes import FakeRegistry
+from labslauncher import metrics, registry
+
+
+REPOSITORY = "ontresearch/nanolabs-notebook"
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("100", (100, None)),
+    ("100;w=21600", (100, 21600)),
+    ("0;w=21600", (0, 21600)),
+    (" 76 ; w=3600 ", (76, 3600)),
+    ("100;w=21600;comment=\"ip\"", (100, 21600))])
+def test_parse_limit(value, expected):
+    """The count and window of a limit are parsed."""
+    assert registry.parse_limit(value) == expected
+
+
+@pytest.mark.parametrize("error, expected", [
+    ("toomanyrequests: You have reached your pull rate limit.", True),
+    (IOError("Pull Rate Limit exceeded"), True),
+    ("manifest unknown", False)])
+def test_is_limit_error(error, expected):
+    """Errors of refused pulls are recognised."""
+    assert registry.is_limit_error(error) == expected
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (0, "1min"), (89, "1min"), (3599, "1h"), (3600, "1h"),
+    (21600, "6h"), (7500, "2h 5min")])
+def test_format_wait(seconds, expected):
+    """Waits are given in hours and minutes."""
+    assert registry.format_wait(seconds) == expected
+
+
+def test_budget_unknown():
+    """The budget is unknown until reported."""
+    budget = registry.PullBudget()
+    assert not budget.update({})
+    assert budget.remaining() is None
+    assert budget.retry_after() is None
+    assert budget.describe() == "Pull limit: unknown"
+
+
+def test_budget_window():
+    """A reported budget expires at the end of its window."""
+    budget = registry.PullBudget()
+    assert budget.update({
+        'RateLimit-Limit': '100;w=21600',
+        'RateLimit-Remaining': '76;w=21600'}, now=1000)
+    assert (budget.limit, budget.window) == (100, 21600)
+    assert budget.remaining(now=1000) == 76
+    assert budget.remaining(now=1000 + 21599) == 76
+    assert budget.remaining(now=1000 + 21600) is None
+    budget.consume(80)
+    assert budget.remaining(now=1000) == 0
+
+
+def test_budget_reset():
+    """A reported reset time takes precedence over the window."""
+    budget = registry.PullBudget()
+    budget.update({
+        'RateLimit-Remaining': '0;w=21600', 'RateLimit-Reset': '60'},
+        now=1000)
+    assert budget.remaining(now=1059) == 0
+    assert budget.retry_after(now=1030) == 30
+    assert budget.remaining(now=1060) is None
+    assert budget.retry_after(now=1060) is None
+    # a budget reset as it is reported is unknown
+    budget.update({
+        'RateLimit-Remaining': '5', 'RateLimit-Reset': '0'}, now=2000)
+    assert budget.remaining(now=2000) is None
+
+
+def test_budget_exhaust():
+    """A refused request exhausts the budget until the retry time."""
+    budget = registry.PullBudget()
+    budget.exhaust(now=1000)
+    assert budget.remaining(now=1000) == 0
+    assert budget.retry_after(now=1000) == registry.HOLDOFF
+    budget.exhaust(retry_after=120, now=1000)
+    assert budget.retry_after(now=1060) == 60
+    assert budget.remaining(now=1120) is None
+
+
+def test_budget_describe():
+    """The budget is described in words."""
+    budget = registry.PullBudget()
+    budget.update({
+        'RateLimit-Limit': '100;w=21600', 'RateLimit-Remaining': '76'})
+    assert budget.describe() == \
+        "Pull limit: 76 of 100 remaining per 6h"
+    budget.exhaust(retry_after=3600)
+    assert budget.describe().startswith("Pull limit reached, retry after")
+
+
+def test_check():
+    """Informational requests are refused within the reserve."""
+    client = registry.RegistryClient("http://localhost", reserve=10)
+    client.check(essential=False)
+    client.budget.update({'RateLimit-Remaining': '11'})
+    client.check(essential=False)
+    client.budget.consume()
+    with pytest.raises(registry.RateLimited) as error:
+        client.check(essential=False)
+    assert error.value.retry_after is None
+    client.check()
+    client.budget.exhaust(retry_after=120)
+    with pytest.raises(registry.RateLimited) as error:
+        client.check()
+    assert 0 < error.value.retry_after <= 120
+
+
+def test_refused():
+    """A pull refused by docker exhausts the budget."""
+    client = registry.RegistryClient("http://localhost")
+    error = client.refused("toomanyrequests: rate limit")
+    assert isinstance(error, registry.RateLimited)
+    assert error.retry_after == pytest.approx(registry.HOLDOFF, abs=1)
+    assert client.budget.remaining() == 0
+
+
+@pytest.fixture
+def fake_registry():
+    """Start a fake registry."""
+    with FakeRegistry(limit=12, window=21600) as fake:
+        yield fake
+
+
+def test_request(fake_registry):
+    """Tokens are requested once, HEAD requests do not count."""
+    client = registry.RegistryClient(fake_registry.base_url, reserve=10)
+    budget = client.refresh(REPOSITORY, "v0.1.9")
+    assert budget.remaining() == 12
+    assert budget.limit == 12 and budget.window == 21600
+    assert metrics.REGISTRY_PULLS_REMAINING.value(
+        registry=fake_registry.base_url) == 12
+    client.get("/manifests/v0.1.9", REPOSITORY)
+    assert client.budget.remaining() == 11
+    client.get("/manifests/v0.1.9", REPOSITORY, essential=False)
+    assert client.budget.remaining() == 10
+    assert fake_registry.tokens == 1
+    # the reserve is kept for pulls
+    with pytest.raises(registry.RateLimited):
+        client.get("/manifests/v0.1.9", REPOSITORY, essential=False)
+    assert fake_registry.remaining == 10
+
+
+def test_request_limited(fake_registry):
+    """A request refused with status 429 exhausts the budget."""
+    client = registry.RegistryClient(fake_registry.base_url, reserve=0)
+    client.refresh(REPOSITORY)
+    # the budget of other computers behind the same address is shared
+    fake_registry.remaining = 0
+    client.budget.update({'RateLimit-Remaining': '3'})
+    with pytest.raises(registry.RateLimited) as error:
+        client.get("/manifests/latest", REPOSITORY)
+    assert error.value.retry_after is not None
+    assert client.budget.remaining() == 0
+    assert metrics.REGISTRY_PULLS_REMAINING.value(
+        registry=fake_registry.base_url) == 0
+    # further requests are not made
+    requests = fake_registry.requests
+    with pytest.raises(registry.RateLimited):
+        client.get("/manifests/latest", REPOSITORY)
+    assert fake_registry.requests == requests
+
+
+def test_request_reset(fake_registry):
+    """A budget reported as already reset is not recorded as a metric."""
+    fake_registry.reset = 0
+    client = registry.RegistryClient(fake_registry.base_url)
+    client.refresh(REPOSITORY)
+    assert client.budget.remaining() is None
+    assert {"registry": fake_registry.base_url} not in \
+        metrics.REGISTRY_PULLS_REMAINING.labelsets()
+    assert "None" not in metrics.render()
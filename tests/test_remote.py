@@ -0,0 +1,84 @@
+"""Tests of labslauncher.remote, using a second docker daemon over tcp."""
+import pytest
+
+from conftest import IMAGE
+from labslauncher import dockerapi, preflight, remote
+
+
+@pytest.mark.parametrize("base_url, expected", [
+    (None, None),
+    ("unix:///var/run/docker.sock", None),
+    ("tcp://127.0.0.1:2375", None),
+    ("tcp://localhost:2376", None),
+    ("tcp://server:2376", "server"),
+    ("ssh://user@server", "server"),
+    ("ssh://user@server:2222", "server")])
+def test_host_name(base_url, expected):
+    """Only hosts other than this computer are remote."""
+    assert remote.host_name(base_url) == expected
+
+
+@pytest.mark.parametrize("base_url, expected", [
+    ("ssh://user@server", ["user@server"]),
+    ("ssh://user@server:2222", ["-p", "2222", "user@server"]),
+    # the docker port is not that of ssh
+    ("tcp://server:2376", ["server"])])
+def test_ssh_destination(base_url, expected):
+    """The user and port of ssh hosts are used."""
+    assert remote.ssh_destination(base_url) == expected
+
+
+@pytest.mark.parametrize("base_url, mode, expected", [
+    ("ssh://user@server", remote.AUTO, True),
+    ("tcp://server:2376", remote.AUTO, False),
+    ("tcp://server:2376", remote.ALWAYS, True),
+    ("ssh://user@server", remote.NEVER, False)])
+def test_use_tunnel(base_url, mode, expected):
+    """Ports are forwarded from tcp hosts only when requested."""
+    assert remote.use_tunnel(base_url, mode) == expected
+
+
+@pytest.fixture
+def remote_client(monkeypatch, engine_factory, hub, client_factory):
+    """Return a client of a fake engine on tcp, treated as remote."""
+    monkeypatch.setattr(remote, "LOCAL_NAMES", ())
+    engine = engine_factory(
+        tcp=True, images=["{}:v0.1.9".format(IMAGE)])
+    # the environment does not select the host
+    monkeypatch.delenv("DOCKER_HOST")
+    client = client_factory(
+        connection=dockerapi.SharedClient(host=engine.base_url))
+    remote.configure(client, engine.base_url)
+    yield client
+    client.connection.close()
+
+
+def test_configure_tcp(remote_client):
+    """A tcp host is used directly, its ports are not forwarded."""
+    assert remote_client.remote_host == "127.0.0.1"
+    assert remote_client.tunnel is None
+    assert remote_client.server_host == "127.0.0.1"
+    assert remote_client.container is not None
+
+
+def test_configure_ssh(client_factory, engine_factory, hub):
+    """Ports of an ssh host are forwarded."""
+    engine_factory()
+    client = client_factory()
+    tunnel = remote.configure(client, "ssh://user@server")
+    assert client.remote_host == "server"
+    assert tunnel is client.tunnel is not None
+    # the server is reached through the tunnel
+    assert client.server_host is None
+
+
+def test_preflight_remote(remote_client):
+    """Local checks are skipped for a remote host."""
+    results = {
+        x.name: x for x in
+        preflight.Preflight(remote_client, "/nonexistent", 8888, 8889).run()}
+    assert results["docker"].level == preflight.OK
+    assert results["image"].level == preflight.OK
+    assert results["disk"].level == preflight.SKIPPED
+    # only reachable from the remote host itself
+    assert results["ports"].level == preflight.WARNING
@@ -0,0 +1,107 @@
+"""Tests of labslauncher.qtext.Settings."""
+import argparse
+
+from PyQt5.QtCore import QSettings
+import pytest
+
+import labslauncher
+from labslauncher.qtext import Settings
+
+
+@pytest.fixture
+def settings_factory(qapp, tmp_path):
+    """Return a function creating settings stored in a temporary file.
+
+    The function takes values to store before the settings are created.
+    """
+    path = str(tmp_path / "settings.ini")
+
+    class TempSettings(Settings):
+        _qsettings_args = (path, QSettings.IniFormat)
+
+    def factory(**stored):
+        qsettings = QSettings(path, QSettings.IniFormat)
+        for key, value in stored.items():
+            qsettings.setValue(key, value)
+        qsettings.sync()
+        return TempSettings(labslauncher.Defaults())
+
+    return factory
+
+
+def test_defaults(settings_factory):
+    """Unset values take their defaults, which are written back."""
+    settings = settings_factory()
+    defaults = labslauncher.Defaults()
+    assert settings["port"] == defaults["port"]
+    assert settings["docker_restrict"] is True
+    stored = QSettings(*settings._qsettings_args)
+    assert stored.contains("port")
+
+
+@pytest.mark.parametrize("stored, expected", [
+    ("true", True), ("True", True), ("1", True),
+    ("false", False), ("0", False), ("", False)])
+def test_stored_bool(settings_factory, stored, expected):
+    """Booleans stored as strings are converted."""
+    settings = settings_factory(auto_prune=stored)
+    assert settings["auto_prune"] is expected
+
+
+def test_stored_invalid(settings_factory):
+    """Values which cannot be converted are replaced by the default."""
+    settings = settings_factory(port="not a port", keep_images="3")
+    assert settings["port"] == 8888
+    assert settings["keep_images"] == 3
+
+
+def test_set_converts(settings_factory):
+    """Set values are converted to the type of the setting."""
+    settings = settings_factory()
+    settings["auto_prune"] = "true"
+    assert settings["auto_prune"] is True
+    settings["auto_prune"] = "false"
+    assert settings["auto_prune"] is False
+    settings["port"] = "9000"
+    assert settings["port"] == 9000
+    with pytest.raises(ValueError):
+        settings["port"] = "not a port"
+    assert settings["port"] == 9000
+
+
+def test_set_changed(settings_factory):
+    """A change is signalled only if the value differs."""
+    settings = settings_factory()
+    changes = list()
+    settings.changed.connect(lambda key, value: changes.append((key, value)))
+    settings["auto_prune"] = "false"
+    settings["auto_prune"] = True
+    settings["auto_prune"] = "1"
+    assert changes == [("auto_prune", True)]
+
+
+def test_set_written_back(settings_factory):
+    """Changes are written to QSettings on sync."""
+    settings = settings_factory()
+    settings["auto_prune"] = True
+    settings.sync()
+    reloaded = settings_factory()
+    assert reloaded["auto_prune"] is True
+
+
+def test_override_bool(settings_factory):
+    """Boolean command line overrides, given as integers, are converted."""
+    settings = settings_factory(auto_prune="true")
+    args, _ = settings.parser.parse_known_args(["--auto_prune", "0"])
+    settings.override(args)
+    assert settings["auto_prune"] is False
+    settings.clear_override()
+    assert settings["auto_prune"] is True
+
+
+def test_override_unset(settings_factory):
+    """Settings not given on the command line are not overridden."""
+    settings = settings_factory(port="9000")
+    settings.override(argparse.Namespace(**{
+        item["key"]: None for item in settings.spec}))
+    assert settings["port"] == 9000
@@ -0,0 +1,108 @@
+"""Tests of labslauncher.state, and of clients created from a state."""
+import json
+
+import pytest
+
+from conftest import IMAGE
+from labslauncher import state
+
+
+SERVER = "Epi2Me-Labs-Server"
+STATE = {
+    'container_id': "0123abcd", 'status': "running", 'tag': "v0.1.9",
+    'latest_tag': "v0.2.0", 'update_available': True,
+    'address': "http://127.0.0.1:8888"}
+
+
+@pytest.fixture
+def fname(tmp_path):
+    """Return the path of a state file, within a missing folder."""
+    return str(tmp_path / "logs" / "state.json")
+
+
+def test_round_trip(fname):
+    """A saved state is loaded for the same image and container."""
+    assert state.load(IMAGE, SERVER, fname=fname) is None
+    state.save(dict(STATE, other="ignored"), IMAGE, SERVER, fname=fname)
+    loaded = state.load(IMAGE, SERVER, fname=fname)
+    assert {k: loaded[k] for k in state.FIELDS} == STATE
+    assert 'other' not in loaded
+    assert loaded['saved'] > 0
+
+
+@pytest.mark.parametrize("image_name, server_name", [
+    ("ontresearch/other", SERVER), (IMAGE, "Other-Server")])
+def test_other_configuration(fname, image_name, server_name):
+    """A state saved for another image or container is not loaded."""
+    state.save(STATE, IMAGE, SERVER, fname=fname)
+    assert state.load(image_name, server_name, fname=fname) is None
+
+
+def test_missing_field(fname):
+    """A state lacking a field, e.g. from an old version, is ignored."""
+    state.save(STATE, IMAGE, SERVER, fname=fname)
+    with open(fname, 'r') as fh:
+        data = json.load(fh)
+    del data['address']
+    with open(fname, 'w') as fh:
+        json.dump(data, fh)
+    assert state.load(IMAGE, SERVER, fname=fname) is None
+
+
+def test_corrupt(fname):
+    """An unreadable state is ignored."""
+    state.save(STATE, IMAGE, SERVER, fname=fname)
+    with open(fname, 'w') as fh:
+        fh.write('{"container_id": ')
+    assert state.load(IMAGE, SERVER, fname=fname) is None
+
+
+def test_save_failure(tmp_path):
+    """A failure to save is logged, the previous state is kept."""
+    fname = str(tmp_path / "state.json")
+    state.save(STATE, IMAGE, SERVER, fname=fname)
+    # a folder in place of the temporary file
+    (tmp_path / "state.json.tmp").mkdir()
+    state.save(dict(STATE, status="exited"), IMAGE, SERVER, fname=fname)
+    assert state.load(IMAGE, SERVER, fname=fname)['status'] == "running"
+
+
+def test_save_replaces(fname):
+    """The state is replaced, without leaving a temporary file."""
+    state.save(STATE, IMAGE, SERVER, fname=fname)
+    state.save(dict(STATE, status="exited"), IMAGE, SERVER, fname=fname)
+    assert state.load(IMAGE, SERVER, fname=fname)['status'] == "exited"
+    with pytest.raises(FileNotFoundError):
+        open("{}.tmp".format(fname))
+
+
+def test_client_stale(engine_factory, hub, client_factory):
+    """A client created from a state is stale until reconciled."""
+    engine_factory(images=["{}:v0.1.9".format(IMAGE)])
+    saved = dict(STATE, tag="v0.1.5", status="exited")
+    client = client_factory(state=saved)
+    assert client.stale.value
+    assert client.tag.value == "v0.1.5"
+    assert client.status.value[1] == "exited"
+    assert client.update_available is True
+    assert client.state() == {
+        k: saved[k] for k in state.FIELDS if k != 'address'}
+
+    client.reconcile()
+    assert not client.stale.value
+    assert client.tag.value == "v0.1.9"
+    assert client.status.value[1] == "running"
+
+
+def test_client_reconcile_unavailable(
+        monkeypatch, engine_factory, hub, client_factory):
+    """A saved state which cannot be confirmed becomes unknown."""
+    engine = engine_factory()
+    client = client_factory(state=STATE)
+    engine.stop()
+    # not to be stopped again by the fixture
+    monkeypatch.setattr(engine, "stop", lambda: None)
+    client.reconcile()
+    assert not client.stale.value
+    assert client.tag.value == "unknown"
+    assert client.status.value[1] == "unknown"
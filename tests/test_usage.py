@@ -0,0 +1,210 @@
+"""Tests of labslauncher.usage."""
+import sqlite3
+import time
+
+from PyQt5.QtCore import QThreadPool
+import pytest
+
+from conftest import wait_for
+from labslauncher import usage
+
+
+def stats(cpu_ns=2 * 10 ** 9, mem=600, **kwargs):
+    """Return a statistics sample, as the docker API."""
+    data = {
+        "read": "2020-10-19T10:15:20.123456789Z",
+        "cpu_stats": {"cpu_usage": {"total_usage": cpu_ns}},
+        "memory_stats": {
+            "usage": mem, "limit": 8000,
+            "stats": {"total_inactive_file": 100}},
+        "blkio_stats": {"io_service_bytes_recursive": [
+            {"major": 8, "minor": 0, "op": "Read", "value": 10},
+            {"major": 8, "minor": 0, "op": "Write", "value": 20},
+            {"major": 8, "minor": 16, "op": "Read", "value": 5},
+            {"major": 8, "minor": 0, "op": "Total", "value": 35}]},
+        "networks": {
+            "eth0": {"rx_bytes": 100, "tx_bytes": 50},
+            "eth1": {"rx_bytes": 1, "tx_bytes": 2}}}
+    data.update(kwargs)
+    return data
+
+
+def test_parse_stats():
+    """Counters are summed over devices, the page cache is excluded."""
+    assert usage.parse_stats(stats()) == dict(
+        cpu_ns=2 * 10 ** 9, mem=500, mem_limit=8000,
+        blk_read=15, blk_write=20, net_rx=101, net_tx=52)
+
+
+def test_parse_stats_cgroup_v2():
+    """The page cache of cgroups v2 is excluded."""
+    values = usage.parse_stats(stats(memory_stats={
+        "usage": 600, "stats": {"inactive_file": 200}}))
+    assert values['mem'] == 400
+    assert values['mem_limit'] is None
+
+
+def test_parse_stats_empty():
+    """Missing, or null, block and network statistics are zero."""
+    values = usage.parse_stats(stats(
+        blkio_stats={"io_service_bytes_recursive": None}, networks=None))
+    assert [values[x] for x in usage.COUNTERS[1:]] == [0, 0, 0, 0]
+    values = usage.parse_stats(stats(blkio_stats={}))
+    assert values['blk_read'] == 0
+
+
+@pytest.mark.parametrize("data", [
+    {"read": "0001-01-01T00:00:00Z", "cpu_stats": {}, "memory_stats": {}},
+    {"cpu_stats": {"cpu_usage": {"total_usage": 0}}, "memory_stats": {}},
+    {}])
+def test_parse_stats_stopped(data):
+    """Statistics of a stopped container have no values."""
+    assert usage.parse_stats(data) is None
+
+
+def test_parse_time():
+    """Docker timestamps are parsed to the second, as UTC."""
+    assert usage.parse_time("2020-10-19T10:15:20.123456789Z") == 1603102520
+    assert usage.parse_time("1970-01-01T00:00:00Z") == 0
+
+
+SESSION = {
+    'id': "0123abcd-start", 'container_id': "0123abcd",
+    'image': "ontresearch/nanolabs-notebook", 'tag': "v0.1.9"}
+
+
+def sample(t, **kwargs):
+    """Return a stored sample at a time."""
+    data = dict(
+        time=t, cpu=0.5, mem=500, mem_limit=8000, cpu_seconds=t / 10,
+        blk_read=10, blk_write=20, net_rx=30, net_tx=40)
+    data.update(kwargs)
+    return data
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Return a store writing without delay."""
+    store = usage.UsageStore(
+        fname=str(tmp_path / "usage" / "usage.sqlite"), batch_delay=0)
+    yield store
+    store.close()
+
+
+def test_store(store):
+    """Samples are stored, and summarised by session."""
+    now = time.time()
+    session = dict(SESSION, started=now - 120)
+    store.record(session, sample(now - 60, cpu=2.0))
+    store.record(session, sample(now, mem=700, blk_read=15))
+    store.close()
+    assert [x['time'] for x in store.samples(session['id'])] == \
+        [now - 60, now]
+    [stored] = store.sessions()
+    assert stored['samples'] == 2
+    assert stored['ended'] - stored['started'] == pytest.approx(120)
+    assert stored['cpu_peak'] == 2.0
+    assert stored['mem_peak'] == 700
+    assert stored['blk_read'] == 15
+    assert stored['cpu_seconds'] == pytest.approx(now / 10)
+    summary = store.summary()
+    assert summary['sessions'] == 1
+    assert summary['mem_max'] == summary['mem_p95'] == 700
+
+
+def test_store_repeated(store):
+    """A repeated sample is stored once."""
+    now = time.time()
+    session = dict(SESSION, started=now - 120)
+    for _ in range(3):
+        store.record(session, sample(now))
+    store.close()
+    assert len(store.samples(session['id'])) == 1
+    assert store.sessions()[0]['samples'] == 1
+
+
+def test_store_prune(tmp_path):
+    """Usage older than the retention period is removed on opening."""
+    fname = str(tmp_path / "usage.sqlite")
+    now = time.time()
+    store = usage.UsageStore(fname=fname, batch_delay=0)
+    store.record(dict(SESSION, started=now - 3 * 86400),
+                 sample(now - 2 * 86400))
+    store.record(dict(SESSION, id="recent", started=now), sample(now))
+    store.close()
+    assert len(store.sessions()) == 2
+    store = usage.UsageStore(fname=fname, retention=1, batch_delay=0)
+    store.close()
+    assert [x['id'] for x in store.sessions()] == ["recent"]
+    assert store.samples(SESSION['id']) == []
+
+
+def test_store_migrate(tmp_path):
+    """Repeated samples of an existing database are removed."""
+    fname = str(tmp_path / "usage.sqlite")
+    now = time.time()
+    conn = sqlite3.connect(fname)
+    conn.executescript(usage.SCHEMA.replace(
+        "CREATE UNIQUE INDEX IF NOT EXISTS samples_key "
+        "ON samples (session_id, time);",
+        "CREATE INDEX samples_session ON samples (session_id);"))
+    with conn:
+        conn.executemany(
+            'INSERT INTO samples VALUES (?, ?, 0.5, 500, 0, 0, 0, 0)',
+            [(SESSION['id'], now), (SESSION['id'], now),
+             (SESSION['id'], now + 60)])
+    conn.close()
+    store = usage.UsageStore(fname=fname, batch_delay=0)
+    store.close()
+    assert [x['time'] for x in store.samples(SESSION['id'])] == \
+        [now, now + 60]
+
+
+def test_store_missing(tmp_path):
+    """Queries of a database not yet created are empty."""
+    store = usage.UsageStore.__new__(usage.UsageStore)
+    store.fname = str(tmp_path / "usage.sqlite")
+    assert store.sessions() == []
+    assert store.samples(SESSION['id']) == []
+    assert store.summary()['sessions'] == 0
+
+
+class FakeStore():
+    """Collect recorded samples."""
+
+    def __init__(self):
+        """Initialize the store."""
+        self.recorded = list()
+
+    def record(self, session, sample):
+        """Record a sample."""
+        self.recorded.append((session, sample))
+
+
+def test_recorder(engine_factory, hub, client_factory):
+    """Samples of the server are combined over each interval."""
+    engine_factory()
+    client = client_factory()
+    store = FakeStore()
+    pool = QThreadPool()
+    recorder = usage.UsageRecorder(client, pool, store, interval=3600)
+    recorder.add(stats())
+    assert recorder._window is None
+    recorder.start()
+    # the first sample is polled on starting
+    wait_for(lambda: recorder._window is not None)
+    pool.waitForDone()
+    assert recorder.session['started'] == 1603102520
+    recorder.add(stats(cpu_ns=10 ** 9, mem=300))
+    recorder.add(stats(cpu_ns=3 * 10 ** 9, mem=1000))
+    recorder.add({"read": "0001-01-01T00:00:00Z"})
+    assert store.recorded == []
+    recorder.stop(final_stats=stats(cpu_ns=4 * 10 ** 9, mem=400))
+    assert not recorder.active
+    [(session, recorded)] = store.recorded
+    assert session['container_id'] == client.container.id
+    # the peak memory, that of the fake daemon's sample
+    assert recorded['mem'] == 1024
+    assert recorded['cpu_seconds'] == 4
+    assert recorded['cpu'] > 0
+    assert recorded['net_rx'] == 101